@@ -0,0 +1,168 @@
+import hashlib
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+
+class MessagesStub:
+    """
+    A local stand-in for the Messages endpoint (POST /v1/messages) and the
+    Message Batches endpoints (/v1/messages/batches), for tests.
+
+    Point a client at it with `anthropic.Anthropic(base_url=stub.url, api_key='test')`.
+    Replies come from `respond(request)`, which returns the reply's text or a
+    content block such as a tool_use block (by default Resume A wins). Every
+    request body is kept in `requests`.
+
+    Prompt caching is simulated: the content up to a block with a `cache_control`
+    marker is cached the first time it is seen, and later requests that start with
+    it report those tokens as `cache_read_input_tokens`. Tokens are rough estimates
+    (4 characters of text or 100 characters of base64 image data per token), and
+    there is no minimum cacheable length and no expiry.
+
+    A batch reports 'in_progress' for its first `polls_until_ended` retrievals
+    and then 'ended'; its requests are answered when it is submitted.
+    """
+    def __init__(self, respond=None, polls_until_ended=1):
+        self.respond = respond or (lambda request: 'I prefer Resume A')
+        self.polls_until_ended = polls_until_ended
+        self.requests = []
+        # batch id -> {'requests': [...], 'polls': retrievals so far, 'results': [...]}
+        self.batches = {}
+        self._cached_prefixes = set()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self._server.server_address[1]}'
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @staticmethod
+    def block_tokens(block):
+        if block['type'] == 'image':
+            return max(1, len(block['source']['data']) // 100)
+        return max(1, len(block.get('text', '')) // 4)
+
+    def usage(self, request):
+        """The `usage` the API would report for `request`."""
+        blocks = [block for message in request['messages'] for block in message['content']]
+
+        tokens, read, written = 0, 0, 0
+        prefix = hashlib.sha256(request['model'].encode('utf-8'))
+        for block in blocks:
+            tokens += self.block_tokens(block)
+            prefix.update(json.dumps(block, sort_keys=True).encode('utf-8'))
+            if 'cache_control' not in block:
+                continue
+
+            key = prefix.hexdigest()
+            with self._lock:
+                if key in self._cached_prefixes:
+                    read = tokens
+                else:
+                    self._cached_prefixes.add(key)
+            written = tokens - read
+
+        return {'input_tokens': tokens - read - written,
+                'cache_creation_input_tokens': written,
+                'cache_read_input_tokens': read,
+                'output_tokens': 50}
+
+    def _reply(self, request):
+        with self._lock:
+            self.requests.append(request)
+        block = self.respond(request)
+        if isinstance(block, str):
+            block = {'type': 'text', 'text': block}
+        return {'id': f'msg_stub_{len(self.requests)}',
+                'type': 'message',
+                'role': 'assistant',
+                'model': request['model'],
+                'content': [block],
+                'stop_reason': 'tool_use' if block['type'] == 'tool_use' else 'end_turn',
+                'stop_sequence': None,
+                'usage': self.usage(request)}
+
+    def _create_batch(self, body):
+        batch_id = f'msgbatch_stub_{len(self.batches) + 1}'
+        results = [{'custom_id': request['custom_id'],
+                    'result': {'type': 'succeeded', 'message': self._reply(request['params'])}}
+                   for request in body['requests']]
+        with self._lock:
+            self.batches[batch_id] = {'requests': body['requests'], 'polls': 0, 'results': results}
+        return self._batch(batch_id)
+
+    def _batch(self, batch_id):
+        batch = self.batches[batch_id]
+        ended = batch['polls'] > self.polls_until_ended
+        count = len(batch['requests'])
+        return {'id': batch_id,
+                'type': 'message_batch',
+                'processing_status': 'ended' if ended else 'in_progress',
+                'request_counts': {'processing': 0 if ended else count, 'succeeded': count if ended else 0,
+                                   'errored': 0, 'canceled': 0, 'expired': 0},
+                'created_at': '2024-01-01T00:00:00Z',
+                'expires_at': '2024-01-02T00:00:00Z',
+                'ended_at': '2024-01-01T00:00:00Z' if ended else None,
+                'cancel_initiated_at': None,
+                'archived_at': None,
+                'results_url': f'{self.url}/v1/messages/batches/{batch_id}/results' if ended else None}
+
+    def _retrieve_batch(self, batch_id):
+        with self._lock:
+            self.batches[batch_id]['polls'] += 1
+        return self._batch(batch_id)
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                path = self.path.split('?')[0]
+                if path == '/v1/messages':
+                    self._send_json(stub._reply(body))
+                elif path == '/v1/messages/batches':
+                    self._send_json(stub._create_batch(body))
+                else:
+                    self.send_error(404)
+
+            def do_GET(self):
+                parts = self.path.split('?')[0].strip('/').split('/')
+                if parts[:3] != ['v1', 'messages', 'batches'] or len(parts) < 4 or parts[3] not in stub.batches:
+                    self.send_error(404)
+                elif len(parts) == 4:
+                    self._send_json(stub._retrieve_batch(parts[3]))
+                elif parts[4:] == ['results']:
+                    lines = ''.join(json.dumps(result) + '\n' for result in stub.batches[parts[3]]['results'])
+                    self._send(lines.encode('utf-8'), 'application/binary')
+                else:
+                    self.send_error(404)
+
+            def _send_json(self, response):
+                self._send(json.dumps(response).encode('utf-8'), 'application/json')
+
+            def _send(self, body, content_type):
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,204 @@
+import json
+import os
+import time
+from rank_search import ConcurrentInsertion
+
+class BatchInsertion:
+    """
+    Runs a `ConcurrentInsertion` through the Message Batches API, for offline
+    runs where latency doesn't matter but cost and rate limits do.
+
+    The comparisons are made in rounds. Each round collects the next votes of
+    every comparison that can be made (the next wave of each best of n, see
+    `LLMResumeComparer.best_of_n`), submits them as one batch, waits for the batch
+    to end and moves every search forward with the verdicts.
+
+    Every round is one batch, and waits at least `poll_interval` for it to end
+    (most batches end within minutes, a few take hours). `ConcurrentInsertion` hands
+    out every comparison of a round at once, also when ordering resumes that landed
+    in the same gap, so a run takes `ConcurrentInsertion.estimate_rounds()` batches:
+    a fresh intake of 300 resumes into an empty folder is 45 batches, a few hours at
+    a few minutes each, and 300 into 1,000 ranked resumes about 10. The fresh intake
+    takes 5,417 Haiku calls (`ConcurrentInsertion.estimate_calls()`), at half price.
+
+    Restarting: every verdict is saved in the comparer's `ComparisonStore`, and the
+    A/B labels of a vote follow from the two resumes' hashes instead of being
+    random, so replaying the rounds takes every vote made so far from the store
+    without paying for it again. `state_path` keeps the snapshot the run started
+    from and the batch that is in flight; on restart that batch's results are
+    fetched instead of submitting it again.
+
+    Parameters:
+    - resume_comparer (LLMResumeComparer): builds the requests and stores the verdicts.
+    - state_path (str): json file with the run's state, removed when the run finishes.
+    - poll_interval (float): seconds between checks on a batch that hasn't ended.
+    - policy (CascadePolicy): optional, picks the model and votes of each search step.
+        It must be fitted to the same history on restart, so the replay asks the same questions.
+    """
+    def __init__(self, resume_comparer, state_path, poll_interval=60, policy=None):
+        self.resume_comparer = resume_comparer
+        self.state_path = state_path
+        self.poll_interval = poll_interval
+        self.policy = policy
+
+        # Comparisons made this run, and the id of every batch submitted
+        self.comparisons = []
+        self.batch_ids = []
+
+        self.state = None
+
+    def run(self, candidates, ranked_filenames):
+        """Returns the final order as (filename, is_ranked) pairs, best first."""
+        self.state = self._load_state()
+        if self.state is None:
+            self.state = {'candidates': list(candidates), 'ranked_filenames': list(ranked_filenames),
+                          'batch_id': None, 'votes': {}}
+            self._save_state()
+        elif self.state['batch_id'] is not None:
+            print(f"Resuming: collecting batch {self.state['batch_id']}")
+            self._collect(self.state['batch_id'], self.state['votes'])
+
+        insertion = ConcurrentInsertion(self.state['candidates'], self.state['ranked_filenames'], policy=self.policy)
+        sizes = len(self.state['candidates']), len(self.state['ranked_filenames'])
+        estimate, calls = ConcurrentInsertion.estimate_rounds(*sizes), ConcurrentInsertion.estimate_calls(*sizes)
+        print(f'Batch insertion: about {estimate} rounds, one batch each; '
+              f'at least {estimate * self.poll_interval / 60:.0f} minutes at one poll per batch; '
+              f"at least {calls['haiku']} Haiku and {calls['sonnet']} Sonnet calls")
+        ballots = {}
+        rounds = 0
+        while not insertion.done:
+            for job in insertion.pending_jobs():
+                ballots[job] = self._ballot(job)
+            if not ballots:
+                break
+
+            # Everything asked this round, as (job, resumes, to_be_ranked_is_A, sample)
+            votes = []
+            for job, ballot in ballots.items():
+                wave = (job.n + 1) // 2 - max(ballot['tally']['wins'], ballot['tally']['losses'])
+                planned = self.resume_comparer._plan_votes(ballot['resumes'], ballot['to_be_ranked_is_A'],
+                                                           ballot['num_votes'], wave, ballot['samples'])
+                ballot['num_votes'] += wave
+                votes.extend((job, *vote) for vote in planned)
+
+            rounds += 1
+            comparisons = self._cast(votes)
+
+            for job in list(ballots):
+                decided = self._count(job, ballots[job], [c for (j, *_), c in zip(votes, comparisons) if j == job])
+                if decided is not None:
+                    del ballots[job]
+                    self.comparisons.append(decided)
+                    insertion.record(job, decided['winner'] == decided['to_be_ranked_resume'])
+
+        os.remove(self.state_path)
+        print(f'Batch insertion finished in {rounds} rounds, {len(self.batch_ids)} batches')
+        return insertion.final_order()
+
+    def _ballot(self, job):
+        """The votes of one best of n `job` so far."""
+        resumes = self.resume_comparer._build_resumes(job.to_be_ranked, job.opponent, job.opponent_is_ranked)
+        # A restart asks the same questions
+        resumes, to_be_ranked_is_A = self.resume_comparer._fixed_labels(resumes)
+
+        return {'resumes': resumes, 'to_be_ranked_is_A': to_be_ranked_is_A, 'samples': {}, 'num_votes': 0,
+                'tally': {'wins': 0, 'losses': 0, 'win_comparison': None, 'loss_comparison': None},
+                'last_comparison': None}
+
+    def _count(self, job, ballot, comparisons):
+        """Adds this round's votes; returns the deciding comparison once best of n is decided."""
+        self.resume_comparer._count_votes(ballot['tally'], comparisons)
+        ballot['last_comparison'] = comparisons[-1]
+
+        wins_required = (job.n + 1) // 2
+        if ballot['tally']['wins'] == wins_required:
+            return ballot['tally']['win_comparison']
+        if ballot['tally']['losses'] == wins_required:
+            return ballot['tally']['loss_comparison']
+        if ballot['num_votes'] >= 2 * job.n:
+            # Claude kept not stating a winner
+            return ballot['last_comparison']
+        return None
+
+    def _cast(self, votes):
+        """One round: stored votes come from the `ComparisonStore`, the rest go in one batch."""
+        resume_comparer = self.resume_comparer
+        comparisons = [resume_comparer._cached_vote(resumes, is_A, job.model, sample)
+                       for job, resumes, is_A, sample in votes]
+        missing = [i for i, comparison in enumerate(comparisons) if comparison is None]
+        if not missing:
+            return comparisons
+
+        requests, pending = [], {}
+        for i in missing:
+            job, resumes, is_A, sample = votes[i]
+            custom_id = f'vote-{i}'
+            requests.append({'custom_id': custom_id,
+                             'params': resume_comparer._message_params(resumes, is_A, job.model)})
+            pending[custom_id] = self._pending_vote(job, resumes, is_A, sample)
+
+        batch = self._batches().create(requests=requests)
+        print(f'Submitted batch {batch.id} with {len(requests)} comparisons')
+        self.batch_ids.append(batch.id)
+        self.state['batch_id'], self.state['votes'] = batch.id, pending
+        self._save_state()
+
+        collected = self._collect(batch.id, pending)
+        for i in missing:
+            comparisons[i] = collected[f'vote-{i}']
+        return comparisons
+
+    @staticmethod
+    def _pending_vote(job, resumes, to_be_ranked_is_A, sample):
+        """What is needed to store a vote's verdict after a restart."""
+        return {'model': job.model, 'sample': sample, 'to_be_ranked_is_A': to_be_ranked_is_A,
+                'resumes': {label: {key: resume[key] for key in ('filename', 'hash')}
+                            for label, resume in resumes.items()}}
+
+    def _collect(self, batch_id, pending):
+        """Waits for the batch to end, stores every verdict and returns custom_id -> comparison."""
+        resume_comparer = self.resume_comparer
+        batches = self._batches()
+        while batches.retrieve(batch_id).processing_status != 'ended':
+            self._wait()
+
+        collected = {}
+        for entry in batches.results(batch_id):
+            vote = pending[entry.custom_id]
+            resumes, is_A = vote['resumes'], vote['to_be_ranked_is_A']
+            resume_comparer.num_calls[vote['model']] += 1
+
+            if entry.result.type != 'succeeded':
+                # Counts as a vote without a winner, so it is asked again next round
+                collected[entry.custom_id] = resume_comparer._comparison(resumes, is_A, None, f'batch request {entry.result.type}')
+                continue
+
+            message = entry.result.message
+            resume_comparer._record_usage(resumes, is_A, vote['model'], message, batch=True)
+            winner, text = resume_comparer._read_message(message)
+            comparison = resume_comparer._comparison(resumes, is_A, winner, text)
+            resume_comparer._store_vote(resumes, vote['model'], vote['sample'], comparison)
+            collected[entry.custom_id] = comparison
+
+        self.state['batch_id'], self.state['votes'] = None, {}
+        self._save_state()
+        return collected
+
+    def _batches(self):
+        # The comparer's client leaves retries to its `RequestScheduler`, which batch calls don't go through
+        return self.resume_comparer.client.with_options(max_retries=2).messages.batches
+
+    def _wait(self):
+        time.sleep(self.poll_interval)
+
+    def _load_state(self):
+        if not os.path.exists(self.state_path):
+            return None
+        with open(self.state_path, 'r') as file:
+            return json.load(file)
+
+    def _save_state(self):
+        temp_path = f'{self.state_path}.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump(self.state, file, indent=4)
+        os.replace(temp_path, self.state_path)
@@ -0,0 +1,320 @@
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import random
+import time
+from listwise_comparer import ListwiseSort
+from resume_sorter import ResumeSorter
+from telemetry import call_cost
+from verdict_graph import VerdictGraph
+
+# Tokens of one simulated call: two resume images and the prompt in, an essay out
+SIMULATED_TOKENS = {'input_tokens': 3500, 'output_tokens': 600}
+
+# Error rate 0.5 * exp(-distance / scale), with the distance as a fraction of the list:
+# at 100 resumes, neighbours are judged wrongly 18% (Sonnet) and 36% (Haiku) of the time
+ERROR_SCALES = {'sonnet': 0.01, 'haiku': 0.03}
+
+# (median seconds, sigma) of each model's log-normal latency
+LATENCIES = {'sonnet': (6.0, 0.35), 'haiku': (2.0, 0.35)}
+
+DEFAULT_SIZES = (10, 100, 1000, 5000)
+
+# 'listwise' sorts with a `ListwiseSort` of LISTWISE_K resumes per call instead of inserting one at a time
+BENCHMARK_STRATEGIES = (*ResumeSorter.STRATEGIES, 'listwise')
+LISTWISE_K = 6
+
+# A listwise call sorts its resumes by true rank plus Gaussian noise of sd LISTWISE_NOISE * n * error_scale.
+# At 0.5, neighbours are judged wrongly about twice as often as by a pairwise call: a
+# long context with many images is assumed to be read less carefully than two resumes.
+LISTWISE_NOISE = 0.5
+
+def listwise_tokens(k):
+    """Tokens of one simulated listwise call: k images and the prompt in, a short tool call out."""
+    return {'input_tokens': 1600 * k + 300, 'output_tokens': 60}
+
+class SimulatedComparer:
+    """
+    Stands in for `LLMResumeComparer` with a hidden true order, so ranking
+    strategies can be measured without calling Claude.
+
+    A vote between resumes `distance` ranks apart (out of `n`) is wrong with
+    probability 0.5 * exp(-distance / (n * error_scale[model])): close calls are
+    coin flips, clear ones are nearly always right. With probability
+    `position_bias` the vote goes to whichever resume is shown first ('Resume A'),
+    whatever their quality. Every call takes a log-normal time (`latencies`) on a
+    simulated clock; the votes of one wave of a best of n run side by side.
+
+    Parameters:
+    - true_ranks (dict): filename -> true rank, 0 being the best.
+    """
+    def __init__(self, true_ranks, error_scales=None, position_bias=0.0, latencies=None, seed=0):
+        self.true_ranks = true_ranks
+        self.error_scales = ERROR_SCALES if error_scales is None else error_scales
+        self.position_bias = position_bias
+        self.latencies = LATENCIES if latencies is None else latencies
+        self.random = random.Random(seed)
+
+        self.model = 'sonnet'
+        self.should_swap_mediatype = False
+        self.num_calls = {'haiku': 0, 'sonnet': 0}
+        self.wall_seconds = 0.0
+        self.cost = 0.0
+
+    def error_rate(self, unranked_filename, ranked_filename, model):
+        distance = abs(self.true_ranks[unranked_filename] - self.true_ranks[ranked_filename])
+        scale = self.error_scales[model] * len(self.true_ranks)
+        return 0.5 * math.exp(-distance / scale) if scale > 0 else 0.0
+
+    def _vote(self, unranked_filename, ranked_filename):
+        """One simulated call. Returns (comparison, seconds it took)."""
+        model = self.model
+        self.num_calls[model] += 1
+        self.cost += call_cost(model, SIMULATED_TOKENS)
+
+        to_be_ranked_is_A = self.random.random() < 0.5
+        if self.random.random() < self.position_bias:
+            to_be_ranked_wins = to_be_ranked_is_A
+        else:
+            is_better = self.true_ranks[unranked_filename] < self.true_ranks[ranked_filename]
+            is_wrong = self.random.random() < self.error_rate(unranked_filename, ranked_filename, model)
+            to_be_ranked_wins = is_better != is_wrong
+
+        labels = ('Resume A', 'Resume B') if to_be_ranked_is_A else ('Resume B', 'Resume A')
+        filenames = dict(zip(labels, (unranked_filename, ranked_filename)))
+        comparison = {'Resume A': filenames['Resume A'], 'Resume B': filenames['Resume B'],
+                      'winner': labels[0] if to_be_ranked_wins else labels[1],
+                      'to_be_ranked_resume': labels[0], 'claude_response': ''}
+
+        median, sigma = self.latencies[model]
+        return comparison, self.random.lognormvariate(math.log(median), sigma)
+
+    def main(self, unranked_filename, ranked_filename):
+        comparison, seconds = self._vote(unranked_filename, ranked_filename)
+        self.wall_seconds += seconds
+        return comparison
+
+    def best_of_n(self, n, unranked_filename, ranked_filename):
+        """Same waves as `LLMResumeComparer.best_of_n`: each wave takes as long as its slowest vote."""
+        wins_required = (n + 1) // 2
+        wins, losses = 0, 0
+        while True:
+            wave = [self._vote(unranked_filename, ranked_filename) for _ in range(wins_required - max(wins, losses))]
+            self.wall_seconds += max(seconds for _, seconds in wave)
+            for comparison, _ in wave:
+                if comparison['winner'] == comparison['to_be_ranked_resume']:
+                    wins += 1
+                else:
+                    losses += 1
+            if max(wins, losses) == wins_required:
+                return comparison
+
+    def pretty_print(self, comparison):
+        pass
+
+    # What a `RatingEngine` reads from a comparer: the simulated resumes are their own hashes, and nothing is stored
+    comparison_store = None
+    prompt_hash = None
+
+    def get_image(self, ranked, filename):
+        return {'hash': filename}
+
+    def image_hash(self, ranked, filename):
+        return filename
+
+    def rank_list(self, filenames):
+        """
+        One simulated listwise call over `filenames`, in the order shown. Returns
+        (indices into `filenames`, best first; seconds it took).
+        """
+        model = self.model
+        self.num_calls[model] += 1
+        self.cost += call_cost(model, listwise_tokens(len(filenames)))
+
+        sd = LISTWISE_NOISE * len(self.true_ranks) * self.error_scales[model]
+        keys = [self.true_ranks[filename] + (self.random.gauss(0, sd) if sd > 0 else 0) for filename in filenames]
+        order = sorted(range(len(filenames)), key=lambda i: keys[i])
+        if self.random.random() < self.position_bias:
+            # The resume shown first goes to the top, whatever its quality
+            order.remove(0)
+            order.insert(0, 0)
+
+        median, sigma = self.latencies[model]
+        return order, self.random.lognormvariate(math.log(median), sigma)
+
+class SimulatedListwiseComparer:
+    """`ListwiseComparer` over a `SimulatedComparer`: each group in a wave is shown shuffled."""
+    def __init__(self, resume_comparer, k=LISTWISE_K):
+        self.resume_comparer = resume_comparer
+        self.model = resume_comparer.model
+        self.k = k
+        self.pair_weight = 2 / k
+        self.prompt_hash = None
+        self.num_calls = 0
+        self.num_unreadable = 0
+
+    def rank_groups(self, groups):
+        orders, seconds = [], [0.0]
+        for group in groups:
+            shown = self.resume_comparer.random.sample(range(len(group)), len(group))
+            order, call_seconds = self.resume_comparer.rank_list([group[i]['filename'] for i in shown])
+            orders.append([shown[position] for position in order])
+            seconds.append(call_seconds)
+            self.num_calls += 1
+        self.resume_comparer.wall_seconds += max(seconds)
+        return orders
+
+class InMemorySorter(ResumeSorter):
+    """`ResumeSorter`'s search code over a list in memory: no files, no Claude."""
+    def __init__(self, resume_comparer, strategy='walk'):
+        self.resume_comparer = resume_comparer
+        self.strategy = strategy
+        self.debug = False
+        self.comparisons = []
+        self.cascade_policy = None
+        self.journal = None
+        self.prior_scores = {}
+        self.prefetcher = None
+        self.verdict_graph = None
+        self.ranked_filenames = []
+        self.num_ranked_resumes = 0
+
+    def read_ranked_folder(self):
+        self.num_ranked_resumes = len(self.ranked_filenames)
+
+    def insert(self, to_be_ranked_filename):
+        self.read_ranked_folder()
+        if self.num_ranked_resumes == 0:
+            self.ranked_filenames.append(to_be_ranked_filename)
+            return
+        self.to_be_ranked_filename = to_be_ranked_filename
+        self.ranked_filenames.insert(self.find_rank(), to_be_ranked_filename)
+        self.comparisons.clear()
+
+def kendall_tau(order):
+    """Kendall tau between `order` (true ranks in the order found) and the true order, in O(n log n)."""
+    n = len(order)
+    if n < 2:
+        return 1.0
+
+    def count_inversions(items):
+        if len(items) < 2:
+            return items, 0
+        middle = len(items) // 2
+        left, left_inversions = count_inversions(items[:middle])
+        right, right_inversions = count_inversions(items[middle:])
+        merged, inversions, i, j = [], left_inversions + right_inversions, 0, 0
+        while i < len(left) and j < len(right):
+            if left[i] <= right[j]:
+                merged.append(left[i])
+                i += 1
+            else:
+                merged.append(right[j])
+                inversions += len(left) - i
+                j += 1
+        return merged + left[i:] + right[j:], inversions
+
+    _, inversions = count_inversions(list(order))
+    return 1 - 4 * inversions / (n * (n - 1))
+
+def run_benchmark(strategy, n, seed=0, transitivity=False, **comparer_kwargs):
+    """
+    Insert `n` simulated resumes one at a time with `strategy`; returns the measurements.
+    With `transitivity`, comparisons a `VerdictGraph` already implies are skipped.
+    """
+    shuffled = random.Random(seed)
+    filenames = [f'resume-{rank:05}.png' for rank in range(n)]
+    true_ranks = {filename: rank for rank, filename in enumerate(filenames)}
+    shuffled.shuffle(filenames)
+
+    resume_comparer = SimulatedComparer(true_ranks, seed=seed, **comparer_kwargs)
+
+    started = time.perf_counter()
+    # The sorter prints every step
+    with contextlib.redirect_stdout(io.StringIO()):
+        if strategy == 'listwise':
+            listwise_sort = ListwiseSort(SimulatedListwiseComparer(resume_comparer), [(filename, False) for filename in filenames],
+                                         seed=seed)
+            ranked_filenames = [filename for filename, _ in listwise_sort.run()]
+        else:
+            sorter = InMemorySorter(resume_comparer, strategy)
+            if transitivity:
+                sorter.verdict_graph = VerdictGraph()
+            for filename in filenames:
+                sorter.insert(filename)
+            ranked_filenames = sorter.ranked_filenames
+    cpu_seconds = time.perf_counter() - started
+
+    calls = sum(resume_comparer.num_calls.values())
+    result = {'strategy': strategy, 'n': n, 'seed': seed,
+            'calls': calls,
+            'calls_by_model': dict(resume_comparer.num_calls),
+            'calls_per_insert': round(calls / max(1, n - 1), 3),
+            'cost_usd': round(resume_comparer.cost, 4),
+            'simulated_seconds': round(resume_comparer.wall_seconds, 1),
+            'cpu_seconds': round(cpu_seconds, 3),
+            'kendall_tau': round(kendall_tau([true_ranks[filename] for filename in ranked_filenames]), 4)}
+    if transitivity and strategy != 'listwise':
+        result['inferred'] = sorter.verdict_graph.num_inferred
+    return result
+
+def run_suite(strategies=ResumeSorter.STRATEGIES, sizes=DEFAULT_SIZES, seeds=(0,), transitivity=False, **comparer_kwargs):
+    results = []
+    for n in sizes:
+        for strategy in strategies:
+            for seed in seeds:
+                result = run_benchmark(strategy, n, seed, transitivity, **comparer_kwargs)
+                print(f"{strategy:<8} n={n:<5} seed={seed}: {result['calls_per_insert']:>7} calls/insert, "
+                      f"${result['cost_usd']:<9} {result['simulated_seconds']:>9}s simulated, "
+                      f"{result['cpu_seconds']}s cpu, tau={result['kendall_tau']}"
+                      f"{f", {result['inferred']} inferred" if 'inferred' in result else ''}")
+                results.append(result)
+    return results
+
+def save_results(results, path):
+    with open(path, 'w') as file:
+        json.dump(results, file, indent=4)
+
+def load_results(path):
+    with open(path, 'r') as file:
+        return json.load(file)
+
+def compare_results(baseline, results, tolerance=0.05):
+    """
+    Prints and returns the runs that got worse than `baseline`: more calls per insert
+    or a lower Kendall tau, by more than `tolerance` (relative for calls, absolute for tau).
+    """
+    previous = {(result['strategy'], result['n'], result['seed']): result for result in baseline}
+    regressions = []
+    for result in results:
+        old = previous.get((result['strategy'], result['n'], result['seed']))
+        if old is None:
+            continue
+        if result['calls_per_insert'] > old['calls_per_insert'] * (1 + tolerance):
+            regressions.append((result, 'calls_per_insert', old['calls_per_insert'], result['calls_per_insert']))
+        if result['kendall_tau'] < old['kendall_tau'] - tolerance:
+            regressions.append((result, 'kendall_tau', old['kendall_tau'], result['kendall_tau']))
+
+    for result, metric, old, new in regressions:
+        print(f"REGRESSION {result['strategy']} n={result['n']} seed={result['seed']}: {metric} {old} -> {new}")
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the ranking strategies against a simulated comparer.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES))
+    parser.add_argument('--strategies', nargs='+', default=list(BENCHMARK_STRATEGIES), choices=BENCHMARK_STRATEGIES)
+    parser.add_argument('--seeds', type=int, nargs='+', default=[0])
+    parser.add_argument('--position-bias', type=float, default=0.0)
+    parser.add_argument('--transitivity', action='store_true', help='skip comparisons the verdicts so far imply')
+    parser.add_argument('--out', default='benchmark_results.json')
+    parser.add_argument('--baseline', help='earlier results to check for regressions')
+    args = parser.parse_args()
+
+    results = run_suite(args.strategies, args.sizes, args.seeds, args.transitivity, position_bias=args.position_bias)
+    save_results(results, args.out)
+    if args.baseline and os.path.exists(args.baseline):
+        if compare_results(load_results(args.baseline), results):
+            raise SystemExit(1)
@@ -0,0 +1,180 @@
+from collections import namedtuple
+from functools import lru_cache
+import math
+import random
+
+# One way to ask about a pair: `model`, best of `n`
+Option = namedtuple('Option', ['model', 'n'])
+
+@lru_cache(maxsize=None)
+def expected_votes(q, n):
+    """
+    Votes a best of `n` takes when every vote goes one way with probability `q`,
+    sending the votes in waves like `LLMResumeComparer.best_of_n`.
+    """
+    wins_required = (n + 1) // 2
+
+    @lru_cache(maxsize=None)
+    def remaining(wins, losses):
+        if wins == wins_required or losses == wins_required:
+            return 0
+        wave = wins_required - max(wins, losses)
+        return wave + sum(math.comb(wave, k) * q**k * (1 - q)**(wave - k) * remaining(wins + k, losses + wave - k)
+                          for k in range(wave + 1))
+
+    return remaining(0, 0)
+
+def majority_accuracy(q, n):
+    """P(the majority of `n` votes is right) when each vote is right with probability `q`."""
+    return sum(math.comb(n, k) * q**k * (1 - q)**(n - k) for k in range(n // 2 + 1, n + 1))
+
+class CascadePolicy:
+    """
+    Decides which model, and how many votes, to use for a comparison, based on
+    how often Haiku agreed with Sonnet in the comparison history.
+
+    Agreement is measured per bucket of rank distance (1, 2, 3-4, 5-8, ...): for
+    every pair of ranked resumes that both models have compared, each Haiku vote
+    is checked against the Sonnet majority. Resumes far apart in the ranking are
+    easy to tell apart, so Haiku tends to agree there; near the decision boundary
+    it often doesn't.
+
+    `choose(distance)` returns the cheapest `Option` whose accuracy (the chance of
+    matching Sonnet's verdict) is at least `target_accuracy`. The expected cost of
+    every step is added up, so `report()` can compare it with what was spent.
+
+    The walk only asks Sonnet where a Haiku vote changed direction, so the pairs
+    with both models' votes are mostly the ones Haiku got wrong, and the agreement
+    would come out too low. `audit()` also sends a random `audit_rate` of the other
+    Haiku steps to Sonnet; `fit()` counts each audited pair 1 / rate times, since
+    it stands for that many steps nobody checked.
+
+    Parameters:
+    - agreement_prior (tuple): (agreements, disagreements) assumed for every bucket
+        before looking at the history, so a bucket with little data can't swing far.
+    - sonnet_accuracy (float): chance that one Sonnet vote matches the Sonnet majority.
+    - costs (dict): relative cost of one call per model.
+    - audit_rate (float): share of the Haiku steps that didn't change direction Sonnet is also asked about.
+    """
+    OPTIONS = (Option('haiku', 1), Option('haiku', 3), Option('sonnet', 1), Option('sonnet', 3))
+    # Sonnet 3.5 costs 12 times as much as Haiku 3 per token
+    COSTS = {'haiku': 1, 'sonnet': 12}
+
+    def __init__(self, target_accuracy=0.9, agreement_prior=(4, 1), sonnet_accuracy=0.95, costs=None,
+                 audit_rate=0.02, seed=None):
+        self.target_accuracy = target_accuracy
+        self.agreement_prior = agreement_prior
+        self.sonnet_accuracy = sonnet_accuracy
+        self.costs = costs or dict(self.COSTS)
+        self.audit_rate = audit_rate
+        self.rng = random.Random(seed)
+
+        # distance bucket -> [agreements, disagreements]
+        self.agreement = {}
+
+        self.projected_cost = 0
+        self.actual_cost = 0
+        self.calls = {'haiku': 0, 'sonnet': 0}
+        # Option -> times it was used
+        self.decisions = {}
+        self.num_audits = 0
+
+    @staticmethod
+    def bucket(distance):
+        """1 -> 0, 2 -> 1, 3-4 -> 2, 5-8 -> 3, ..."""
+        return math.ceil(math.log2(max(1, distance)))
+
+    def fit(self, verdicts, ranks, audits=None):
+        """
+        Count Haiku/Sonnet agreement.
+        - verdicts: (a_hash, b_hash, model, sample, winner) rows, see `ComparisonStore.verdicts()`.
+        - ranks (dict): image hash -> rank, for the ranked resumes.
+        - audits (dict): (a_hash, b_hash) -> rate, hashes sorted, see `ComparisonStore.audits()`.
+        """
+        audits = audits or {}
+        # (hash, hash) -> {model: [hash of the winner of each vote]}
+        votes = {}
+        for a_hash, b_hash, model, _, winner in verdicts:
+            if a_hash not in ranks or b_hash not in ranks or a_hash == b_hash:
+                continue
+            pair = tuple(sorted((a_hash, b_hash)))
+            votes.setdefault(pair, {}).setdefault(model, []).append(a_hash if winner == 'Resume A' else b_hash)
+
+        self.agreement = {}
+        for (a_hash, b_hash), by_model in votes.items():
+            sonnet, haiku = by_model.get('sonnet', []), by_model.get('haiku', [])
+            if not sonnet or not haiku:
+                continue
+            majority = max(set(sonnet), key=sonnet.count)
+            if 2 * sonnet.count(majority) == len(sonnet):
+                # Sonnet is split, so there is nothing to agree with
+                continue
+
+            counts = self.agreement.setdefault(self.bucket(abs(ranks[a_hash] - ranks[b_hash])), [0, 0])
+            weight = 1 / audits[(a_hash, b_hash)] if (a_hash, b_hash) in audits else 1
+            for winner in haiku:
+                counts[winner != majority] += weight
+        return self
+
+    def haiku_agreement(self, distance):
+        bucket = self.bucket(distance)
+        if self.agreement and bucket > max(self.agreement):
+            # Further apart than any pair in the history; agreement only grows with distance
+            bucket = max(self.agreement)
+        agreements, disagreements = self.agreement.get(bucket, (0, 0))
+        prior_agreements, prior_disagreements = self.agreement_prior
+        return (agreements + prior_agreements) / (agreements + disagreements + prior_agreements + prior_disagreements)
+
+    def _vote_accuracy(self, model, distance):
+        return self.haiku_agreement(distance) if model == 'haiku' else self.sonnet_accuracy
+
+    def accuracy(self, option, distance):
+        return majority_accuracy(self._vote_accuracy(option.model, distance), option.n)
+
+    def expected_cost(self, option, distance):
+        return self.costs[option.model] * expected_votes(self._vote_accuracy(option.model, distance), option.n)
+
+    def choose(self, distance):
+        """The cheapest `Option` accurate enough for two resumes about `distance` ranks apart."""
+        accurate = [option for option in self.OPTIONS if self.accuracy(option, distance) >= self.target_accuracy]
+        if accurate:
+            option = min(accurate, key=lambda option: self.expected_cost(option, distance))
+        else:
+            option = max(self.OPTIONS, key=lambda option: self.accuracy(option, distance))
+        return self.project(option, distance)
+
+    def project(self, option, distance):
+        """Count a step whose option was fixed by the caller; returns `option`."""
+        self.projected_cost += self.expected_cost(option, distance)
+        self.decisions[option] = self.decisions.get(option, 0) + 1
+        return option
+
+    def audit(self, option):
+        """
+        Whether to also ask Sonnet (best of 1) about a step made with `option` that
+        didn't change direction; only Haiku steps are audited. Counts the audit's cost.
+        """
+        if option.model != 'haiku' or self.rng.random() >= self.audit_rate:
+            return False
+        self.projected_cost += self.costs['sonnet']
+        self.num_audits += 1
+        return True
+
+    def record(self, calls):
+        """Add the calls actually made, as {model: calls}."""
+        for model, num_calls in calls.items():
+            self.calls[model] = self.calls.get(model, 0) + num_calls
+            self.actual_cost += self.costs[model] * num_calls
+
+    def report(self):
+        """Prints and returns the projected and actual cost (in units of one Haiku call)."""
+        report = {'projected_cost': round(self.projected_cost, 1),
+                  'actual_cost': self.actual_cost,
+                  'calls': dict(self.calls),
+                  'decisions': {f'{option.model} best of {option.n}': count for option, count in self.decisions.items()},
+                  'audits': self.num_audits,
+                  'haiku_agreement': {f'distance {2 ** (bucket - 1) + 1 if bucket else 1}-{2 ** bucket}': round(self.haiku_agreement(2 ** bucket), 3)
+                                      for bucket in sorted(self.agreement)}}
+        print(f"cascade: projected cost {report['projected_cost']}, actual cost {report['actual_cost']} "
+              f"(Haiku calls), decisions {report['decisions']}, {report['audits']} audits")
+        return report
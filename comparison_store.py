@@ -0,0 +1,158 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+class ComparisonStore:
+    """
+    On-disk cache of comparisons, so that re-running a ranking never pays for
+    a comparison that has already been made.
+
+    A comparison is keyed by the SHA-256 of the image shown as Resume A, the
+    SHA-256 of the image shown as Resume B, the model, the hash of the prompt and
+    `sample`, the index of the vote among votes with the same key (best of n asks
+    the same question more than once).
+
+    When the store holds more than `max_entries` comparisons, the least recently
+    used ones are evicted.
+
+    Parameters:
+    - path (str): the SQLite file.
+    - stats_path (str): json file that accumulates hit/miss counters, see `save_stats()`.
+    """
+    def __init__(self, path, max_entries=50000, stats_path=None):
+        self.path = path
+        self.max_entries = max_entries
+        self.stats_path = stats_path
+
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS comparisons (
+                a_hash TEXT NOT NULL,
+                b_hash TEXT NOT NULL,
+                model TEXT NOT NULL,
+                prompt_hash TEXT NOT NULL,
+                sample INTEGER NOT NULL,
+                winner TEXT NOT NULL,
+                claude_response TEXT NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (a_hash, b_hash, model, prompt_hash, sample)
+            )""")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS comparisons_last_used ON comparisons (last_used)")
+        # Pairs Sonnet was asked about at random, and at what rate; see `CascadePolicy.audit()`
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS audits (
+                a_hash TEXT NOT NULL,
+                b_hash TEXT NOT NULL,
+                prompt_hash TEXT NOT NULL,
+                rate REAL NOT NULL,
+                PRIMARY KEY (a_hash, b_hash, prompt_hash)
+            )""")
+        self.connection.commit()
+
+        self.num_entries = self.connection.execute("SELECT COUNT(*) FROM comparisons").fetchone()[0]
+
+        # Counters since the last `save_stats()`
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    @staticmethod
+    def hash_bytes(data):
+        return hashlib.sha256(data).hexdigest()
+
+    @staticmethod
+    def hash_prompt(prompt):
+        return hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:16]
+
+    def get(self, a_hash, b_hash, model, prompt_hash, sample=0):
+        """Returns {'winner': ..., 'claude_response': ...} or None."""
+        return self.get_first([(a_hash, b_hash, model, prompt_hash, sample)])[1]
+
+    def get_first(self, keys):
+        """
+        Looks up each key in turn and returns (key, comparison) for the first one
+        that is stored, or (None, None). Counts as a single hit or miss.
+        """
+        for key in keys:
+            row = self.connection.execute(
+                "SELECT winner, claude_response FROM comparisons "
+                "WHERE a_hash=? AND b_hash=? AND model=? AND prompt_hash=? AND sample=?", key).fetchone()
+            if row is None:
+                continue
+
+            self.stats['hits'] += 1
+            self.connection.execute(
+                "UPDATE comparisons SET last_used=? "
+                "WHERE a_hash=? AND b_hash=? AND model=? AND prompt_hash=? AND sample=?", (time.time(), *key))
+            self.connection.commit()
+            return key, {'winner': row[0], 'claude_response': row[1]}
+
+        self.stats['misses'] += 1
+        return None, None
+
+    def contains(self, keys):
+        """Whether any of `keys` is stored; unlike `get_first()`, not counted as a hit or miss."""
+        return any(self.connection.execute(
+            "SELECT 1 FROM comparisons WHERE a_hash=? AND b_hash=? AND model=? AND prompt_hash=? AND sample=?", key).fetchone()
+            for key in keys)
+
+    def put(self, a_hash, b_hash, model, prompt_hash, sample, winner, claude_response):
+        """`winner` is 'Resume A' or 'Resume B', relative to the order of the key."""
+        cursor = self.connection.execute(
+            "INSERT OR IGNORE INTO comparisons VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (a_hash, b_hash, model, prompt_hash, sample, winner, claude_response, time.time()))
+        self.num_entries += cursor.rowcount
+        self._evict()
+        self.connection.commit()
+
+    def verdicts(self, prompt_hash):
+        """Every stored comparison made with `prompt_hash`, as (a_hash, b_hash, model, sample, winner) rows."""
+        return self.connection.execute(
+            "SELECT a_hash, b_hash, model, sample, winner FROM comparisons WHERE prompt_hash=?", (prompt_hash,)).fetchall()
+
+    def put_audit(self, a_hash, b_hash, prompt_hash, rate):
+        """Mark the pair as audited at `rate`; the order of the hashes doesn't matter."""
+        self.connection.execute("INSERT OR REPLACE INTO audits VALUES (?, ?, ?, ?)",
+                                (*sorted((a_hash, b_hash)), prompt_hash, rate))
+        self.connection.commit()
+
+    def audits(self, prompt_hash):
+        """(a_hash, b_hash) -> rate of every audited pair, hashes sorted."""
+        return {(a_hash, b_hash): rate for a_hash, b_hash, rate in self.connection.execute(
+            "SELECT a_hash, b_hash, rate FROM audits WHERE prompt_hash=?", (prompt_hash,))}
+
+    def _evict(self):
+        excess = self.num_entries - self.max_entries
+        if excess <= 0:
+            return
+
+        self.connection.execute(
+            "DELETE FROM comparisons WHERE rowid IN "
+            "(SELECT rowid FROM comparisons ORDER BY last_used LIMIT ?)", (excess,))
+        self.num_entries -= excess
+        self.stats['evictions'] += excess
+
+    def save_stats(self):
+        """Add the counters to `stats_path` (if set) and reset them."""
+        if self.stats_path is None:
+            return
+
+        totals = {}
+        if os.path.exists(self.stats_path):
+            with open(self.stats_path, 'r') as file:
+                totals = json.load(file)
+
+        for key, value in self.stats.items():
+            totals[key] = totals.get(key, 0) + value
+        totals['entries'] = self.num_entries
+        lookups = totals.get('hits', 0) + totals.get('misses', 0)
+        totals['hit_rate'] = totals.get('hits', 0) / lookups if lookups else 0
+
+        with open(self.stats_path, 'w') as file:
+            json.dump(totals, file, indent=4)
+
+        print(f'comparison cache: {self.stats}')
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def close(self):
+        self.connection.close()
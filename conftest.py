@@ -0,0 +1,38 @@
+import base64
+import json
+import os
+import pytest
+
+RANKED = ['000-c.png', '001-m.png', '002-x.png']
+UNRANKED = ['a.png', 'd.png', 'e.png', 'n.png', 'z.png']
+
+def label_of(content, data):
+    """The label ('Resume A' or 'Resume B') the request gave to the image `data`."""
+    first, second = content[2]['text'].removesuffix(':').split('is ')[1:]
+    first = first.split('.')[0]
+    return first if content[1]['source']['data'] == data else second
+
+def respond(request):
+    """The resume whose (fake) image holds the alphabetically smaller name wins."""
+    content = request['messages'][0]['content']
+    images = [block['source']['data'] for block in content if block['type'] == 'image']
+    best = min(images, key=lambda data: base64.b64decode(data))
+    return f'I prefer {label_of(content, best)}'
+
+@pytest.fixture
+def resume_folder(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for folder in ('ranked', 'unranked', 'storage'):
+        os.makedirs(f'batch_resumes/{folder}')
+    for filename in RANKED:
+        with open(f'batch_resumes/ranked/{filename}', 'wb') as file:
+            file.write(filename[4:].encode('utf-8'))
+    for filename in UNRANKED:
+        with open(f'batch_resumes/unranked/{filename}', 'wb') as file:
+            file.write(filename.encode('utf-8'))
+    with open('batch_resumes/usage.json', 'w') as file:
+        json.dump({'num_calls': {'haiku': 0, 'sonnet': 0}}, file)
+    return 'batch_resumes'
+
+class Interrupted(Exception):
+    pass
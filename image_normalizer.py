@@ -0,0 +1,106 @@
+from collections import namedtuple
+import hashlib
+import io
+import os
+
+try:
+    from PIL import Image
+except ImportError:
+    # Without Pillow, images are uploaded as they are
+    Image = None
+
+# `data` is what gets uploaded; sizes are in bytes, tokens are the API's image token estimate
+NormalizedImage = namedtuple('NormalizedImage', ['data', 'media_type', 'original_size', 'original_tokens', 'tokens'])
+
+class ImageNormalizer:
+    """
+    Shrinks resume screenshots before they are uploaded:
+    1. Downscale so the image fits in `max_tokens` image tokens and `max_long_edge` pixels
+    2. Convert to grayscale
+    3. Re-encode as PNG, JPEG and WEBP and keep the smallest
+
+    Each distinct image is only processed once; the result is saved in
+    `cache_folder` under the SHA-256 of the original bytes.
+
+    Parameters:
+    - cache_folder (str): where normalized images are kept.
+    - max_tokens (int): image token budget; the API charges about width * height / 750 tokens.
+    """
+    PIXELS_PER_TOKEN = 750
+    MEDIA_TYPES = {'PNG': 'image/png', 'JPEG': 'image/jpeg', 'WEBP': 'image/webp'}
+    EXTENSIONS = {'image/png': 'png', 'image/jpeg': 'jpg', 'image/webp': 'webp'}
+
+    def __init__(self, cache_folder, max_tokens=1600, max_long_edge=1568, grayscale=True, jpeg_quality=85):
+        self.cache_folder = cache_folder
+        self.max_tokens = max_tokens
+        self.max_long_edge = max_long_edge
+        self.grayscale = grayscale
+        self.jpeg_quality = jpeg_quality
+
+        # Different settings produce different images, so they get their own cache entries
+        settings = f'{max_tokens}-{max_long_edge}-{grayscale}-{jpeg_quality}'
+        self.settings_hash = hashlib.sha256(settings.encode('utf-8')).hexdigest()[:8]
+
+    @classmethod
+    def estimate_tokens(cls, width, height):
+        return round(width * height / cls.PIXELS_PER_TOKEN)
+
+    def normalize(self, data):
+        """Returns a `NormalizedImage` for the image `data` (bytes)."""
+        if Image is None:
+            return NormalizedImage(data, None, len(data), None, None)
+
+        try:
+            image = Image.open(io.BytesIO(data))
+        except OSError:
+            # Not something Pillow can read; upload it as it is
+            return NormalizedImage(data, None, len(data), None, None)
+
+        with image:
+            original_tokens = self.estimate_tokens(*image.size)
+
+            cache_path = self._cache_path(data)
+            for media_type, extension in self.EXTENSIONS.items():
+                if os.path.exists(f'{cache_path}.{extension}'):
+                    with open(f'{cache_path}.{extension}', 'rb') as file:
+                        normalized = file.read()
+                    with Image.open(io.BytesIO(normalized)) as normalized_image:
+                        tokens = self.estimate_tokens(*normalized_image.size)
+                    return NormalizedImage(normalized, media_type, len(data), original_tokens, tokens)
+
+            image = self._resize(image.convert('L' if self.grayscale else 'RGB'))
+            normalized, media_type = self._smallest_encoding(image)
+            tokens = self.estimate_tokens(*image.size)
+
+        os.makedirs(self.cache_folder, exist_ok=True)
+        with open(f'{cache_path}.{self.EXTENSIONS[media_type]}', 'wb') as file:
+            file.write(normalized)
+
+        return NormalizedImage(normalized, media_type, len(data), original_tokens, tokens)
+
+    def _cache_path(self, data):
+        return f'{self.cache_folder}/{hashlib.sha256(data).hexdigest()}-{self.settings_hash}'
+
+    def _resize(self, image):
+        width, height = image.size
+        scale = min(1,
+                    (self.max_tokens * self.PIXELS_PER_TOKEN / (width * height)) ** 0.5,
+                    self.max_long_edge / max(width, height))
+        if scale == 1:
+            return image
+        return image.resize((max(1, int(width * scale)), max(1, int(height * scale))), Image.LANCZOS)
+
+    def _smallest_encoding(self, image):
+        encodings = []
+        for image_format, media_type in self.MEDIA_TYPES.items():
+            buffer = io.BytesIO()
+            try:
+                if image_format == 'PNG':
+                    image.save(buffer, format='PNG', optimize=True)
+                else:
+                    image.save(buffer, format=image_format, quality=self.jpeg_quality)
+            except (KeyError, OSError):
+                # This Pillow build can't write the format
+                continue
+            encodings.append((buffer.getvalue(), media_type))
+        return min(encodings, key=lambda encoding: len(encoding[0]))
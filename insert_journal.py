@@ -0,0 +1,151 @@
+import json
+import os
+
+class InsertJournal:
+    """
+    Write-ahead journal of the insert in progress. A run that dies part way through
+    (a network error, Ctrl-C, or the debug `input()` prompt) pays for none of its
+    comparisons again, and it never leaves the ranked folder half renamed.
+
+    insert.journal has one JSON line per operation, appended and fsynced before the
+    operation is applied:
+    - {"op": "start", "filename", "num_ranked"}: `ResumeSorter.insert()` started ranking `filename`
+    - {"op": "verdict", "opponent", "model", "n", "comparison"}: the result of one comparison
+    - {"op": "renames", "moves": [[source, target], ...]}: a batch of renames (paths relative
+      to the resume folder)
+    The journal is emptied once the resume is in the ranked folder.
+
+    `open()` finishes any batch of renames that was cut short by making every move
+    whose source still exists. Each file moves at most once per batch, so this is
+    safe to repeat. If an insert was in progress, its verdicts are kept. `start()`,
+    called for the same resume against a ranked folder of the same size, replays them
+    in order instead of asking Claude, which rebuilds the search exactly where it stopped.
+    """
+    def __init__(self, resume_folder):
+        self.resume_folder = resume_folder
+        self.path = f'./{resume_folder}/insert.journal'
+
+        # The insert that was cut short: {'filename', 'num_ranked', 'verdicts'}, or None
+        self.pending = None
+
+        # The "start" operation and the verdicts of the insert in progress, and how many
+        # of those verdicts have been replayed
+        self.operations = []
+        self.num_replayed = 0
+
+    @classmethod
+    def open(cls, resume_folder):
+        """Load the journal and finish any renames it lists."""
+        journal = cls(resume_folder)
+
+        pending = None
+        for operation in journal._read():
+            if operation['op'] == 'start':
+                pending = {'filename': operation['filename'], 'num_ranked': operation['num_ranked'], 'verdicts': []}
+            elif operation['op'] == 'verdict' and pending is not None:
+                pending['verdicts'].append(operation)
+            elif operation['op'] == 'renames':
+                journal._apply(operation['moves'])
+                if pending is None:
+                    continue
+                # The resume being ranked has either moved into the ranked folder (the insert
+                # was finished) or changed extension (see `ResumeSorter._swap_mediatype_if_needed`)
+                for source, target in operation['moves']:
+                    if source == f'unranked/{pending["filename"]}':
+                        pending['filename'] = target.split('/', 1)[1] if target.startswith('unranked/') else None
+                if pending['filename'] is None:
+                    pending = None
+
+        journal.pending = pending
+        if pending is None:
+            journal.clear()
+        return journal
+
+    def start(self, filename, num_ranked):
+        """Start journalling the insert of `filename`; replays the verdicts of an earlier, cut short, insert of it."""
+        pending, self.pending = self.pending, None
+        self.num_replayed = 0
+        if pending is not None and (pending['filename'], pending['num_ranked']) == (filename, num_ranked):
+            self.operations = [{'op': 'start', 'filename': filename, 'num_ranked': num_ranked}, *pending['verdicts']]
+            print(f'Replaying {len(pending["verdicts"])} comparisons of {filename} from the journal')
+            self._rewrite()
+            return
+
+        self.operations = [{'op': 'start', 'filename': filename, 'num_ranked': num_ranked}]
+        self._rewrite()
+
+    def replayed(self, opponent, model, n):
+        """
+        The journalled comparison that comes next, if the search is asking the same question
+        (opponent, model and best of n) as it did before the crash; otherwise None.
+        """
+        verdicts = self.operations[1:]
+        if self.num_replayed == len(verdicts):
+            return None
+
+        verdict = verdicts[self.num_replayed]
+        if (verdict['opponent'], verdict['model'], verdict['n']) != (opponent, model, n):
+            # The search has gone another way; the rest of the verdicts don't apply
+            del self.operations[1 + self.num_replayed:]
+            self._rewrite()
+            return None
+
+        self.num_replayed += 1
+        return verdict['comparison']
+
+    def replaying(self):
+        """Whether journalled verdicts are still waiting to be replayed."""
+        return self.num_replayed < len(self.operations) - 1
+
+    def record(self, opponent, model, n, comparison):
+        """Journal the result of a comparison Claude just made."""
+        verdict = {'op': 'verdict', 'opponent': opponent, 'model': model, 'n': n,
+                   'comparison': {key: value for key, value in comparison.items() if key != 'claude_response'}}
+        self._log(verdict)
+        self.operations.append(verdict)
+        self.num_replayed += 1
+
+    def rename(self, moves):
+        """Journal a batch of (source, target) renames, then make them."""
+        self._log({'op': 'renames', 'moves': [list(move) for move in moves]})
+        self._apply(moves)
+
+    def clear(self):
+        """The insert is done (or there was none); nothing is left to replay or finish."""
+        self.operations = []
+        self.num_replayed = 0
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def _apply(self, moves):
+        for source, target in moves:
+            if os.path.exists(f'./{self.resume_folder}/{source}'):
+                os.rename(f'./{self.resume_folder}/{source}', f'./{self.resume_folder}/{target}')
+
+    def _log(self, operation):
+        with open(self.path, 'a') as file:
+            file.write(json.dumps(operation) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+
+    def _rewrite(self):
+        """Atomically replace the journal with `self.operations`."""
+        temp_path = f'{self.path}.tmp'
+        with open(temp_path, 'w') as file:
+            file.writelines(json.dumps(operation) + '\n' for operation in self.operations)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, self.path)
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return []
+        operations = []
+        with open(self.path, 'r') as file:
+            for line in file:
+                try:
+                    operations.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # The last line was cut off by a crash; it was never applied
+                    break
+        return operations
@@ -0,0 +1,218 @@
+import argparse
+import json
+import os
+import socket
+import sqlite3
+import time
+from resume_comparer import LLMResumeComparer
+from telemetry import Telemetry
+
+class JobQueue:
+    """
+    Durable queue of comparison jobs in SQLite, shared by one coordinator
+    (`ResumeSorter.insert_all(distributed=True)`) and any number of `Worker`
+    processes, on this machine or any machine that can open the file.
+
+    A job is one best of n: the two resumes (filenames and SHA-256 of their
+    contents), the model and n. A worker leases a job for `lease_seconds`.
+    If the worker dies, the lease runs out and another worker takes the job.
+    A job that fails `max_attempts` times is marked 'failed'.
+
+    `put()` is idempotent: asking for a job that is already queued or done returns
+    the same job. A restarted coordinator therefore picks up the verdicts made
+    before it stopped.
+
+    Parameters:
+    - path (str): the SQLite file.
+    - clock (callable): seconds, for the leases (time.time, which is shared between processes).
+    """
+    def __init__(self, path, lease_seconds=300, max_attempts=3, clock=time.time):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.clock = clock
+
+        # Autocommit; transactions that need to be atomic are opened explicitly
+        self.connection = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY,
+                identity TEXT NOT NULL UNIQUE,
+                job TEXT NOT NULL,
+                status TEXT NOT NULL,
+                worker TEXT,
+                lease_expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                result TEXT
+            )""")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    @classmethod
+    def for_folder(cls, resume_folder, **queue_kwargs):
+        return cls(f'./{resume_folder}/jobs.sqlite', **queue_kwargs)
+
+    @staticmethod
+    def identity(job):
+        """What makes two jobs the same question."""
+        return json.dumps([job['key'], job['to_be_ranked_hash'], job['opponent_hash'], job['model'], job['n']])
+
+    def put(self, job):
+        """Queue `job` (a dict, see `ResumeSorter._queue_job`); returns its id."""
+        identity = self.identity(job)
+        self.connection.execute("INSERT OR IGNORE INTO jobs (identity, job, status) VALUES (?, ?, 'pending')",
+                                (identity, json.dumps(job)))
+        return self.connection.execute("SELECT id FROM jobs WHERE identity=?", (identity,)).fetchone()[0]
+
+    def lease(self, worker):
+        """
+        The oldest job that is pending or whose lease ran out, leased to `worker`,
+        as (id, job); None if there is none.
+        """
+        now = self.clock()
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.connection.execute(
+                "SELECT id, job FROM jobs WHERE status='pending' OR (status='leased' AND lease_expires < ?) "
+                "ORDER BY id LIMIT 1", (now,)).fetchone()
+            if row is not None:
+                self.connection.execute("UPDATE jobs SET status='leased', worker=?, lease_expires=?, attempts=attempts+1 "
+                                        "WHERE id=?", (worker, now + self.lease_seconds, row[0]))
+            self.connection.execute("COMMIT")
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        return None if row is None else (row[0], json.loads(row[1]))
+
+    def complete(self, job_id, result):
+        """
+        Post a job's result. A late result from a worker whose lease ran out still
+        counts, if no other worker posted one first. Returns whether it was taken.
+        """
+        cursor = self.connection.execute("UPDATE jobs SET status='done', result=? WHERE id=? AND status != 'done'",
+                                         (json.dumps(result), job_id))
+        return cursor.rowcount == 1
+
+    def fail(self, job_id, error):
+        """Give a job back after an error. After `max_attempts` leases it is marked 'failed'."""
+        self.connection.execute(
+            "UPDATE jobs SET status=CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+            "worker=NULL, lease_expires=NULL, error=? WHERE id=? AND status='leased'",
+            (self.max_attempts, str(error), job_id))
+
+    def results(self, job_ids):
+        """{id: result} of the jobs in `job_ids` that are done. Raises RuntimeError if one of them failed."""
+        results = {}
+        for job_id, status, result, error in self.connection.execute(
+                f"SELECT id, status, result, error FROM jobs WHERE id IN ({','.join('?' * len(job_ids))}) "
+                "AND status IN ('done', 'failed')", list(job_ids)):
+            if status == 'failed':
+                raise RuntimeError(f'job {job_id} failed {self.max_attempts} times: {error}')
+            results[job_id] = json.loads(result)
+        return results
+
+    def counts(self):
+        """Number of jobs per status."""
+        return dict(self.connection.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    def open(self):
+        """A coordinator is running: idle workers wait for jobs instead of stopping."""
+        self.connection.execute("INSERT OR REPLACE INTO meta VALUES ('open', '1')")
+
+    def finish(self):
+        """The run is over: its jobs are deleted and idle workers stop."""
+        self.connection.execute("DELETE FROM jobs")
+        self.connection.execute("INSERT OR REPLACE INTO meta VALUES ('open', '0')")
+
+    def is_open(self):
+        row = self.connection.execute("SELECT value FROM meta WHERE key='open'").fetchone()
+        return row is None or row[0] == '1'
+
+    def close(self):
+        self.connection.close()
+
+class Worker:
+    """
+    Leases jobs from a `JobQueue`, makes the comparison with an `LLMResumeComparer`
+    of its own and posts the verdict back. Start as many as the rate limits allow,
+    each with its own API key if you have several (`api_key`, else ANTHROPIC_API_KEY).
+    Resumes are read from `resume_folder`, which every worker must be able to see.
+    A job whose files don't hash to what the coordinator saw fails instead of being
+    compared.
+
+    Parameters:
+    - worker_id (str): name in the queue and in the worker's metrics file; defaults to host:pid.
+    - poll_interval (float): seconds between looks at an empty queue.
+    """
+    def __init__(self, resume_folder, queue, worker_id=None, api_key=None, poll_interval=1.0, resume_comparer=None):
+        self.queue = queue
+        self.worker_id = worker_id or f'{socket.gethostname()}:{os.getpid()}'
+        self.poll_interval = poll_interval
+        self.resume_comparer = resume_comparer or LLMResumeComparer(
+            resume_folder, telemetry=Telemetry.for_folder(resume_folder, self.worker_id))
+        if api_key is not None:
+            self.resume_comparer.client = self.resume_comparer.client.with_options(api_key=api_key)
+        self.num_jobs = 0
+
+    def run(self, idle_timeout=None, max_jobs=None):
+        """
+        Work until the coordinator has finished and the queue is empty, or after
+        `idle_timeout` seconds without a job, or after `max_jobs` jobs.
+        """
+        idle_since = time.monotonic()
+        while max_jobs is None or self.num_jobs < max_jobs:
+            leased = self.queue.lease(self.worker_id)
+            if leased is None:
+                if not self.queue.is_open():
+                    break
+                if idle_timeout is not None and time.monotonic() - idle_since > idle_timeout:
+                    break
+                time.sleep(self.poll_interval)
+                continue
+
+            job_id, job = leased
+            try:
+                result = self.compare(job)
+            except Exception as error:
+                print(f'{self.worker_id}: job {job_id} failed: {error!r}')
+                self.queue.fail(job_id, repr(error))
+            else:
+                self.queue.complete(job_id, result)
+            self.num_jobs += 1
+            idle_since = time.monotonic()
+        print(f'{self.worker_id}: {self.num_jobs} jobs, calls={self.resume_comparer.num_calls}')
+
+    def compare(self, job):
+        """Best of n on `job`. Returns the deciding comparison and the calls it took per model."""
+        resume_comparer = self.resume_comparer
+        hashes = (resume_comparer.image_hash(False, job['to_be_ranked']),
+                  resume_comparer.image_hash(job['opponent_is_ranked'], job['opponent']))
+        if hashes != (job['to_be_ranked_hash'], job['opponent_hash']):
+            raise ValueError(f"{job['to_be_ranked']} or {job['opponent']} is not the file the coordinator saw")
+
+        num_calls_before = dict(resume_comparer.num_calls)
+        resume_comparer.model = job['model']
+        comparison = resume_comparer.best_of_n(job['n'], job['to_be_ranked'], job['opponent'],
+                                               opponent_is_ranked=job['opponent_is_ranked'])
+        calls = {model: resume_comparer.num_calls[model] - num_calls_before.get(model, 0) for model in resume_comparer.num_calls}
+        return {'comparison': comparison, 'calls': calls, 'worker': self.worker_id}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rank resumes with a coordinator and any number of worker processes.')
+    parser.add_argument('role', choices=['coordinator', 'worker'])
+    parser.add_argument('resume_folder')
+    parser.add_argument('--queue', help='the SQLite job queue (default: RESUME_FOLDER/jobs.sqlite)')
+    parser.add_argument('--worker-id')
+    parser.add_argument('--api-key-env', help='environment variable holding this worker\'s API key')
+    parser.add_argument('--idle-timeout', type=float, help='stop a worker after this many seconds without a job')
+    args = parser.parse_args()
+
+    if args.role == 'coordinator':
+        from resume_sorter import ResumeSorter
+        ResumeSorter(args.resume_folder, strategy='binary').insert_all(distributed=True, queue_path=args.queue)
+    else:
+        queue = JobQueue(args.queue) if args.queue else JobQueue.for_folder(args.resume_folder)
+        api_key = os.environ[args.api_key_env] if args.api_key_env else None
+        Worker(args.resume_folder, queue, args.worker_id, api_key).run(idle_timeout=args.idle_timeout)
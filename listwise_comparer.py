@@ -0,0 +1,279 @@
+import json
+import random
+import re
+from concurrent.futures import ThreadPoolExecutor
+from comparison_store import ComparisonStore
+from rating_engine import RatingEngine
+from tournament import estimate_insert_all
+
+class ListwiseComparer:
+    """
+    Ranks up to `k` resumes in one call: the images are labelled "Resume 1" to
+    "Resume k" and Claude answers with a `record_ranking` tool call listing every
+    label, best first. One call tells the k(k-1)/2 pairwise verdicts that a pairwise
+    comparison would need as many calls for.
+
+    The resumes are shown in a new random order on every call, so the position bias
+    of long contexts (favouring the first or last image) turns into noise rather than
+    a systematic lean. A ranking that doesn't list every label exactly once is asked
+    again, shuffled anew, up to `max_attempts` times.
+
+    Each ranking is stored in the `ComparisonStore` as pairwise verdicts under its
+    own prompt hash: the resume shown first is Resume A. A `RatingEngine` given this
+    comparer (`listwise=`) fits them along with the pairwise ones.
+
+    Parameters:
+    - resume_comparer (LLMResumeComparer): reads the images and makes the calls, with its `model`.
+    - k (int): most resumes per call.
+    - max_workers (int): most calls in flight at once.
+    """
+    LIST_PROMPT = """You are an expert software engineering recruiter tasked with ranking several resumes for an early-career software engineering position. Each resume is preceded by its label.
+
+Judge the candidates on the following criteria:
+   - Relevance and amount of work experience
+   - Depth and breadth of technical skills
+   - Education and academic performance
+   - Project experience and its relevance to software engineering
+   - Evidence of problem-solving abilities and initiative
+
+IGNORE certifications (such as those from Coursera or other MOOCs), leadership roles and extracurricular activities, grades from before university, and how far into the degree the candidate is.
+
+The order the resumes are shown in means nothing. Do not write out your analysis. Record every resume's label, from the strongest candidate to the weakest, with the record_ranking tool."""
+
+    RANKING_TOOL = {
+        "name": "record_ranking",
+        "description": "Record the resumes in order, strongest candidate first.",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "ranking": {
+                    "type": "array",
+                    "items": {"type": "string"},
+                    "description": "Every resume label (e.g. \"Resume 3\") exactly once, strongest first."
+                }
+            },
+            "required": ["ranking"]
+        }
+    }
+
+    MAX_TOKENS = 200
+    MAX_K = 10
+
+    def __init__(self, resume_comparer, k=6, max_workers=16, max_attempts=3, seed=None):
+        if not 2 <= k <= self.MAX_K:
+            raise ValueError(f'k must be between 2 and {self.MAX_K}')
+        self.resume_comparer = resume_comparer
+        self.model = resume_comparer.model
+        self.k = k
+        self.max_workers = max_workers
+        self.max_attempts = max_attempts
+        self.random = random.Random(seed)
+        self.prompt_hash = ComparisonStore.hash_prompt('\n'.join([self.LIST_PROMPT, json.dumps(self.RANKING_TOOL)]))
+
+        # The k(k-1)/2 verdicts of one call share its mistakes; together they count about as much as k - 1 votes
+        self.pair_weight = 2 / k
+
+        # (a_hash, b_hash, model) -> verdicts stored for that pair, i.e. the next one's `sample`
+        self.samples = {}
+        store = resume_comparer.comparison_store
+        if store is not None:
+            for a_hash, b_hash, model, sample, _ in store.verdicts(self.prompt_hash):
+                self.samples[(a_hash, b_hash, model)] = max(self.samples.get((a_hash, b_hash, model), 0), sample + 1)
+
+        self.num_calls = 0
+        self.num_unreadable = 0
+
+    def rank_groups(self, groups):
+        """
+        Rank each group of images (dicts with 'filename', 'hash', 'type' and 'data';
+        at most `k` per group) in one concurrent wave. Returns, for each group, the
+        indices into the group from best to worst, or None if no readable ranking came back.
+        """
+        if any(len(group) > self.k for group in groups):
+            raise ValueError(f'at most {self.k} resumes per call')
+
+        orders = [None if len(group) > 1 else list(range(len(group))) for group in groups]
+        undecided = [g for g, order in enumerate(orders) if order is None]
+        for attempt in range(self.max_attempts):
+            if not undecided:
+                break
+            shown = {g: self.random.sample(range(len(groups[g])), len(groups[g])) for g in undecided}
+            print(f"Ranking resumes... ({len(undecided)} groups of up to {self.k} at once)")
+            with ThreadPoolExecutor(max_workers=min(len(undecided), self.max_workers)) as executor:
+                futures = {g: executor.submit(self._request_ranking, [groups[g][i] for i in shown[g]]) for g in undecided}
+
+            for g, future in futures.items():
+                self.num_calls += 1
+                self.resume_comparer.num_calls[self.model] += 1
+                ranking = future.result()
+                if ranking is None:
+                    self.num_unreadable += 1
+                    continue
+                orders[g] = [shown[g][position] for position in ranking]
+                self._store([groups[g][i] for i in shown[g]], ranking)
+            undecided = [g for g in undecided if orders[g] is None]
+            if undecided:
+                print(f"WARNING: could not read {len(undecided)} rankings (attempt {attempt + 1} of {self.max_attempts})")
+        return orders
+
+    def _request_ranking(self, images):
+        """One call; returns the positions in `images`, best first, or None."""
+        resume_comparer = self.resume_comparer
+        content = [{"type": "text", "text": self.LIST_PROMPT}]
+        for position, image in enumerate(images):
+            content.append({"type": "text", "text": f"Resume {position + 1}:"})
+            content.append({"type": "image", "source": {"type": "base64", "media_type": f"image/{image['type']}",
+                                                        "data": image['data']}})
+        params = dict(
+            model=resume_comparer.SONNET if self.model == 'sonnet' else resume_comparer.HAIKU,
+            max_tokens=self.MAX_TOKENS,
+            temperature=resume_comparer.temperature,
+            messages=[{"role": "user", "content": content}],
+            tools=[self.RANKING_TOOL],
+            tool_choice={"type": "tool", "name": self.RANKING_TOOL['name']})
+
+        stats = {}
+        message = resume_comparer._schedule(params, self.model, stats)
+
+        usage = {'model': self.model, 'to_be_ranked': images[0]['filename'], 'opponent': None}
+        for key in resume_comparer.TOKEN_KEYS:
+            usage[key] = getattr(message.usage, key, None) or 0
+        resume_comparer.token_usage.append(usage)
+        if resume_comparer.telemetry:
+            resume_comparer.telemetry.record(self.model, usage['to_be_ranked'], None, usage, stats)
+
+        for block in message.content:
+            if block.type == 'tool_use' and block.name == self.RANKING_TOOL['name']:
+                return self.parse_ranking(block.input.get('ranking'), len(images))
+        return None
+
+    @staticmethod
+    def parse_ranking(ranking, num_resumes):
+        """
+        The positions (0 for "Resume 1") in the order of `ranking`, a list of labels;
+        None unless every label from 1 to `num_resumes` is there exactly once.
+        """
+        if not isinstance(ranking, list):
+            return None
+        positions = []
+        for label in ranking:
+            match = re.fullmatch(r'(?:resume\s*)?(\d+)', str(label).strip(), re.IGNORECASE)
+            if match is None:
+                return None
+            positions.append(int(match.group(1)) - 1)
+        return positions if sorted(positions) == list(range(num_resumes)) else None
+
+    @staticmethod
+    def pairwise(order):
+        """The (better, worse) pairs implied by `order`, best first."""
+        return [(better, worse) for i, better in enumerate(order) for worse in order[i + 1:]]
+
+    def _store(self, images, ranking):
+        """Store the verdicts of one ranking; `images` in the order shown, `ranking` as positions, best first."""
+        store = self.resume_comparer.comparison_store
+        if store is None:
+            return
+        labels = json.dumps([f'Resume {position + 1}' for position in ranking])
+        for better, worse in self.pairwise(ranking):
+            a, b = min(better, worse), max(better, worse)
+            a_hash, b_hash = images[a]['hash'], images[b]['hash']
+            if a_hash == b_hash:
+                continue
+            sample = self.samples.get((a_hash, b_hash, self.model), 0)
+            self.samples[(a_hash, b_hash, self.model)] = sample + 1
+            store.put(a_hash, b_hash, self.model, self.prompt_hash, sample,
+                      'Resume A' if better == a else 'Resume B', labels)
+
+class ListwiseSort:
+    """
+    Ranks resumes with a `ListwiseComparer`, about n / k calls per round.
+
+    A `RatingEngine` is fitted to the pairwise verdicts of every ranking so far.
+    1. `random_rounds` rounds of groups drawn at random: every resume meets resumes
+       from across the pool, which places it roughly.
+    2. Then rounds of neighbours: the fitted order is cut into runs of k, shifted by
+       k / 2 every other round so that no boundary between runs stays put, and each
+       run is ranked. These settle the order where the fit is least sure.
+    The order returned is the last fit with each run of the last round put in the
+    order Claude ranked it in. A fit can leave two resumes the wrong way round even
+    when every verdict agrees, if one of them met stronger opponents. Stops once
+    two rounds in a row (both shifts) agree with the fit, or after `max_rounds`.
+
+    Parameters:
+    - listwise (ListwiseComparer): makes the calls.
+    - items (list): (filename, is_ranked) pairs; `is_ranked` says which folder the file is in.
+    """
+    def __init__(self, listwise, items, random_rounds=2, max_rounds=12, seed=None):
+        self.listwise = listwise
+        self.items = list(items)
+        self.random_rounds = random_rounds
+        self.max_rounds = max_rounds
+        self.random = random.Random(seed)
+        self.engine = RatingEngine(listwise.resume_comparer, self.items, listwise=listwise)
+        self.rounds = 0
+        self.num_calls = 0
+        self.num_pairs = 0
+
+    def run(self):
+        """Returns the order as (filename, is_ranked) pairs, best first."""
+        engine, k = self.engine, self.listwise.k
+        calls_before = self.listwise.num_calls
+        num_ratings = len(engine.images)
+        # The fitted order as ratings, best first, with the last round's rankings applied
+        order = None
+        still_rounds = 0
+
+        while self.rounds < self.max_rounds and num_ratings > 1 and still_rounds < 2:
+            if self.rounds < self.random_rounds:
+                positions, offset = self.random.sample(range(num_ratings), num_ratings), 0
+            else:
+                engine.fit()
+                ranks = engine.ranks()
+                order = sorted(range(num_ratings), key=lambda rating: ranks[rating])
+                positions, offset = list(order), (self.rounds - self.random_rounds) % 2 * (k // 2)
+
+            runs = self._runs(num_ratings, offset)
+            rankings = self.listwise.rank_groups([[engine.images[rating] for rating in positions[start:end]]
+                                                  for start, end in runs])
+            moved = 0
+            for (start, end), ranking in zip(runs, rankings):
+                if ranking is None:
+                    continue
+                group = positions[start:end]
+                engine.add_ranking([engine.images[group[i]]['hash'] for i in ranking],
+                                   self.listwise.model, self.listwise.pair_weight)
+                self.num_pairs += len(ranking) * (len(ranking) - 1) // 2
+                if order is not None:
+                    order[start:end] = [group[i] for i in ranking]
+                    moved += sum(i != place for place, i in enumerate(ranking))
+            self.rounds += 1
+
+            if order is None:
+                print(f'Round {self.rounds}: {len(runs)} rankings of random groups')
+            else:
+                still_rounds = still_rounds + 1 if moved == 0 else 0
+                print(f'Round {self.rounds}: {len(runs)} rankings of neighbours, {moved} resumes moved')
+
+        self.num_calls += self.listwise.num_calls - calls_before
+        if order is None:
+            engine.fit()
+            return engine.order()
+        place = {rating: rank for rank, rating in enumerate(order)}
+        positions = sorted(range(len(self.items)), key=lambda position: (place[engine.rating_of[position]], position))
+        return [self.items[position] for position in positions]
+
+    def _runs(self, num_ratings, offset):
+        """(start, end) of the runs of k that positions are cut into, the first `offset` long; runs of one are left out."""
+        bounds = [0, *range(offset or self.listwise.k, num_ratings, self.listwise.k), num_ratings]
+        return [(start, end) for start, end in zip(bounds, bounds[1:]) if end - start > 1]
+
+    def report(self):
+        """Calls and rounds used, next to the `insert_all()` estimate for the same folder."""
+        insert_all_calls, insert_all_rounds = estimate_insert_all(len(self.items))
+        report = {'resumes': len(self.items), 'k': self.listwise.k,
+                  'calls': self.num_calls, 'rounds': self.rounds, 'pairwise_verdicts': self.num_pairs,
+                  'unreadable': self.listwise.num_unreadable,
+                  'insert_all_calls': insert_all_calls, 'insert_all_rounds': insert_all_rounds}
+        print(f"listwise: {report['calls']} calls ({report['pairwise_verdicts']} pairwise verdicts) in {report['rounds']} rounds; "
+              f"insert_all would take about {insert_all_calls} calls in {insert_all_rounds} rounds")
+        return report
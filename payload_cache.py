@@ -0,0 +1,77 @@
+from collections import OrderedDict
+import os
+import threading
+
+class PayloadCache:
+    """
+    In-memory LRU cache of encoded resume payloads, bounded by `max_bytes`.
+
+    Files are recognised by (device, inode), which `os.rename` keeps, so moving a
+    resume between 'unranked' and 'ranked' does not force it to be read again.
+    An entry is only trusted while the file's size and mtime are unchanged.
+
+    Payloads are stored by the content hash the loader reports, so two files with
+    the same content share one entry.
+    """
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+
+        # (st_dev, st_ino) -> (st_size, st_mtime_ns, content hash)
+        self._identities = {}
+        # content hash -> payload dict, least recently used first
+        self._payloads = OrderedDict()
+        self.num_bytes = 0
+
+        self.hits, self.misses, self.invalidations, self.evictions = 0, 0, 0, 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def payload_size(payload):
+        return len(payload['data'])
+
+    def get(self, path, load):
+        """
+        The payload for the file at `path`. On a miss `load()` is called; it must
+        return a dict with at least 'data' (the encoded payload) and 'hash'.
+        """
+        stat = os.stat(path)
+        identity = (stat.st_dev, stat.st_ino)
+        version = (stat.st_size, stat.st_mtime_ns)
+
+        with self._lock:
+            if identity in self._identities:
+                *cached_version, content_hash = self._identities[identity]
+                if tuple(cached_version) != version:
+                    self.invalidations += 1
+                    del self._identities[identity]
+                elif content_hash in self._payloads:
+                    self.hits += 1
+                    self._payloads.move_to_end(content_hash)
+                    return self._payloads[content_hash]
+            self.misses += 1
+
+        payload = load()
+
+        with self._lock:
+            self._identities[identity] = (*version, payload['hash'])
+            if payload['hash'] not in self._payloads:
+                self._payloads[payload['hash']] = payload
+                self.num_bytes += self.payload_size(payload)
+                self._evict()
+        return payload
+
+    def _evict(self):
+        while self.num_bytes > self.max_bytes and len(self._payloads) > 1:
+            _, payload = self._payloads.popitem(last=False)
+            self.num_bytes -= self.payload_size(payload)
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0,
+                'invalidations': self.invalidations,
+                'evictions': self.evictions,
+                'entries': len(self._payloads),
+                'bytes': self.num_bytes}
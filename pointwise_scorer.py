@@ -0,0 +1,149 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from comparison_store import ComparisonStore
+
+class PointwiseScorer:
+    """
+    Gives every resume an absolute score from 1 to 100: one Haiku call per resume,
+    answered with a `record_score` tool call. The calls are made concurrently. Scores
+    are kept in scores.json by SHA-256 of the file, so a resume is never scored twice.
+
+    The scores are too coarse to rank with; `ResumeSorter` uses them as a prior, to
+    start `find_rank()` where similarly scored resumes already sit (see `window()`).
+
+    Parameters:
+    - resume_comparer (LLMResumeComparer): reads the images and makes the calls.
+    - max_workers (int): most calls in flight at once.
+    """
+    SCORE_PROMPT = """You are an expert software engineering recruiter tasked with scoring a resume for an early-career software engineering position.
+
+Judge the candidate on the following criteria:
+   - Relevance and amount of work experience
+   - Depth and breadth of technical skills
+   - Education and academic performance
+   - Project experience and its relevance to software engineering
+   - Evidence of problem-solving abilities and initiative
+
+IGNORE certifications (such as those from Coursera or other MOOCs), leadership roles and extracurricular activities, grades from before university, and how far into the degree the candidate is.
+
+Do not write out your analysis. Record a score from 1 (weakest) to 100 (strongest) with the record_score tool."""
+
+    SCORE_TOOL = {
+        "name": "record_score",
+        "description": "Record how strong the resume is.",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "score": {"type": "integer", "minimum": 1, "maximum": 100}
+            },
+            "required": ["score"]
+        }
+    }
+
+    MAX_TOKENS = 50
+
+    def __init__(self, resume_comparer, max_workers=16):
+        self.resume_comparer = resume_comparer
+        self.max_workers = max_workers
+        self.path = f'./{resume_comparer.resume_folder}/scores.json'
+        self.prompt_hash = ComparisonStore.hash_prompt('\n'.join([self.SCORE_PROMPT, json.dumps(self.SCORE_TOOL)]))
+
+        # SHA-256 -> score, for the current prompt
+        self.scores = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as file:
+                saved = json.load(file)
+            if saved.get('prompt_hash') == self.prompt_hash:
+                self.scores = saved['scores']
+
+        self.num_calls = 0
+
+    def score_all(self, items):
+        """
+        Score every (filename, is_ranked) pair that has no score yet.
+        Returns filename -> score; a resume Claude gave no score is left out.
+        """
+        images = {filename: self.resume_comparer.get_image(is_ranked, filename) for filename, is_ranked in items}
+        missing = {}
+        for filename, image in images.items():
+            if image['hash'] not in self.scores:
+                missing.setdefault(image['hash'], (filename, image))
+
+        if missing:
+            print(f'Scoring {len(missing)} resumes ({len(images) - len(missing)} already scored)')
+            with ThreadPoolExecutor(max_workers=min(len(missing), self.max_workers)) as executor:
+                futures = {image_hash: executor.submit(self._score, filename, image)
+                           for image_hash, (filename, image) in missing.items()}
+            for image_hash, future in futures.items():
+                score = future.result()
+                self.num_calls += 1
+                self.resume_comparer.num_calls['haiku'] += 1
+                if score is not None:
+                    self.scores[image_hash] = score
+            self._save()
+
+        return {filename: self.scores[image['hash']] for filename, image in images.items() if image['hash'] in self.scores}
+
+    def _score(self, filename, image):
+        """One Haiku call; returns the score, or None if Claude didn't give one."""
+        resume_comparer = self.resume_comparer
+        params = dict(
+            model=resume_comparer.HAIKU,
+            max_tokens=self.MAX_TOKENS,
+            temperature=0,
+            messages=[{"role": "user", "content": [
+                {"type": "text", "text": self.SCORE_PROMPT},
+                {"type": "image", "source": {"type": "base64", "media_type": f"image/{image['type']}", "data": image['data']}}
+            ]}],
+            tools=[self.SCORE_TOOL],
+            tool_choice={"type": "tool", "name": self.SCORE_TOOL['name']})
+
+        stats = {}
+        message = resume_comparer._schedule(params, 'haiku', stats, 'explore')
+
+        usage = {'model': 'haiku', 'to_be_ranked': filename, 'opponent': None}
+        for key in resume_comparer.TOKEN_KEYS:
+            usage[key] = getattr(message.usage, key, None) or 0
+        resume_comparer.token_usage.append(usage)
+        if resume_comparer.telemetry:
+            resume_comparer.telemetry.record('haiku', filename, None, usage, stats)
+
+        for block in message.content:
+            if block.type == 'tool_use' and block.name == self.SCORE_TOOL['name']:
+                score = block.input.get('score')
+                return score if isinstance(score, (int, float)) else None
+        return None
+
+    def _save(self):
+        temp_path = f'{self.path}.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump({'prompt_hash': self.prompt_hash, 'scores': self.scores}, file, indent=4)
+        os.replace(temp_path, self.path)
+
+    @staticmethod
+    def window(score, ranked_scores, tolerance=5):
+        """
+        Where to search for a resume scoring `score`, from the scores of the ranked
+        resumes (`ranked_scores`, best first; None where a resume has no score).
+        Returns (start, lo, hi): `start` is the median rank of the ranked resumes scored
+        within `tolerance` of it, and range(lo, hi + 1) spans all of their ranks. If
+        none are that close, the window is the gap between the ranked resumes scored
+        just above and just below it. Returns None when nothing is scored.
+        """
+        scored = [(rank, other) for rank, other in enumerate(ranked_scores) if other is not None]
+        if not scored:
+            return None
+
+        close = [rank for rank, other in scored if abs(other - score) <= tolerance]
+        if close:
+            return close[len(close) // 2], close[0], close[-1] + 1
+
+        above = [rank for rank, other in scored if other > score]
+        below = [rank for rank, other in scored if other < score]
+        lo = max(above) + 1 if above else 0
+        hi = min(below) if below else len(ranked_scores)
+        if lo > hi:
+            # The scores disagree with the ranking around here
+            lo, hi = min(lo, hi), max(lo, hi)
+        return (lo + hi) // 2, lo, hi
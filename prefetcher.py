@@ -0,0 +1,119 @@
+from concurrent.futures import ThreadPoolExecutor
+from random import randint
+
+class Prefetcher:
+    """
+    Speculative Haiku votes for `ResumeSorter`'s walk. Once the first best of n
+    has set the direction, each step compares the resume with the next ranked
+    resume in that direction, so the opponents of the next `depth` steps are known
+    in advance. They are sent together, in background threads, while the walk waits
+    on the current one. A long walk then takes about one round trip per `depth`
+    steps instead of one per step.
+
+    A vote is made like `LLMResumeComparer.main()` would make it (random A/B labels,
+    the comparer's prompt), and stored in the `ComparisonStore` as that pair's first
+    Haiku vote when it comes back. The walk's own call for that step then finds it
+    there. When the walk stops (or turns), votes not yet sent are cancelled; those
+    already sent are stored all the same, for a later run to find, and counted as wasted.
+
+    Only the main thread touches the store; the threads just make the calls.
+
+    Parameters:
+    - resume_comparer (LLMResumeComparer): makes the calls.
+    - depth (int): steps ahead to send votes for.
+    """
+    MODEL = 'haiku'
+
+    def __init__(self, resume_comparer, depth=3):
+        if depth < 1:
+            raise ValueError('depth must be at least 1')
+        self.resume_comparer = resume_comparer
+        self.depth = depth
+        self.executor = ThreadPoolExecutor(max_workers=depth + 1)
+
+        # (to_be_ranked, opponent) -> (resumes, future), for the walk in progress
+        self.in_flight = {}
+        # The same, left over from walks that are over
+        self.stale = {}
+
+        self.stats = {'sent': 0, 'used': 0, 'wasted': 0, 'cancelled': 0}
+
+    def prefetch(self, to_be_ranked, opponents):
+        """Send votes of `to_be_ranked` against each of `opponents` (ranked filenames), unless already sent or stored."""
+        self._harvest(wait=False)
+        for opponent in opponents:
+            if (to_be_ranked, opponent) in self.in_flight:
+                continue
+            resumes = self.resume_comparer._build_resumes(to_be_ranked, opponent)
+            to_be_ranked_is_A = False
+            if randint(0, 1):
+                resumes, to_be_ranked_is_A = self.resume_comparer._swap(resumes), True
+            if self._stored(resumes):
+                continue
+            future = self.executor.submit(self.resume_comparer._request_comparison, resumes, to_be_ranked_is_A, self.MODEL,
+                                          lane='explore')
+            self.in_flight[(to_be_ranked, opponent)] = (resumes, future)
+
+    def collect(self, to_be_ranked, opponent):
+        """
+        Wait for the vote on this pair, if one was sent, and store it; the walk's
+        own call then reads it from the store. Returns whether there was one to use.
+        """
+        entry = self.in_flight.pop((to_be_ranked, opponent), None)
+        if entry is None:
+            return False
+        comparison = self._store(*entry)
+        if comparison['winner'] is not None:
+            self.stats['used'] += 1
+            return True
+        return False
+
+    def cancel(self):
+        """The walk is over: cancel votes not yet sent; the others are stored as they come back."""
+        for key, (resumes, future) in self.in_flight.items():
+            if future.cancel():
+                self.stats['cancelled'] += 1
+            else:
+                self.stale[key] = (resumes, future)
+        self.in_flight = {}
+
+    def finish(self):
+        """Wait for the votes still out and store them. Returns `report()`."""
+        self.cancel()
+        self._harvest(wait=True)
+        return self.report()
+
+    def report(self):
+        """Prints and returns how many speculative votes were sent, used, wasted and cancelled."""
+        stats = dict(self.stats)
+        print(f"prefetch: {stats['sent']} speculative votes sent, {stats['used']} used by the walk, "
+              f"{stats['wasted']} wasted (kept in the comparison store), {stats['cancelled']} cancelled before sending")
+        return stats
+
+    def _harvest(self, wait):
+        """Store the votes of walks that are over as they come back (all of them, waiting, with `wait`); they are wasted."""
+        for key, (resumes, future) in list(self.stale.items()):
+            if wait or future.done():
+                del self.stale[key]
+                try:
+                    self._store(resumes, future)
+                except Exception as error:
+                    # No step is waiting on it, so the error need not stop the run
+                    print(f'WARNING: speculative vote {key} failed: {error!r}')
+                    continue
+                self.stats['wasted'] += 1
+
+    def _store(self, resumes, future):
+        """Count the call and store its vote; returns the comparison."""
+        comparison, _ = future.result()
+        self.stats['sent'] += 1
+        self.resume_comparer.num_calls[self.MODEL] += 1
+        self.resume_comparer._remember(resumes, self.MODEL, {}, comparison)
+        return comparison
+
+    def _stored(self, resumes):
+        store = self.resume_comparer.comparison_store
+        if store is None:
+            return False
+        return store.contains([(resumes['Resume A']['hash'], resumes['Resume B']['hash'], self.MODEL, self.resume_comparer.prompt_hash, 0),
+                               (resumes['Resume B']['hash'], resumes['Resume A']['hash'], self.MODEL, self.resume_comparer.prompt_hash, 0)])
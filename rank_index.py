@@ -0,0 +1,308 @@
+import json
+import os
+import random
+from rankstring import RankString
+
+class _Node:
+    __slots__ = ('value', 'priority', 'size', 'left', 'right', 'parent')
+
+    def __init__(self, value):
+        self.value = value
+        self.priority = random.random()
+        self.size = 1
+        self.left = None
+        self.right = None
+        self.parent = None
+
+def _size(node):
+    return node.size if node is not None else 0
+
+def _update(node):
+    node.size = 1 + _size(node.left) + _size(node.right)
+    for child in (node.left, node.right):
+        if child is not None:
+            child.parent = node
+    return node
+
+def _split(node, k):
+    """Split into (first k values, the rest)."""
+    if node is None:
+        return None, None
+    if _size(node.left) < k:
+        left, right = _split(node.right, k - _size(node.left) - 1)
+        node.right = left
+        return _update(node), right
+    left, right = _split(node.left, k)
+    node.left = right
+    return left, _update(node)
+
+def _merge(left, right):
+    if left is None or right is None:
+        return left or right
+    if left.priority > right.priority:
+        left.right = _merge(left.right, right)
+        return _update(left)
+    right.left = _merge(left, right.left)
+    return _update(right)
+
+class RankedList:
+    """
+    A list that supports insert, pop, indexing and `index()` in O(log n) (an implicit
+    treap). Used instead of a Python list so that inserting into 800+ ranked resumes
+    does not shift every entry below the insertion point. Values must be hashable
+    and distinct, as the names of ranked resumes are.
+    """
+    def __init__(self, values=()):
+        self.root = None
+        # value -> its node, for `index()`
+        self.nodes = {}
+        for value in values:
+            self.nodes[value] = _Node(value)
+            self.root = _merge(self.root, self.nodes[value])
+        self._set_root(self.root)
+
+    def __len__(self):
+        return _size(self.root)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if index not in range(len(self)):
+            raise IndexError('RankedList index out of range')
+
+        node = self.root
+        while True:
+            left_size = _size(node.left)
+            if index < left_size:
+                node = node.left
+            elif index == left_size:
+                return node.value
+            else:
+                index -= left_size + 1
+                node = node.right
+
+    def __iter__(self):
+        stack, node = [], self.root
+        while stack or node is not None:
+            while node is not None:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            yield node.value
+            node = node.right
+
+    def index(self, value):
+        """Position of `value`, by walking up from its node."""
+        if value not in self.nodes:
+            raise ValueError(f'{value!r} is not in RankedList')
+        node = self.nodes[value]
+        index = _size(node.left)
+        while node.parent is not None:
+            if node is node.parent.right:
+                index += _size(node.parent.left) + 1
+            node = node.parent
+        return index
+
+    def insert(self, index, value):
+        self.nodes[value] = _Node(value)
+        left, right = _split(self.root, index)
+        self._set_root(_merge(_merge(left, self.nodes[value]), right))
+
+    def pop(self, index):
+        if index not in range(len(self)):
+            raise IndexError('pop index out of range')
+        left, right = _split(self.root, index)
+        middle, right = _split(right, 1)
+        self._set_root(_merge(left, right))
+        return self.nodes.pop(middle.value).value
+
+    def _set_root(self, root):
+        self.root = root
+        if root is not None:
+            root.parent = None
+
+class RankIndex:
+    """
+    The ranking, kept in `rankings.json` instead of in the filenames.
+
+    rankings.json has the shape {name: {"rank": 0, "comparisons": {}, "path": "..."}},
+    where `name` is the resume's original filename and `path` is its current
+    filename in the ranked folder. Files are not renamed when ranks change;
+    `export()` writes the NNN-filename layout once, at the end.
+
+    Every change is appended to `rankings.journal` before it is applied, and
+    `checkpoint()` atomically rewrites rankings.json and empties the journal, so
+    a crash never loses or half-applies a change.
+    """
+    def __init__(self, resume_folder):
+        self.resume_folder = resume_folder
+        self.json_path = f'./{resume_folder}/rankings.json'
+        self.journal_path = f'./{resume_folder}/rankings.journal'
+
+        # name -> entry dict (without "rank")
+        self.entries = {}
+        # names, best first
+        self.names = RankedList()
+        # path -> name, for `rank_of()`
+        self.paths = {}
+
+    @classmethod
+    def open(cls, resume_folder):
+        """
+        Load the index. A resume that the index ranks but that is still in the
+        unranked folder (a crash between logging and moving it) is moved into
+        place. If the index is missing, or the ranked folder was changed without
+        it, it is rebuilt from the NNN-filename prefixes.
+        """
+        index = cls(resume_folder)
+        index._load()
+
+        ranked_folder, unranked_folder = f'./{resume_folder}/ranked', f'./{resume_folder}/unranked'
+        unranked = set(os.listdir(unranked_folder))
+        for name, entry in index.entries.items():
+            if not os.path.exists(f'{ranked_folder}/{entry["path"]}') and name in unranked:
+                os.rename(f'{unranked_folder}/{name}', f'{ranked_folder}/{entry["path"]}')
+
+        on_disk = set(os.listdir(ranked_folder))
+        if {entry['path'] for entry in index.entries.values()} != on_disk:
+            if os.path.exists(index.json_path):
+                print('rankings.json does not match the ranked folder; rebuilding it from the filenames')
+            index = cls(resume_folder)
+            index._import_ranked_folder(on_disk)
+        index.checkpoint()
+        return index
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, rank):
+        """The filename in the ranked folder of the resume at `rank`."""
+        return self.entries[self.names[rank]]['path']
+
+    def __iter__(self):
+        for name in self.names:
+            yield self.entries[name]['path']
+
+    def name_at(self, rank):
+        return self.names[rank]
+
+    def rank_of(self, path):
+        """The rank of the resume whose filename in the ranked folder is `path`, in O(log n)."""
+        return self.names.index(self.paths[path])
+
+    def insert(self, rank, name, path=None):
+        if name in self.entries:
+            raise ValueError(f'{name} is already ranked')
+        self._log({'op': 'insert', 'rank': rank, 'name': name, 'path': path or name})
+        self._insert(rank, name, path or name)
+
+    def remove(self, rank):
+        """Remove the resume at `rank` and return its entry (including "name")."""
+        self._log({'op': 'remove', 'rank': rank})
+        return self._remove(rank)
+
+    def set_path(self, rank, path):
+        self._log({'op': 'set_path', 'rank': rank, 'path': path})
+        self._set_path(rank, path)
+
+    def checkpoint(self):
+        """Atomically rewrite rankings.json and empty the journal."""
+        rankings = {}
+        for rank, name in enumerate(self.names):
+            rankings[name] = {'rank': rank, **self.entries[name]}
+
+        temp_path = f'{self.json_path}.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump(rankings, file, indent=4)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, self.json_path)
+
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+
+    def export(self, width=None):
+        """
+        Rename the ranked folder to the NNN-filename layout. `width` defaults to
+        the number of digits the largest rank needs (at least 3).
+        """
+        rank_string = RankString(width or max(3, len(str(len(self) - 1))))
+
+        moves = []
+        for rank, name in enumerate(self.names):
+            target = rank_string.add_rankstring_to_filename(name, rank)
+            if self.entries[name]['path'] != target:
+                moves.append((rank, name, target))
+
+        # Files whose current name is another file's target step out of the way first
+        ranked_folder = f'./{self.resume_folder}/ranked'
+        targets = {target for _, _, target in moves}
+        for rank, name, target in moves:
+            if self.entries[name]['path'] in targets:
+                temp_path = f'.{rank}.{name}.tmp'
+                os.rename(f'{ranked_folder}/{self.entries[name]["path"]}', f'{ranked_folder}/{temp_path}')
+                self.set_path(rank, temp_path)
+
+        for rank, name, target in moves:
+            os.rename(f'{ranked_folder}/{self.entries[name]["path"]}', f'{ranked_folder}/{target}')
+            self.set_path(rank, target)
+
+        self.checkpoint()
+        print(f'Exported {len(self)} ranked resumes ({len(moves)} renamed)')
+
+    def _insert(self, rank, name, path):
+        self.entries[name] = {'comparisons': {}, 'path': path}
+        self.names.insert(rank, name)
+        self.paths[path] = name
+
+    def _remove(self, rank):
+        name = self.names.pop(rank)
+        entry = self.entries.pop(name)
+        del self.paths[entry['path']]
+        return {'name': name, **entry}
+
+    def _set_path(self, rank, path):
+        entry = self.entries[self.names[rank]]
+        del self.paths[entry['path']]
+        entry['path'] = path
+        self.paths[path] = self.names[rank]
+
+    def _log(self, operation):
+        with open(self.journal_path, 'a') as file:
+            file.write(json.dumps(operation) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+
+    def _load(self):
+        if os.path.exists(self.json_path):
+            with open(self.json_path, 'r') as file:
+                rankings = json.load(file)
+            for name, entry in sorted(rankings.items(), key=lambda item: item[1]['rank']):
+                self.entries[name] = {key: value for key, value in entry.items() if key != 'rank'}
+                self.entries[name].setdefault('comparisons', {})
+                self.entries[name].setdefault('path', name)
+            self.names = RankedList(sorted(rankings, key=lambda name: rankings[name]['rank']))
+            self.paths = {entry['path']: name for name, entry in self.entries.items()}
+
+        if not os.path.exists(self.journal_path):
+            return
+
+        with open(self.journal_path, 'r') as file:
+            lines = file.readlines()
+        for line in lines:
+            try:
+                operation = json.loads(line)
+            except json.JSONDecodeError:
+                # The last line was cut off by a crash; it was never applied
+                break
+            if operation['op'] == 'insert':
+                self._insert(operation['rank'], operation['name'], operation['path'])
+            elif operation['op'] == 'remove':
+                self._remove(operation['rank'])
+            elif operation['op'] == 'set_path':
+                self._set_path(operation['rank'], operation['path'])
+
+    def _import_ranked_folder(self, filenames):
+        rank_string = RankString()
+        for rank, filename in enumerate(sorted(filenames, key=rank_string.sort_key)):
+            self._insert(rank, rank_string.rm_rankstring_from_filename(filename), filename)
@@ -0,0 +1,349 @@
+from collections import namedtuple
+from cascade_policy import Option
+
+# One comparison the search wants made: the ranked resume at `rank`, which model, best of `n`,
+# and the `RequestScheduler` lane it waits in
+SearchStep = namedtuple('SearchStep', ['rank', 'model', 'n', 'lane'], defaults=['default'])
+
+class BinaryInsertionSearch:
+    """
+    Noisy binary search for the insertion rank of one resume.
+
+    The search never calls the LLM itself: ask it for the `next_step()`, make that
+    comparison, then `record()` whether the to-be-ranked resume won. This keeps it
+    usable from the synchronous sorter as well as from anything that batches calls.
+
+    Algorithm:
+    1. Sonnet (best of `first_n`) at the median, where a wrong step costs the most
+    2. Haiku (best of 1) to halve the remaining window until it is empty
+    3. Confirm both neighbours of the final rank with Sonnet (best of `confirm_n`)
+    4. If a confirmation disagrees, reopen the window on that side up to the
+       nearest Sonnet verdict and search again (at most `max_backtracks` times)
+
+    With a `policy` (see `CascadePolicy`), the model and number of votes of steps 1
+    and 2 are chosen for each step by how far apart the two resumes are expected
+    to be: a quarter of the window.
+
+    Parameters:
+    - num_ranked (int): number of resumes already ranked.
+    - lo, hi (int): optional starting window; the final rank is searched for in `range(lo, hi+1)`.
+    - policy (CascadePolicy): optional; replaces the fixed schedule of steps 1 and 2.
+    """
+    def __init__(self, num_ranked, first_n=3, confirm_n=1, max_backtracks=2, lo=0, hi=None, policy=None):
+        self.num_ranked = num_ranked
+        self.first_n = first_n
+        self.confirm_n = confirm_n
+        self.max_backtracks = max_backtracks
+        self.policy = policy
+
+        # The final rank lies in range(lo, hi + 1)
+        self.lo = lo
+        self.hi = num_ranked if hi is None else hi
+
+        # rank -> (is_win, model) for every comparison recorded so far
+        self.verdicts = {}
+        self.history = []
+        self.backtracks = 0
+        self.rank = None
+
+        self._pending = None
+
+    def next_step(self):
+        """Returns the next `SearchStep`, or `None` once `self.rank` is final."""
+        if self._pending is not None:
+            return self._pending
+
+        while self.rank is None:
+            if self.lo < self.hi:
+                mid = (self.lo + self.hi) // 2
+                if self._is_confirmed(mid):
+                    # Sonnet already decided this one; don't pay for it again
+                    self._narrow(mid, self.verdicts[mid][0])
+                    continue
+
+                if self.policy is not None:
+                    option = self.policy.choose(max(1, (self.hi - self.lo + 1) // 4))
+                    self._pending = SearchStep(mid, option.model, option.n, 'default' if not self.history else 'explore')
+                elif not self.history:
+                    self._pending = SearchStep(mid, 'sonnet', self.first_n)
+                else:
+                    self._pending = SearchStep(mid, 'haiku', 1, 'explore')
+                return self._pending
+
+            step = self._next_confirmation(self.lo)
+            if step is None:
+                self.rank = self.lo
+            else:
+                self._pending = step
+                return step
+
+        return None
+
+    def record(self, is_win):
+        """Record the outcome of the step returned by `next_step()`."""
+        if self._pending is None:
+            raise ValueError('no comparison is pending')
+        step, self._pending = self._pending, None
+
+        self.history.append((step, is_win))
+        self.verdicts[step.rank] = (is_win, step.model)
+
+        if self.lo < self.hi:
+            self._narrow(step.rank, is_win)
+            return
+
+        # This was a confirmation of the neighbours of `self.lo`
+        expected_win = step.rank == self.lo
+        if is_win != expected_win:
+            self._backtrack(step.rank, is_win)
+
+    @property
+    def num_steps(self):
+        return len(self.history)
+
+    def _narrow(self, rank, is_win):
+        """Win against `rank` means we belong at or above it; loss means below it."""
+        if is_win:
+            self.hi = rank
+        else:
+            self.lo = rank + 1
+
+    def _is_confirmed(self, rank):
+        return rank in self.verdicts and self.verdicts[rank][1] == 'sonnet'
+
+    def _next_confirmation(self, rank):
+        """Sonnet check against the resumes directly above and below `rank`."""
+        if self.backtracks >= self.max_backtracks:
+            return None
+
+        # Should lose against rank - 1 and win against rank
+        for neighbour in (rank - 1, rank):
+            if neighbour not in range(self.num_ranked):
+                continue
+            if not self._is_confirmed(neighbour):
+                if self.policy is not None:
+                    # Not the policy's choice, but part of the projected cost
+                    self.policy.project(Option('sonnet', self.confirm_n), 1)
+                return SearchStep(neighbour, 'sonnet', self.confirm_n, 'confirm')
+
+        return None
+
+    def _backtrack(self, rank, is_win):
+        """
+        A confirmation contradicted the window, so some Haiku verdict on that
+        side was wrong. Reopen the window on that side up to the nearest Sonnet
+        verdict (or the end of the list) and search it again.
+        """
+        self.backtracks += 1
+
+        if is_win:
+            # Beat the resume above us, so our rank is at most `rank`
+            self.hi = rank
+            sonnet_losses = [r for r in range(rank) if self._is_confirmed(r) and not self.verdicts[r][0]]
+            self.lo = max(sonnet_losses) + 1 if sonnet_losses else 0
+        else:
+            # Lost to the resume below us, so our rank is at least `rank + 1`
+            self.lo = rank + 1
+            sonnet_wins = [r for r in range(rank + 1, self.num_ranked) if self._is_confirmed(r) and self.verdicts[r][0]]
+            self.hi = min(sonnet_wins) if sonnet_wins else self.num_ranked
+
+def merge_sort_network(num_items):
+    """
+    Batcher's odd-even merge sort as a list of rounds; each round is a list of
+    (i, j) comparators with i < j, and no position appears twice in a round.
+    A comparator puts the better of the items at positions i and j at position i.
+
+    The network is built for the next power of two. Positions past `num_items`
+    are treated as worse than everything, so their comparators never swap and
+    are left out.
+    """
+    size = 1
+    while size < num_items:
+        size *= 2
+
+    rounds = []
+    p = 1
+    while p < size:
+        k = p
+        while k >= 1:
+            comparators = []
+            for j in range(k % p, size - k, 2 * k):
+                for i in range(k):
+                    low, high = i + j, i + j + k
+                    if low // (2 * p) == high // (2 * p) and high < num_items:
+                        comparators.append((low, high))
+            if comparators:
+                rounds.append(comparators)
+            k //= 2
+        p *= 2
+    return rounds
+
+# A comparison handed out by `ConcurrentInsertion`; `key` identifies the search (or gap comparator) it belongs to
+Job = namedtuple('Job', ['key', 'to_be_ranked', 'opponent', 'opponent_is_ranked', 'model', 'n', 'lane'], defaults=['default'])
+
+class ConcurrentInsertion:
+    """
+    Inserts many resumes into a fixed snapshot of the ranked list.
+
+    1. Every resume runs its own `BinaryInsertionSearch` against the snapshot. These
+       comparisons are independent of each other, so they can all be in flight at once.
+    2. Resumes that landed in the same gap of the snapshot are ordered among
+       themselves by a sorting network (see `merge_sort_network`), one `gap_model`
+       vote per comparator. Every comparator of a round can be in flight at once, and
+       each gap moves on to its next round on its own. A fresh intake (empty snapshot)
+       lands entirely in one gap, so it takes O(log^2 n) rounds, not one per comparison.
+
+    The network trades calls for rounds: it makes O(n log^2 n) comparisons where
+    binary insertion makes O(n log n). A fresh intake of 300 resumes is 45 rounds
+    and 5,417 calls; inserting them one at a time is about 2,500 calls (1,600 Haiku,
+    900 Sonnet), but 2,200 rounds. That is why the comparators are Haiku by default:
+    at 12 Haiku calls to a Sonnet one, the network then costs less than half as much
+    as binary insertion, at the price of Haiku's accuracy on close pairs, which a
+    network doesn't correct. With `gap_model='sonnet'` it costs about 5 times as much
+    as binary insertion. `estimate_calls()` gives the calls per model of a run.
+
+    Hand out comparisons with `pending_jobs()`, report each verdict with `record()`
+    and read `final_order()` once `done` is True.
+
+    Parameters:
+    - candidates (list): filenames in the unranked folder.
+    - ranked_filenames (list): snapshot of the ranked folder, best first.
+    - gap_model (str): model of the comparators that order a gap.
+    """
+    def __init__(self, candidates, ranked_filenames, gap_model='haiku', **search_kwargs):
+        self.candidates = list(candidates)
+        self.ranked_filenames = list(ranked_filenames)
+        self.gap_model = gap_model
+
+        # key -> search; phase 1 keys are candidate filenames
+        self._searches = {candidate: BinaryInsertionSearch(len(self.ranked_filenames), **search_kwargs)
+                          for candidate in self.candidates}
+        self._in_flight = set()
+
+        # Phase 2: gap index -> its candidates, in network order so far
+        self.gaps = None
+        # gap index -> rounds of comparators still to run (the first is in progress), and its verdicts so far
+        self._rounds = None
+        self._verdicts = None
+
+    @property
+    def done(self):
+        return self.gaps is not None and not self._rounds
+
+    @staticmethod
+    def estimate_rounds(num_candidates, num_ranked):
+        """
+        Rounds (waves of comparisons that have to wait for the previous one) needed to
+        insert `num_candidates` resumes into `num_ranked`, assuming every vote agrees and
+        the candidates spread evenly over the gaps. With `num_ranked=0` (a fresh intake)
+        it is exact: the depth of one network over every candidate.
+        """
+        search = BinaryInsertionSearch(num_ranked)
+        rounds = 0
+        while (step := search.next_step()) is not None:
+            rounds += 1
+            search.record(step.rank >= num_ranked // 2)
+        gap_size = -(-num_candidates // (num_ranked + 1))
+        return rounds + len(merge_sort_network(gap_size))
+
+    @staticmethod
+    def estimate_calls(num_candidates, num_ranked, gap_model='haiku'):
+        """
+        Calls per model (one per vote) needed to insert `num_candidates` resumes into
+        `num_ranked`, under the same assumptions as `estimate_rounds()`.
+        """
+        calls = {'haiku': 0, 'sonnet': 0}
+        search = BinaryInsertionSearch(num_ranked)
+        while (step := search.next_step()) is not None:
+            calls[step.model] += num_candidates * ((step.n + 1) // 2)
+            search.record(step.rank >= num_ranked // 2)
+
+        num_gaps = min(num_candidates, num_ranked + 1)
+        if num_gaps:
+            gap_size, num_larger = divmod(num_candidates, num_gaps)
+            for size, count in ((gap_size + 1, num_larger), (gap_size, num_gaps - num_larger)):
+                calls[gap_model] += count * sum(map(len, merge_sort_network(size)))
+        return calls
+
+    def pending_jobs(self):
+        """Every comparison that can be made right now and has not been handed out yet."""
+        if self.gaps is not None:
+            return self._gap_jobs()
+
+        jobs = []
+        for key, search in self._searches.items():
+            if key in self._in_flight:
+                continue
+            step = search.next_step()
+            if step is None:
+                continue
+            self._in_flight.add(key)
+            jobs.append(self._job(key, step))
+
+        if not jobs and not self._in_flight and self.gaps is None:
+            self._start_ordering_gaps()
+            return self.pending_jobs()
+
+        return jobs
+
+    def record(self, job, is_win):
+        """Report whether `job.to_be_ranked` won the comparison `job`."""
+        self._in_flight.discard(job.key)
+        if self.gaps is None:
+            self._searches[job.key].record(is_win)
+            return
+
+        # Phase 2: the key is (gap, i, j), and `to_be_ranked` is the candidate at position j
+        gap, i, j = job.key
+        self._verdicts[gap][(i, j)] = is_win
+        comparators = self._rounds[gap][0]
+        if len(self._verdicts[gap]) < len(comparators):
+            return
+
+        order = self.gaps[gap]
+        for i, j in comparators:
+            if self._verdicts[gap][(i, j)]:
+                order[i], order[j] = order[j], order[i]
+        self._rounds[gap].pop(0)
+        self._verdicts[gap] = {}
+        if not self._rounds[gap]:
+            del self._rounds[gap]
+
+    def final_order(self):
+        """(filename, is_ranked) pairs, best first."""
+        if not self.done:
+            raise ValueError('insertion is not finished')
+
+        order = []
+        for gap, filename in enumerate(self.ranked_filenames + [None]):
+            order.extend((candidate, False) for candidate in self.gaps.get(gap, []))
+            if filename is not None:
+                order.append((filename, True))
+        return order
+
+    def _job(self, key, step):
+        return Job(key, key, self.ranked_filenames[step.rank], True, step.model, step.n, step.lane)
+
+    def _gap_jobs(self):
+        """The comparators of each gap's current round that have not been handed out yet."""
+        jobs = []
+        for gap, rounds in self._rounds.items():
+            order = self.gaps[gap]
+            for i, j in rounds[0]:
+                key = (gap, i, j)
+                if key in self._in_flight or (i, j) in self._verdicts[gap]:
+                    continue
+                self._in_flight.add(key)
+                jobs.append(Job(key, order[j], order[i], False, self.gap_model, 1))
+        return jobs
+
+    def _start_ordering_gaps(self):
+        self.gaps = {}
+        for candidate in self.candidates:
+            self.gaps.setdefault(self._searches[candidate].rank, []).append(candidate)
+        self._searches = {}
+
+        # A gap with one candidate needs no comparisons
+        networks = {gap: merge_sort_network(len(candidates)) for gap, candidates in self.gaps.items()}
+        self._rounds = {gap: network for gap, network in networks.items() if network}
+        self._verdicts = {gap: {} for gap in self._rounds}
@@ -2,12 +2,15 @@ class RankString:
     """
     A bunch of useful functions for dealing with the rank-based
     naming convention of the files.
+
+    `width` is the minimum number of digits; ranks that need more digits get them.
     """
+    def __init__(self, width=3):
+        self.width = width
 
-    @staticmethod
-    def string_from_rank(rank):
+    def string_from_rank(self, rank):
         rankstring = str(rank)
-        len_string = 3
+        len_string = self.width
 
         return "0" * (len_string - len(rankstring)) + rankstring
     
@@ -29,7 +32,20 @@ class RankString:
     @staticmethod
     def get_rankstring(filename):
         """123-my_filename.png -> (123, my_filename.png)"""
-        return filename[:3], filename[4:]
+        rankstring, _, og_filename = filename.partition('-')
+        return rankstring, og_filename
+
+    @staticmethod
+    def has_rankstring(filename):
+        rankstring, separator, _ = filename.partition('-')
+        return separator == '-' and rankstring.isdigit()
+
+    def sort_key(self, filename):
+        """Orders ranked filenames by rank, whatever their width; files without a rank go last."""
+        if self.has_rankstring(filename):
+            rankstring, og_filename = self.get_rankstring(filename)
+            return (int(rankstring), og_filename)
+        return (float('inf'), filename)
     
     def increment_ranked_filename(self, filename, by=1):
         rankstring, og_filename = self.get_rankstring(filename)
@@ -45,6 +61,8 @@ class RankString:
     
     def rm_rankstring_from_filename(self, filename):
         """012-my_bad_cv.png -> my_bad_cv.png"""
+        if not self.has_rankstring(filename):
+            return filename
         return self.get_rankstring(filename)[1]
     
     def is_rank_consecutive(self, filename1, filename2):
@@ -0,0 +1,241 @@
+from random import randint
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+class RatingEngine:
+    """
+    Ranks resumes with a Bradley-Terry model fitted to every stored comparison,
+    instead of fixing each resume's rank from the few comparisons of its insert.
+
+    Resume i has a score s_i and beats resume j with probability sigmoid(s_i - s_j).
+    The scores are the maximum a posteriori fit (Newton's method) under a Gaussian
+    prior, and the inverse of the Hessian gives each score's uncertainty.
+
+    Rounds:
+    1. Fit the scores to every verdict in the `ComparisonStore`
+    2. Ask Claude about the `pairs_per_round` disjoint pairs with the highest expected
+       information gain, 0.5 * log(1 + p(1-p) * Var(s_i - s_j)). Pairs whose outcome
+       is nearly certain, or whose difference is already pinned down, score low.
+    3. Every `len(items)` calls, compare the order with the one at the previous
+       check. Stop once every resume has been compared and the two orders agree
+       (Kendall tau of at least `stable_tau`), or after `max_calls` calls
+
+    Parameters:
+    - resume_comparer (LLMResumeComparer): makes the comparisons, with its `model`.
+    - items (list): (filename, is_ranked) pairs; `is_ranked` says which folder the file is in.
+    - prior_variance (float): how far apart scores are expected to be. It also keeps
+        the fit finite for a resume that has won (or lost) every comparison.
+    - listwise (ListwiseComparer): also fit the pairwise verdicts it has stored, see `add_ranking()`.
+    """
+    # Haiku is noisier than Sonnet, so its verdicts count for less
+    MODEL_WEIGHTS = {'sonnet': 1.0, 'haiku': 0.5}
+
+    def __init__(self, resume_comparer, items, prior_variance=4.0, pairs_per_round=8, stable_tau=0.95,
+                 max_calls=None, max_rounds=1000, listwise=None):
+        if np is None:
+            raise ImportError('RatingEngine needs numpy')
+
+        self.resume_comparer = resume_comparer
+        self.model = resume_comparer.model
+        self.items = list(items)
+        self.prior_variance = prior_variance
+        self.pairs_per_round = pairs_per_round
+        self.stable_tau = stable_tau
+        self.max_calls = max_calls
+        self.max_rounds = max_rounds
+        self.listwise = listwise
+
+        # One rating per distinct image; files with identical content share it
+        self.images, self.position, self.rating_of = [], {}, []
+        for filename, is_ranked in self.items:
+            image = resume_comparer.get_image(is_ranked, filename)
+            if image['hash'] not in self.position:
+                self.position[image['hash']] = len(self.images)
+                self.images.append({'filename': filename, **image})
+            self.rating_of.append(self.position[image['hash']])
+
+        num_ratings = len(self.images)
+        # wins[i, j]: weighted number of times resume i beat resume j
+        self.wins = np.zeros((num_ratings, num_ratings))
+        self.scores = np.zeros(num_ratings)
+        self.covariance = np.eye(num_ratings) * prior_variance
+
+        # (a_hash, b_hash) -> votes stored for that A/B order with `model`, i.e. the next vote's `sample`
+        self.samples = {}
+        self.num_calls = 0
+        self.rounds = 0
+
+        self._load_verdicts()
+
+    def _load_verdicts(self):
+        store = self.resume_comparer.comparison_store
+        if store is None:
+            return
+
+        for a_hash, b_hash, model, sample, winner in store.verdicts(self.resume_comparer.prompt_hash):
+            if model == self.model:
+                self.samples[(a_hash, b_hash)] = max(self.samples.get((a_hash, b_hash), 0), sample + 1)
+            if a_hash in self.position and b_hash in self.position and a_hash != b_hash:
+                self._add_verdict(a_hash, b_hash, model, winner)
+
+        if self.listwise is None:
+            return
+        for a_hash, b_hash, model, _, winner in store.verdicts(self.listwise.prompt_hash):
+            if a_hash in self.position and b_hash in self.position and a_hash != b_hash:
+                self._add_verdict(a_hash, b_hash, model, winner, self.listwise.pair_weight)
+
+    def _add_verdict(self, a_hash, b_hash, model, winner, weight=1.0):
+        a, b = self.position[a_hash], self.position[b_hash]
+        winner, loser = (a, b) if winner == 'Resume A' else (b, a)
+        self.wins[winner, loser] += self.MODEL_WEIGHTS.get(model, 1.0) * weight
+
+    def add_ranking(self, hashes, model, weight=1.0):
+        """
+        Add the pairwise verdicts implied by one ordering (`hashes`, best first), e.g.
+        from a `ListwiseComparer`. The k(k-1)/2 verdicts of one call are not independent,
+        so each counts `weight` (the comparer's `pair_weight`) of a pairwise vote.
+        """
+        for i, better in enumerate(hashes):
+            for worse in hashes[i + 1:]:
+                if better != worse:
+                    self._add_verdict(better, worse, model, 'Resume A', weight)
+
+    def _win_probabilities(self):
+        """p[i, j] = P(resume i beats resume j)."""
+        return 1 / (1 + np.exp(self.scores[None, :] - self.scores[:, None]))
+
+    def fit(self, max_iterations=50, tolerance=1e-8):
+        """Fit the scores to the verdicts so far and update their covariance."""
+        games = self.wins + self.wins.T
+        precision = 1 / self.prior_variance
+
+        for _ in range(max_iterations):
+            p = self._win_probabilities()
+            gradient = (self.wins - games * p).sum(axis=1) - precision * self.scores
+            curvature = games * p * (1 - p)
+            # Negative Hessian of the log posterior
+            hessian = np.diag(curvature.sum(axis=1) + precision) - curvature
+
+            step = np.linalg.solve(hessian, gradient)
+            self.scores = self.scores + step
+            if np.abs(step).max() < tolerance:
+                break
+
+        p = self._win_probabilities()
+        curvature = games * p * (1 - p)
+        self.covariance = np.linalg.inv(np.diag(curvature.sum(axis=1) + precision) - curvature)
+        return self.scores
+
+    def uncertainties(self):
+        """Standard deviation of each score."""
+        return np.sqrt(np.diag(self.covariance))
+
+    def expected_information_gain(self):
+        """gain[i, j]: what comparing resumes i and j is expected to tell us about the scores."""
+        variances = np.diag(self.covariance)
+        difference_variance = variances[:, None] + variances[None, :] - 2 * self.covariance
+        p = self._win_probabilities()
+        return 0.5 * np.log1p(p * (1 - p) * np.maximum(difference_variance, 0))
+
+    def select_pairs(self, num_pairs):
+        """The `num_pairs` most informative pairs, no resume in more than one of them."""
+        num_ratings = len(self.images)
+        gain = self.expected_information_gain()
+        gain[np.tril_indices(num_ratings)] = -np.inf
+
+        pairs, used = [], set()
+        for flat_index in np.argsort(gain, axis=None)[::-1]:
+            if len(pairs) == num_pairs:
+                break
+            i, j = divmod(int(flat_index), num_ratings)
+            if gain[i, j] == -np.inf:
+                break
+            if i in used or j in used:
+                continue
+            pairs.append((i, j))
+            used.update((i, j))
+        return pairs
+
+    def ask(self, pairs):
+        """Compare each pair (in parallel, see `LLMResumeComparer._cast_votes`) and add the verdicts."""
+        votes = []
+        for i, j in pairs:
+            resumes, to_be_ranked_is_A = {'Resume A': self.images[i], 'Resume B': self.images[j]}, True
+            if randint(0, 1):
+                resumes, to_be_ranked_is_A = self.resume_comparer._swap(resumes), False
+
+            order = (resumes['Resume A']['hash'], resumes['Resume B']['hash'])
+            sample = self.samples.get(order, 0)
+            self.samples[order] = sample + 1
+            votes.append((resumes, to_be_ranked_is_A, sample))
+
+        calls_before = sum(self.resume_comparer.num_calls.values())
+        comparisons = self.resume_comparer._cast_votes(votes)
+        self.num_calls += sum(self.resume_comparer.num_calls.values()) - calls_before
+
+        for (resumes, _, _), comparison in zip(votes, comparisons):
+            if comparison['winner'] is not None:
+                self._add_verdict(resumes['Resume A']['hash'], resumes['Resume B']['hash'], self.model, comparison['winner'])
+        return comparisons
+
+    def ranks(self):
+        """The rank of each rating, best first."""
+        ranks = np.empty(len(self.images), dtype=int)
+        ranks[np.argsort(-self.scores, kind='stable')] = np.arange(len(self.images))
+        return ranks
+
+    @staticmethod
+    def kendall_tau(ranks, other_ranks):
+        """1 if two rankings agree on every pair, -1 if they disagree on every pair."""
+        if len(ranks) < 2:
+            return 1.0
+        agreement = np.sign(ranks[:, None] - ranks[None, :]) * np.sign(other_ranks[:, None] - other_ranks[None, :])
+        return float(agreement.sum() / (len(ranks) * (len(ranks) - 1)))
+
+    def run(self):
+        """Ask for comparisons until the order is stable. Returns `order()`."""
+        self.fit()
+        checked_ranks, checked_calls = self.ranks(), self.num_calls
+
+        while self.rounds < self.max_rounds:
+            num_pairs = self.pairs_per_round
+            if self.max_calls is not None:
+                num_pairs = min(num_pairs, self.max_calls - self.num_calls)
+            pairs = self.select_pairs(num_pairs) if num_pairs > 0 else []
+            if not pairs:
+                break
+
+            self.ask(pairs)
+            self.rounds += 1
+            self.fit()
+
+            if self.num_calls - checked_calls < len(self.images):
+                continue
+
+            ranks = self.ranks()
+            tau = self.kendall_tau(checked_ranks, ranks)
+            checked_ranks, checked_calls = ranks, self.num_calls
+            print(f'Round {self.rounds}: {self.num_calls} calls, Kendall tau with the previous check {tau:.3f}')
+
+            all_compared = bool(((self.wins + self.wins.T).sum(axis=1) > 0).all())
+            if all_compared and tau >= self.stable_tau:
+                break
+
+        print(f'Rating finished after {self.rounds} rounds and {self.num_calls} calls')
+        return self.order()
+
+    def order(self):
+        """(filename, is_ranked) pairs, best first."""
+        ranks = self.ranks()
+        positions = sorted(range(len(self.items)), key=lambda position: (ranks[self.rating_of[position]], position))
+        return [self.items[position] for position in positions]
+
+    def ratings(self):
+        """{filename: {'score': ..., 'std': ...}} for every item."""
+        uncertainties = self.uncertainties()
+        return {filename: {'score': float(self.scores[self.rating_of[position]]),
+                           'std': float(uncertainties[self.rating_of[position]])}
+                for position, (filename, _) in enumerate(self.items)}
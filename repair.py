@@ -0,0 +1,152 @@
+from rating_engine import RatingEngine
+from tournament import estimate_insert_all
+from verdict_graph import VerdictGraph
+
+class Repair:
+    """
+    Re-checks a finished ranking against the stored verdicts and fixes only the
+    places where they disagree with it, instead of unranking every resume and
+    inserting it again.
+
+    1. Build a `VerdictGraph` of every stored vote between the ranked resumes.
+    2. Suspects: pairs whose evidence says the lower ranked resume is the better one,
+       and the pairs inside cycles (`VerdictGraph.cycles()`), where a single bad vote
+       can hide without contradicting its neighbours.
+    3. Ask the comparer's model `extra_votes` more times about each suspect, all in
+       one concurrent wave (new samples, alternating which resume is Resume A).
+    4. A suspect is confirmed if the evidence now sides with the order. The pairs
+       that still contradict the order, and the cycles that remain, each cover a
+       window of ranks; overlapping windows are merged. Each window is re-sorted by a
+       `RatingEngine` over its resumes, which fits every stored verdict between them
+       and asks at most `calls_per_resume` calls per resume, and put back in place.
+
+    A ranking the stored verdicts agree with costs nothing to check; each suspect
+    costs `extra_votes` calls plus its share of a small window.
+
+    Parameters:
+    - resume_comparer (LLMResumeComparer): makes the calls, with its `model`.
+    - ranked_filenames (list): the ranking to check, best first.
+    - extra_votes (int): new votes per suspect pair.
+    - calls_per_resume (int): calls a window's `RatingEngine` may make per resume in it.
+    - max_workers (int): calls in flight at once.
+    """
+    def __init__(self, resume_comparer, ranked_filenames, extra_votes=3, calls_per_resume=2, max_workers=16):
+        self.resume_comparer = resume_comparer
+        self.model = resume_comparer.model
+        self.ranked_filenames = list(ranked_filenames)
+        self.extra_votes = extra_votes
+        self.calls_per_resume = calls_per_resume
+        self.max_workers = max_workers
+
+        # hash -> rank; a file whose content is already ranked higher up shares that rank
+        self.rank_of = {}
+        for rank, filename in enumerate(self.ranked_filenames):
+            self.rank_of.setdefault(resume_comparer.image_hash(True, filename), rank)
+
+        store = resume_comparer.comparison_store
+        self.graph = VerdictGraph.from_store(store, resume_comparer.prompt_hash, hashes=self.rank_of)
+        for node, rank in self.rank_of.items():
+            self.graph.names[node] = self.ranked_filenames[rank]
+
+        # (a_hash, b_hash) -> votes stored for that A/B order with `model`, i.e. the next vote's `sample`
+        self.samples = {}
+        if store is not None:
+            for a_hash, b_hash, model, sample, _ in store.verdicts(resume_comparer.prompt_hash):
+                if model == self.model:
+                    self.samples[(a_hash, b_hash)] = max(self.samples.get((a_hash, b_hash), 0), sample + 1)
+
+        self.num_calls = 0
+        self.stats = {'suspects': 0, 'cycles': 0, 'confirmed': 0, 'windows': [], 'moved': 0}
+
+    def contradictions(self):
+        """(better_ranked, worse_ranked) hashes of the pairs whose evidence leans against the order."""
+        pairs = set()
+        for node, evidence in self.graph.evidence.items():
+            for other, log_odds in evidence.items():
+                if log_odds > 0 and self.rank_of[node] > self.rank_of[other]:
+                    pairs.add((other, node))
+        return pairs
+
+    def suspects(self):
+        """Contradicting pairs and the pairs inside cycles, each as (better_ranked, worse_ranked), and the cycles."""
+        cycles = self.graph.cycles()
+        pairs = self.contradictions()
+        for cycle in cycles:
+            members = set(cycle)
+            for node in cycle:
+                for other in self.graph.evidence[node]:
+                    if other in members:
+                        pairs.add(tuple(sorted((node, other), key=self.rank_of.get)))
+        return sorted(pairs, key=lambda pair: (self.rank_of[pair[0]], self.rank_of[pair[1]])), cycles
+
+    def requery(self, pairs):
+        """`extra_votes` new votes on each pair, sent together; every one is added to the graph."""
+        votes = []
+        for better, worse in pairs:
+            original = {'Resume A': self._image(better), 'Resume B': self._image(worse)}
+            for vote in range(self.extra_votes):
+                resumes = self.resume_comparer._swap(original) if vote % 2 else original
+                order = (resumes['Resume A']['hash'], resumes['Resume B']['hash'])
+                sample = self.samples.get(order, 0)
+                self.samples[order] = sample + 1
+                votes.append((resumes, False, sample))
+
+        calls_before = sum(self.resume_comparer.num_calls.values())
+        comparisons = self.resume_comparer._cast_votes(votes, self.max_workers)
+        self.num_calls += sum(self.resume_comparer.num_calls.values()) - calls_before
+
+        for (resumes, _, _), comparison in zip(votes, comparisons):
+            if comparison['winner'] is not None:
+                self.graph.add(resumes['Resume A']['hash'], resumes['Resume B']['hash'],
+                               comparison['winner'] == 'Resume A', self.model)
+
+    def windows(self):
+        """(first, last) ranks of the stretches of the order the evidence still disagrees with, merged where they overlap."""
+        spans = [(self.rank_of[better], self.rank_of[worse]) for better, worse in self.contradictions()]
+        spans += [(min(map(self.rank_of.get, cycle)), max(map(self.rank_of.get, cycle))) for cycle in self.graph.cycles()]
+
+        merged = []
+        for first, last in sorted(spans):
+            if merged and first <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], last))
+            else:
+                merged.append((first, last))
+        return merged
+
+    def run(self):
+        """Check the ranking and re-sort what needs it. Returns the new ranking, best first."""
+        pairs, cycles = self.suspects()
+        self.stats['suspects'], self.stats['cycles'] = len(pairs), len(cycles)
+        print(f'repair: {len(pairs)} suspect pairs ({len(cycles)} cycles) among {len(self.ranked_filenames)} ranked resumes')
+        if pairs:
+            self.requery(pairs)
+        self.stats['confirmed'] = sum(self.graph.evidence[better].get(worse, 0.0) > 0 for better, worse in pairs)
+        windows = self.stats['windows'] = self.windows()
+
+        order = list(self.ranked_filenames)
+        for first, last in windows:
+            print(f'repair: re-sorting ranks {first} to {last}')
+            items = [(filename, True) for filename in order[first:last + 1]]
+            engine = RatingEngine(self.resume_comparer, items, max_calls=self.calls_per_resume * len(items))
+            order[first:last + 1] = [filename for filename, _ in engine.run()]
+            self.num_calls += engine.num_calls
+
+        self.stats['moved'] = sum(before != after for before, after in zip(self.ranked_filenames, order))
+        return order
+
+    def report(self):
+        """What was checked, confirmed and re-sorted, next to the `insert_all()` estimate for ranking from scratch."""
+        insert_all_calls, _ = estimate_insert_all(len(self.ranked_filenames))
+        report = {'resumes': len(self.ranked_filenames),
+                  'verdicts': self.graph.num_verdicts,
+                  **self.stats,
+                  'calls': self.num_calls,
+                  'insert_all_calls': insert_all_calls}
+        print(f"repair: {report['suspects']} suspect pairs, {report['confirmed']} confirmed, "
+              f"{len(report['windows'])} windows re-sorted, {report['moved']} resumes moved; "
+              f"{report['calls']} calls, where ranking from scratch would take about {insert_all_calls}")
+        return report
+
+    def _image(self, node):
+        filename = self.ranked_filenames[self.rank_of[node]]
+        return {'filename': filename, **self.resume_comparer.get_image(True, filename)}
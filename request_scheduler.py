@@ -0,0 +1,351 @@
+from collections import namedtuple
+import asyncio
+import contextlib
+import heapq
+import itertools
+import random
+import threading
+import time
+import anthropic
+
+# Per-minute limits of one model
+RateLimits = namedtuple('RateLimits', ['requests', 'input_tokens', 'output_tokens'])
+
+# Anthropic's build tier 4 limits; pass your organisation's own to `RequestScheduler`
+DEFAULT_LIMITS = {'haiku': RateLimits(4000, 400_000, 80_000),
+                  'sonnet': RateLimits(4000, 400_000, 80_000)}
+
+# Lanes in the order they are served
+LANES = ('confirm', 'default', 'explore')
+
+# Errors worth asking again, after a pause
+RETRYABLE = ('rate_limited', 'overloaded', 'server', 'connection')
+
+# What an image counts for in the input token estimate; Claude scales larger images down to about this
+IMAGE_TOKENS = 1600
+
+def classify_error(error):
+    """
+    What went wrong with a call to Claude:
+    'rate_limited' (429), 'overloaded' (529), 'server' (other 5xx), 'connection',
+    'media_type' (400 about an image), 'bad_request', 'auth', 'client' or 'unknown'.
+    """
+    if isinstance(error, anthropic.RateLimitError):
+        return 'rate_limited'
+    if isinstance(error, anthropic.APIConnectionError):
+        return 'connection'
+    if isinstance(error, anthropic.APIStatusError):
+        if error.status_code == 529:
+            return 'overloaded'
+        if error.status_code >= 500:
+            return 'server'
+        if error.status_code == 400:
+            return 'media_type' if 'image' in str(error).lower() else 'bad_request'
+        if error.status_code in (401, 403):
+            return 'auth'
+        return 'client'
+    return 'unknown'
+
+def retry_after(error):
+    """Seconds the API asked us to wait, if it did."""
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+def estimate_input_tokens(params):
+    """Rough input tokens of a request: about 4 characters per text token, plus `IMAGE_TOKENS` per image."""
+    tokens = 0
+    for message in params['messages']:
+        content = message['content']
+        if isinstance(content, str):
+            tokens += len(content) // 4
+            continue
+        for block in content:
+            tokens += IMAGE_TOKENS if block['type'] == 'image' else len(block.get('text', '')) // 4
+    return tokens
+
+class TokenBucket:
+    """
+    Holds up to `capacity` tokens and refills at `capacity` per minute. Taking
+    more than is left is allowed once the bucket is full enough; the level can
+    also go negative when a call turns out to use more than was reserved.
+    """
+    def __init__(self, capacity, clock):
+        self.capacity = capacity
+        self.rate = capacity / 60
+        self.clock = clock
+        self.level = capacity
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def time_until(self, amount):
+        """Seconds until `amount` can be taken (at most a full bucket is ever waited for)."""
+        self._refill()
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing / self.rate)
+
+    def take(self, amount):
+        self._refill()
+        self.level -= amount
+
+    def give(self, amount):
+        self._refill()
+        self.level = min(self.capacity, self.level + amount)
+
+class LaneSemaphore:
+    """
+    An `asyncio.Semaphore` whose waiters are let in by lane (`LANES`), then in order
+    of arrival, so a 'confirm' call takes the next free slot ahead of 'explore' calls
+    that were waiting before it, whatever their model.
+    """
+    def __init__(self, value):
+        self.value = value
+        # heap of (lane index, arrival, future) waiting for a slot
+        self.waiters = []
+        self.arrivals = itertools.count()
+
+    async def acquire(self, lane='default'):
+        if self.value > 0 and not self.waiters:
+            self.value -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (LANES.index(lane), next(self.arrivals), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if not future.cancelled():
+                # The slot was handed over just before the cancellation
+                self.release()
+            raise
+
+    def release(self):
+        """Hand the slot to the first waiter still waiting, or free it."""
+        while self.waiters:
+            _, _, future = heapq.heappop(self.waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.value += 1
+
+    @contextlib.asynccontextmanager
+    async def slot(self, lane='default'):
+        await self.acquire(lane)
+        try:
+            yield
+        finally:
+            self.release()
+
+class RequestScheduler:
+    """
+    Every call to Claude goes through here, from sync and async comparers alike,
+    so that they share one view of the rate limits.
+
+    - Each model has three `TokenBucket`s: requests, input tokens and output tokens
+      per minute. A call reserves 1 request, its estimated input tokens and its
+      `max_tokens`; the difference with the `usage` of the reply is given back.
+    - Calls wait in lanes (`LANES`), chosen where the call is made: a confirmation
+      step of a `BinaryInsertionSearch` is 'confirm', a Haiku step that narrows the
+      window is 'explore'. A 'confirm' call is let through before any waiting
+      'default' or 'explore' call of the same model. Calls of different models don't
+      compete for the same limits; where they do compete, for the slots of an async
+      comparer, `LaneSemaphore` applies the same order.
+    - Errors are classified (see `classify_error`). Rate limits, overloads, server
+      and connection errors are retried after a jittered exponential backoff
+      (at least the `retry-after` the API asked for); anything else is raised.
+    - `report()` gives calls, retries, time spent waiting and queue depth per model.
+      Pass `stats` (a dict) to `create()` to get the queueing time, retries and
+      wall time of that one call added to it.
+
+    Parameters:
+    - limits (dict): model -> `RateLimits`; a model without limits is never throttled.
+    - max_attempts (int): calls made before a retryable error is raised.
+    - base_delay, max_delay (float): the n-th retry waits a random time up to
+        min(max_delay, base_delay * 2**n) seconds.
+    """
+    _shared = None
+
+    def __init__(self, limits=None, max_attempts=6, base_delay=1.0, max_delay=60.0, poll_interval=0.05,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.limits = DEFAULT_LIMITS if limits is None else limits
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.clock = clock
+        self.sleep = sleep
+
+        self.lock = threading.Lock()
+        self.buckets = {model: [TokenBucket(limit, clock) for limit in model_limits]
+                        for model, model_limits in self.limits.items()}
+        # model -> heap of (lane index, arrival, ticket) waiting to be let through
+        self.queues = {}
+        self.arrivals = itertools.count()
+
+        self.metrics = {}
+
+    @classmethod
+    def shared(cls):
+        """The scheduler of every comparer that isn't given one."""
+        if cls._shared is None:
+            cls._shared = cls()
+        return cls._shared
+
+    def _model_metrics(self, model):
+        return self.metrics.setdefault(model, {'calls': 0, 'calls_by_lane': {lane: 0 for lane in LANES},
+                                               'retries': {}, 'errors': {}, 'throttle_seconds': 0.0,
+                                               'backoff_seconds': 0.0, 'max_queue_depth': 0})
+
+    def _enqueue(self, model, lane, params):
+        ticket = {'reserve': (1, estimate_input_tokens(params), params.get('max_tokens', 0))}
+        with self.lock:
+            queue = self.queues.setdefault(model, [])
+            heapq.heappush(queue, (LANES.index(lane), next(self.arrivals), ticket))
+            metrics = self._model_metrics(model)
+            metrics['max_queue_depth'] = max(metrics['max_queue_depth'], len(queue))
+        return ticket
+
+    def _try_admit(self, model, ticket):
+        """0 if `ticket` may go now (its reservation is taken), otherwise seconds to wait before asking again."""
+        with self.lock:
+            queue = self.queues[model]
+            if queue[0][-1] is not ticket:
+                # Someone in a higher lane, or earlier in ours, goes first
+                return self.poll_interval
+            buckets = self.buckets.get(model, [])
+            wait = max([bucket.time_until(amount) for bucket, amount in zip(buckets, ticket['reserve'])], default=0)
+            if wait > 0:
+                return wait
+            for bucket, amount in zip(buckets, ticket['reserve']):
+                bucket.take(amount)
+            heapq.heappop(queue)
+            ticket['admitted'] = True
+            return 0
+
+    def _withdraw(self, model, ticket):
+        """
+        Take `ticket` out of the queue if it is still waiting, e.g. after a Ctrl-C or a
+        cancelled task; left at the head, it would keep every later call of `model` out.
+        """
+        if ticket.get('admitted'):
+            return
+        with self.lock:
+            queue = self.queues[model]
+            queue[:] = [entry for entry in queue if entry[-1] is not ticket]
+            heapq.heapify(queue)
+
+    def _settle(self, model, ticket, message):
+        """Give back what the reservation overestimated (or take what it missed)."""
+        usage = getattr(message, 'usage', None)
+        buckets = self.buckets.get(model)
+        if usage is None or not buckets:
+            return
+        _, input_reserved, output_reserved = ticket['reserve']
+        input_used = usage.input_tokens + (getattr(usage, 'cache_creation_input_tokens', 0) or 0)
+        with self.lock:
+            buckets[1].give(input_reserved - input_used)
+            buckets[2].give(output_reserved - usage.output_tokens)
+
+    def _backoff(self, model, attempt, error):
+        """Seconds to wait before retrying `error`, or None if it should be raised."""
+        kind = classify_error(error)
+        with self.lock:
+            metrics = self._model_metrics(model)
+            if kind not in RETRYABLE or attempt + 1 >= self.max_attempts:
+                metrics['errors'][kind] = metrics['errors'].get(kind, 0) + 1
+                return None
+            metrics['retries'][kind] = metrics['retries'].get(kind, 0) + 1
+            delay = max(random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt)), retry_after(error) or 0)
+            metrics['backoff_seconds'] += delay
+        print(f'WARNING: {kind} error from {model}, retrying in {delay:.1f}s (attempt {attempt + 1} of {self.max_attempts})')
+        return delay
+
+    def _count(self, model, lane, waited):
+        with self.lock:
+            metrics = self._model_metrics(model)
+            metrics['calls'] += 1
+            metrics['calls_by_lane'][lane] += 1
+            metrics['throttle_seconds'] += waited
+
+    def _add_stats(self, stats, started, queue_seconds, attempts):
+        if stats is None:
+            return
+        stats['queue_seconds'] = stats.get('queue_seconds', 0.0) + queue_seconds
+        stats['retries'] = stats.get('retries', 0) + attempts - 1
+        stats['wall_seconds'] = stats.get('wall_seconds', 0.0) + self.clock() - started
+
+    def create(self, create, params, model, lane='default', stats=None):
+        """`create(**params)` once the rate limits allow it, retrying transient errors."""
+        started, queue_seconds = self.clock(), 0.0
+        for attempt in range(self.max_attempts):
+            ticket = self._enqueue(model, lane, params)
+            waited = 0.0
+            try:
+                while (wait := self._try_admit(model, ticket)) > 0:
+                    self.sleep(wait)
+                    waited += wait
+            finally:
+                self._withdraw(model, ticket)
+            self._count(model, lane, waited)
+            queue_seconds += waited
+
+            try:
+                message = create(**params)
+            except anthropic.APIError as error:
+                delay = self._backoff(model, attempt, error)
+                if delay is None:
+                    self._add_stats(stats, started, queue_seconds, attempt + 1)
+                    raise
+                self.sleep(delay)
+                continue
+
+            self._settle(model, ticket, message)
+            self._add_stats(stats, started, queue_seconds, attempt + 1)
+            return message
+
+    async def create_async(self, create, params, model, lane='default', stats=None):
+        """Async version of `create()`; waits with `asyncio.sleep` so other tasks keep running."""
+        started, queue_seconds = self.clock(), 0.0
+        for attempt in range(self.max_attempts):
+            ticket = self._enqueue(model, lane, params)
+            waited = 0.0
+            try:
+                while (wait := self._try_admit(model, ticket)) > 0:
+                    await asyncio.sleep(wait)
+                    waited += wait
+            finally:
+                self._withdraw(model, ticket)
+            self._count(model, lane, waited)
+            queue_seconds += waited
+
+            try:
+                message = await create(**params)
+            except anthropic.APIError as error:
+                delay = self._backoff(model, attempt, error)
+                if delay is None:
+                    self._add_stats(stats, started, queue_seconds, attempt + 1)
+                    raise
+                await asyncio.sleep(delay)
+                continue
+
+            self._settle(model, ticket, message)
+            self._add_stats(stats, started, queue_seconds, attempt + 1)
+            return message
+
+    def report(self):
+        """Prints and returns the metrics of every model."""
+        with self.lock:
+            report = {model: {**metrics, 'queue_depth': len(self.queues.get(model, []))}
+                      for model, metrics in self.metrics.items()}
+        for model, metrics in report.items():
+            print(f"scheduler ({model}): {metrics['calls']} calls, retries {metrics['retries']}, "
+                  f"{metrics['throttle_seconds']:.1f}s throttled, {metrics['backoff_seconds']:.1f}s backing off, "
+                  f"max queue depth {metrics['max_queue_depth']}")
+        return report
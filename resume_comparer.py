@@ -1,7 +1,16 @@
 import anthropic
+import asyncio
 import base64
+import json
 from random import randint
+from concurrent.futures import ThreadPoolExecutor
 import os
+from comparison_store import ComparisonStore
+from image_normalizer import ImageNormalizer
+from payload_cache import PayloadCache
+from request_scheduler import LaneSemaphore, RequestScheduler, classify_error
+from resume_ingest import load_manifest, manifest_media_types, sniff_media_type
+from telemetry import Telemetry
 
 class LLMResumeComparer:
     PROMPT = """You are an expert software engineering recruiter tasked with comparing two resumes for an early-career software engineering position. Your goal is to analyze both resumes thoroughly and determine which candidate would be a better fit for the role.
@@ -76,72 +85,209 @@ Criteria for evaluation:
 
 You MUST end your response with 'I prefer Resume A' or 'I prefer Resume B'."""
 
+    # Text around the two images, see `_message_params`
+    FIRST_RESUME = "The first resume is:"
+    SECOND_RESUME = "The resume above is {first}. The next resume is {second}:"
+
+    # Fast verdicts: the same criteria, but the answer is a short `record_verdict` tool call instead of an essay
+    FAST_PROMPT = PROMPT[:PROMPT.index('8. Explain')] + """8. Do not write out your analysis. Record the resume you prefer with the record_verdict tool, with a one-sentence reason."""
+
+    VERDICT_TOOL = {
+        "name": "record_verdict",
+        "description": "Record which of the two resumes you prefer.",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "winner": {"type": "string", "enum": ["Resume A", "Resume B"]},
+                "reason": {"type": "string", "description": "One sentence on why."}
+            },
+            "required": ["winner", "reason"]
+        }
+    }
+
+    ESSAY_MAX_TOKENS = 2000
+    FAST_MAX_TOKENS = 150
+
+    # Fields of the API's `usage` kept for every call
+    TOKEN_KEYS = ('input_tokens', 'cache_creation_input_tokens', 'cache_read_input_tokens', 'output_tokens')
+
     HAIKU = "claude-3-haiku-20240307"
     SONNET = "claude-3-5-sonnet-20240620"
 
-    def __init__(self, resume_folder, model='sonnet', temperature=0):
+    def __init__(self, resume_folder, model='sonnet', temperature=0, comparison_store=None, normalizer=None, payload_cache=None,
+                 fast_verdict=False, max_attempts=3, scheduler=None, telemetry=None):
         self.resume_folder = resume_folder
         self.model = model
         self.temperature = temperature
-        self.client = anthropic.Anthropic()
+        # Retries are made by the `RequestScheduler`, which knows what kind of error it was
+        self.client = anthropic.Anthropic(max_retries=0)
+        self.scheduler = scheduler if scheduler is not None else RequestScheduler.shared()
 
         self.num_calls = {'haiku': 0, 'sonnet': 0}
 
         self.should_swap_mediatype = False
 
-    def get_image_data(self, ranked: bool, image_filename):
-        path = f'./{self.resume_folder}/{'ranked' if ranked else 'unranked'}/{image_filename}' # e.g. ./unranked/CV.png
-
+        # Comparisons already paid for, see `ComparisonStore`
+        if comparison_store is None:
+            comparison_store = ComparisonStore(f'./{resume_folder}/comparisons.sqlite',
+                                               stats_path=f'./{resume_folder}/cache_stats.json')
+        self.comparison_store = comparison_store
+        layout = [self.FIRST_RESUME, self.SECOND_RESUME]
+        self.essay_prompt_hash = ComparisonStore.hash_prompt('\n'.join([self.PROMPT, *layout]))
+        self.fast_prompt_hash = ComparisonStore.hash_prompt('\n'.join([self.FAST_PROMPT, json.dumps(self.VERDICT_TOOL), *layout]))
+
+        # With `fast_verdict`, Claude answers with a `record_verdict` call instead of an essay (see `explain()` for the essay).
+        # An unreadable verdict is asked again, up to `max_attempts` times, instead of waiting for a key press.
+        self.fast_verdict = fast_verdict
+        self.max_attempts = max_attempts
+        self.prompt_hash = self.fast_prompt_hash if fast_verdict else self.essay_prompt_hash
+
+        # Images are shrunk before upload, see `ImageNormalizer`
+        if normalizer is None:
+            normalizer = ImageNormalizer(f'./{resume_folder}/normalized')
+        self.normalizer = normalizer
+        self.payload_stats = {'uploads': 0, 'bytes_original': 0, 'bytes_sent': 0, 'tokens_original': 0, 'tokens_sent': 0}
+
+        # SHA-256 -> media type, from the manifest written by `ResumeIngest`
+        self.media_types = manifest_media_types(load_manifest(resume_folder))
+
+        # Encoded images, so a resume is read and encoded once rather than once per comparison
+        self.payload_cache = payload_cache if payload_cache is not None else PayloadCache()
+
+        # One dict per call to Claude, see `_record_usage`
+        self.token_usage = []
+        # Every call is also logged as it happens, see `Telemetry`
+        self.telemetry = telemetry if telemetry is not None else Telemetry.for_folder(resume_folder)
+
+    def image_path(self, ranked: bool, image_filename):
+        return f'./{self.resume_folder}/{'ranked' if ranked else 'unranked'}/{image_filename}' # e.g. ./unranked/CV.png
+
+    def read_image(self, ranked: bool, image_filename):
+        with open(self.image_path(ranked, image_filename), 'rb') as image_file:
+            return image_file.read()
+
+    def get_image(self, ranked: bool, image_filename):
+        """
+        The resume as it is uploaded: {'data': base64 string, 'type': e.g. 'png', 'hash': SHA-256 of the file}.
+        """
+        path = self.image_path(ranked, image_filename)
+        image = self.payload_cache.get(path, lambda: self._encode_image(path, image_filename))
+
+        self.payload_stats['uploads'] += 1
+        for key in ('bytes_original', 'bytes_sent', 'tokens_original', 'tokens_sent'):
+            self.payload_stats[key] += image[key]
+
+        return {'data': image['data'], 'type': image['type'], 'hash': image['hash']}
+
+    def _encode_image(self, path, image_filename):
         with open(path, 'rb') as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
-        
-    def construct_resumes_dict(self, unranked_filename, ranked_filename):
-        ranked_data = self.get_image_data(ranked=True, image_filename=ranked_filename)
-        unranked_data = self.get_image_data(ranked=False, image_filename=unranked_filename)
+            raw = image_file.read()
+        normalized = self.normalizer.normalize(raw) if self.normalizer is not None else None
+
+        image = {'bytes_original': len(raw), 'tokens_original': 0, 'tokens_sent': 0, 'hash': ComparisonStore.hash_bytes(raw)}
+        if normalized is not None and normalized.media_type is not None:
+            data, image['type'] = normalized.data, normalized.media_type.split('/')[1]
+            image['tokens_original'], image['tokens_sent'] = normalized.original_tokens, normalized.tokens
+        elif (media_type := self.media_types.get(image['hash']) or sniff_media_type(raw) or '').startswith('image/'):
+            data, image['type'] = raw, media_type.split('/')[1]
+        elif media_type == 'application/pdf':
+            raise ValueError(f'{image_filename} is a PDF; run ingest() first to render it to an image')
+        else:
+            # Not a format we know; guess from the extension
+            data, image['type'] = raw, 'jpeg' if image_filename.rsplit('.', 1)[-1] == 'jpg' else 'png'
+
+        image['bytes_sent'] = len(data)
+        image['data'] = base64.b64encode(data).decode('utf-8')
+        return image
+
+    def image_hash(self, ranked: bool, image_filename):
+        """SHA-256 of the file, without counting it as an upload."""
+        path = self.image_path(ranked, image_filename)
+        return self.payload_cache.get(path, lambda: self._encode_image(path, image_filename))['hash']
 
-        # Are the images jpg or png
-        get_image_type = lambda image_filename: 'jpeg' if image_filename.split('.')[1] == 'jpg' else 'png'
-        ranked_type, unranked_type = get_image_type(ranked_filename), get_image_type(unranked_filename)
+    def get_image_data(self, ranked: bool, image_filename):
+        return self.get_image(ranked, image_filename)['data']
+
+    def payload_report(self):
+        """Prints and returns how much normalizing the images saved."""
+        stats = dict(self.payload_stats)
+        stats['bytes_saved'] = stats['bytes_original'] - stats['bytes_sent']
+        stats['tokens_saved'] = stats['tokens_original'] - stats['tokens_sent']
+        print(f"payload: {stats['uploads']} uploads, {stats['bytes_saved']} bytes and ~{stats['tokens_saved']} input tokens saved")
+        print(f'payload cache: {self.payload_cache.stats()}')
+        return stats
+
+    def _build_resumes(self, unranked_filename, ranked_filename, opponent_is_ranked=True):
+        """Resume A is the ranked resume and Resume B the one being ranked."""
+        ranked_image = self.get_image(ranked=opponent_is_ranked, image_filename=ranked_filename)
+        unranked_image = self.get_image(ranked=False, image_filename=unranked_filename)
 
         # Construct dictionary containing the two resumes
         resumes = {'Resume A': {}, 'Resume B': {}}
-        self.to_be_ranked_is_A = False
         resumes['Resume A']['filename'] = ranked_filename
-        resumes['Resume A']['data'] = ranked_data
-        resumes['Resume A']['type'] = ranked_type
+        resumes['Resume A'].update(ranked_image)
         resumes['Resume B']['filename'] = unranked_filename
-        resumes['Resume B']['data'] = unranked_data
-        resumes['Resume B']['type'] = unranked_type
+        resumes['Resume B'].update(unranked_image)
+
+        return resumes
 
-        self.current_resumes = resumes
+    def construct_resumes_dict(self, unranked_filename, ranked_filename, opponent_is_ranked=True):
+        self.to_be_ranked_is_A = False
+        self.current_resumes = self._build_resumes(unranked_filename, ranked_filename, opponent_is_ranked)
+
+    @staticmethod
+    def _swap(resumes):
+        return {'Resume A': resumes['Resume B'], 'Resume B': resumes['Resume A']}
 
     def randomise_resumes(self):
+        # Resume A is shown first, so this also picks which resume comes first
         rand_int = randint(0, 1)
         # if rand_int is 1 swap resume A and B  
         if rand_int:
-            temp = self.current_resumes['Resume A']
-            self.current_resumes['Resume A'] = self.current_resumes['Resume B']
-            self.current_resumes['Resume B'] = temp
+            self.current_resumes = self._swap(self.current_resumes)
             self.to_be_ranked_is_A = not self.to_be_ranked_is_A
 
-    def compare_resumes_with_llm(self):
-        # Update num_calls
-        self.num_calls[self.model] += 1
-
-        self.randomise_resumes()
-
-        # print(f'name={self.current_resumes['Resume A']['filename']}, type={self.current_resumes['Resume A']['type']}')
-        # print(f'name={self.current_resumes['Resume B']['filename']}, type={self.current_resumes['Resume B']['type']}')
-
-        mediatype_A = f"image/{self.current_resumes['Resume A']['type']}"
-        mediatype_B = f"image/{self.current_resumes['Resume B']['type']}"
-
-        print("Comparing resumes...")
-
-        def call_claude():
-            return self.client.messages.create(
-            model = self.SONNET if self.model == 'sonnet' else self.HAIKU,
-            max_tokens=2000,
+    def _fixed_labels(self, resumes):
+        """
+        Like `randomise_resumes`, but the labels follow from the two images' hashes,
+        so a pair is always asked the same way and a rerun finds its verdicts in the
+        `ComparisonStore`. The choice is still balanced over many pairs.
+        `resumes` has the resume being ranked as Resume B; returns (resumes, to_be_ranked_is_A).
+        """
+        if (int(resumes['Resume A']['hash'], 16) + int(resumes['Resume B']['hash'], 16)) % 2:
+            return self._swap(resumes), True
+        return resumes, False
+
+    def _message_params(self, resumes, to_be_ranked_is_A, model, mediatype_A=None, mediatype_B=None, fast=None):
+        """
+        Keyword arguments for `client.messages.create` comparing `resumes`.
+
+        Resume A is shown first, so the random A/B order (see `randomise_resumes`)
+        also randomises which resume is seen first, against a bias for either
+        position. The prompt comes before both and carries a prompt-caching marker.
+        When the resume being ranked is Resume A it carries a second one, so the
+        calls of one `find_rank` that show it first also share it from the cache.
+
+        `fast` (default: `self.fast_verdict`) asks for a `record_verdict` tool call
+        with a small `max_tokens` instead of an essay.
+        """
+        fast = self.fast_verdict if fast is None else fast
+        mediatypes = {'Resume A': mediatype_A or f"image/{resumes['Resume A']['type']}",
+                      'Resume B': mediatype_B or f"image/{resumes['Resume B']['type']}"}
+        first_image = {
+            "type": "image",
+            "source": {
+                "type": "base64",
+                "media_type": mediatypes['Resume A'],
+                "data": resumes['Resume A']['data']
+            }
+        }
+        if to_be_ranked_is_A:
+            first_image["cache_control"] = {"type": "ephemeral"}
+
+        params = dict(
+            model = self.SONNET if model == 'sonnet' else self.HAIKU,
+            max_tokens=self.FAST_MAX_TOKENS if fast else self.ESSAY_MAX_TOKENS,
             temperature=self.temperature,
             messages=[
                 {
@@ -150,70 +296,261 @@ You MUST end your response with 'I prefer Resume A' or 'I prefer Resume B'."""
                     "content": [
                         {
                             "type": "text",
-                            "text": "Resume A:"
-                        },
-                        {
-                            "type": "image",
-                            "source": {
-                                "type": "base64",
-                                "media_type": mediatype_A,
-                                "data": self.current_resumes['Resume A']['data']
-                            }
+                            "text": f"{self.FAST_PROMPT if fast else self.PROMPT}\n\n{self.FIRST_RESUME}",
+                            "cache_control": {"type": "ephemeral"}
                         },
+                        first_image,
                         {
                             "type": "text",
-                            "text": "Resume B:"
+                            "text": self.SECOND_RESUME.format(first='Resume A', second='Resume B')
                         },
                         {
                             "type": "image",
                             "source": {
                                 "type": "base64",
-                                "media_type": mediatype_B,
-                                "data": self.current_resumes['Resume B']['data']
+                                "media_type": mediatypes['Resume B'],
+                                "data": resumes['Resume B']['data']
                             }
-                        },
-                        {
-                            "type": "text",
-                            "text": self.PROMPT
                         }
                     ]
                 }
             ]
         )
+        if fast:
+            params['tools'] = [self.VERDICT_TOOL]
+            params['tool_choice'] = {"type": "tool", "name": self.VERDICT_TOOL['name']}
+        return params
+
+    def _record_usage(self, resumes, to_be_ranked_is_A, model, message, stats=None, batch=False):
+        """
+        Keep the token counts of one call, split into cached and uncached input tokens,
+        and log the call with `stats` from the `RequestScheduler`.
+        """
+        candidate, opponent = ('Resume A', 'Resume B') if to_be_ranked_is_A else ('Resume B', 'Resume A')
+        usage = {'model': model,
+                 'to_be_ranked': resumes[candidate]['filename'],
+                 'opponent': resumes[opponent]['filename']}
+        for key in self.TOKEN_KEYS:
+            usage[key] = getattr(message.usage, key, None) or 0
+        self.token_usage.append(usage)
+        if self.telemetry:
+            self.telemetry.record(model, usage['to_be_ranked'], usage['opponent'], usage, stats, batch)
+
+    def token_report(self):
+        """Prints and returns the token totals of every call so far."""
+        totals = {key: sum(usage[key] for usage in self.token_usage) for key in self.TOKEN_KEYS}
+        prompt_tokens = totals['input_tokens'] + totals['cache_read_input_tokens'] + totals['cache_creation_input_tokens']
+        cached_share = totals['cache_read_input_tokens'] / prompt_tokens if prompt_tokens else 0
+        print(f"tokens: {totals}, {cached_share:.0%} of input tokens read from the prompt cache")
+        return totals
 
-        try:
+    @staticmethod
+    def _swapped_mediatypes(resumes, to_be_ranked_is_A):
+        """Media types to retry with: the to-be-ranked resume's jpeg <-> png."""
+        mediatype_A = f"image/{resumes['Resume A']['type']}"
+        mediatype_B = f"image/{resumes['Resume B']['type']}"
+        swap = lambda mediatype: 'image/jpeg' if mediatype == 'image/png' else 'image/png'
+        if to_be_ranked_is_A:
+            return swap(mediatype_A), mediatype_B
+        return mediatype_A, swap(mediatype_B)
+
+    def _read_message(self, message):
+        """(winner, text) of a reply: from its `record_verdict` call if it has one, otherwise parsed from the essay."""
+        for block in message.content:
+            if block.type == 'tool_use' and block.name == self.VERDICT_TOOL['name']:
+                winner = block.input.get('winner')
+                return (winner if winner in ('Resume A', 'Resume B') else None), block.input.get('reason', '')
+
+        text = ''.join(block.text for block in message.content if block.type == 'text')
+        return self._parse_winner(text), text
+
+    @staticmethod
+    def _parse_winner(text):
+        if 'prefer resume a' in text.lower():
+            return 'Resume A'
+        if 'prefer resume b' in text.lower():
+            return 'Resume B'
+        return None
+
+    def _lookup(self, resumes, to_be_ranked_is_A, model, samples):
+        """
+        Look for a stored comparison of these two resumes, in either A/B order.
+        `samples` counts the votes already used per order, so best of n never
+        counts one stored vote twice.
+        Returns (resumes, to_be_ranked_is_A, comparison) in the stored order, or None.
+        """
+        if self.comparison_store is None:
+            return None
+
+        keys = []
+        for swap in (False, True):
+            ordered = self._swap(resumes) if swap else resumes
+            order = (ordered['Resume A']['hash'], ordered['Resume B']['hash'])
+            keys.append((*order, model, self.prompt_hash, samples.get(order, 0)))
+
+        key, cached = self.comparison_store.get_first(keys)
+        if cached is None:
+            return None
+
+        swap = key != keys[0]
+        ordered = self._swap(resumes) if swap else resumes
+        samples[key[:2]] = key[4] + 1
+        to_be_ranked_is_A = to_be_ranked_is_A != swap
+        return ordered, to_be_ranked_is_A, self._comparison(ordered, to_be_ranked_is_A, cached['winner'], cached['claude_response'])
+
+    def _remember(self, resumes, model, samples, comparison):
+        """Store a comparison Claude just made, as the next vote for this A/B order."""
+        if self.comparison_store is None or comparison['winner'] is None:
+            return
+
+        order = (resumes['Resume A']['hash'], resumes['Resume B']['hash'])
+        sample = samples.get(order, 0)
+        self.comparison_store.put(*order, model, self.prompt_hash, sample, comparison['winner'], comparison['claude_response'])
+        samples[order] = sample + 1
+
+    def _compare_current(self, samples):
+        """One vote on `self.current_resumes`: from the comparison store if it has one, otherwise from Claude."""
+        cached = self._lookup(self.current_resumes, self.to_be_ranked_is_A, self.model, samples)
+        if cached is not None:
+            print("Comparison found in store")
+            self.current_resumes, self.to_be_ranked_is_A, comparison = cached
             self.should_swap_mediatype = False
-            message = call_claude()
-        except:
-            # Error is most likely because mediatype was wrong
-            if self.to_be_ranked_is_A:
-                # Switch jpeg to png or vice versa
-                mediatype_A = 'image/jpeg' if mediatype_A == 'image/png' else 'image/png'
-            else:
-                mediatype_B = 'image/jpeg' if mediatype_B == 'image/png' else 'image/png'
+            return comparison
+
+        comparison = self.compare_resumes_with_llm()
+        self._remember(self.current_resumes, self.model, samples, comparison)
+        return comparison
+
+    @staticmethod
+    def _comparison(resumes, to_be_ranked_is_A, winner, text):
+        return {'Resume A': resumes['Resume A']['filename'],
+                 'Resume B': resumes['Resume B']['filename'],
+                 'winner': winner, # "Resume A" or "Resume B"
+                 'to_be_ranked_resume': 'Resume A' if to_be_ranked_is_A else 'Resume B',
+                 'claude_response': text}
+
+    def _schedule(self, params, model, stats=None, lane='default'):
+        """`client.messages.create(**params)` through the `RequestScheduler`, waiting in `lane`."""
+        return self.scheduler.create(self.client.messages.create, params, model, lane, stats)
+
+    def _request_comparison(self, resumes, to_be_ranked_is_A, model, fast=None, lane='default'):
+        """
+        One call to Claude; keeps no state on `self`, so several can run in threads at once.
+        Returns (comparison, whether the to-be-ranked resume's mediatype had to be swapped).
+        """
+        stats = {}
+        try:
+            swapped_mediatype = False
+            message = self._schedule(self._message_params(resumes, to_be_ranked_is_A, model, fast=fast), model, stats, lane)
+        except anthropic.BadRequestError as error:
+            if classify_error(error) != 'media_type':
+                raise
+            # Switch jpeg to png or vice versa
+            mediatype_A, mediatype_B = self._swapped_mediatypes(resumes, to_be_ranked_is_A)
 
             # Signal that rename is required
-            self.should_swap_mediatype = True
+            swapped_mediatype = True
 
             # Retry
-            message = call_claude()
+            stats['retries'] += 1
+            message = self._schedule(self._message_params(resumes, to_be_ranked_is_A, model, mediatype_A, mediatype_B, fast), model, stats, lane)
+
+        self._record_usage(resumes, to_be_ranked_is_A, model, message, stats)
+        winner, text = self._read_message(message)
+        return self._comparison(resumes, to_be_ranked_is_A, winner, text), swapped_mediatype
+
+    def compare_resumes_with_llm(self):
+        self.randomise_resumes()
+
+        # print(f'name={self.current_resumes['Resume A']['filename']}, type={self.current_resumes['Resume A']['type']}')
+        # print(f'name={self.current_resumes['Resume B']['filename']}, type={self.current_resumes['Resume B']['type']}')
+
+        print("Comparing resumes...")
+
+        for attempt in range(self.max_attempts if self.fast_verdict else 1):
+            # Update num_calls
+            self.num_calls[self.model] += 1
+
+            comparison, self.should_swap_mediatype = self._request_comparison(self.current_resumes, self.to_be_ranked_is_A, self.model)
+            if comparison['winner'] is not None:
+                break
+            if self.fast_verdict:
+                print(f"WARNING: could not read Claude's verdict (attempt {attempt + 1} of {self.max_attempts})")
         
-        if 'prefer resume a' in message.content[0].text.lower():
-            winner = 'Resume A'
-        elif 'prefer resume b' in message.content[0].text.lower():
-            winner = 'Resume B'
-        else:
-            winner = None
+        if comparison['winner'] is None and not self.fast_verdict:
             print("WARNING: Claude did not state winner")
             print('here is what it said:')
-            print(message.content[0].text)
+            print(comparison['claude_response'])
             input('Press Any Key To Continue')
         
-        return {'Resume A': self.current_resumes['Resume A']['filename'],
-                 'Resume B': self.current_resumes['Resume B']['filename'],
-                 'winner': winner, # "Resume A" or "Resume B"
-                 'to_be_ranked_resume': 'Resume A' if self.to_be_ranked_is_A else 'Resume B',
-                 'claude_response': message.content[0].text}
+        return comparison
+
+    def _plan_votes(self, resumes, to_be_ranked_is_A, first_vote, num_votes, samples):
+        """
+        The next `num_votes` votes of a best of n, as (resumes, to_be_ranked_is_A, sample).
+        Votes alternate between the A/B order given and the swapped one, so each
+        order is asked first before either is asked twice. `sample` is the vote's
+        index among votes in the same order, its key in the `ComparisonStore`.
+        """
+        votes = []
+        for vote in range(first_vote, first_vote + num_votes):
+            if vote % 2:
+                ordered, is_A = self._swap(resumes), not to_be_ranked_is_A
+            else:
+                ordered, is_A = resumes, to_be_ranked_is_A
+            order = (ordered['Resume A']['hash'], ordered['Resume B']['hash'])
+            sample = samples.get(order, 0)
+            samples[order] = sample + 1
+            votes.append((ordered, is_A, sample))
+        return votes
+
+    def _cached_vote(self, resumes, to_be_ranked_is_A, model, sample):
+        if self.comparison_store is None:
+            return None
+        cached = self.comparison_store.get(resumes['Resume A']['hash'], resumes['Resume B']['hash'], model, self.prompt_hash, sample)
+        if cached is None:
+            return None
+        return self._comparison(resumes, to_be_ranked_is_A, cached['winner'], cached['claude_response'])
+
+    def _store_vote(self, resumes, model, sample, comparison):
+        if self.comparison_store is None or comparison['winner'] is None:
+            return
+        self.comparison_store.put(resumes['Resume A']['hash'], resumes['Resume B']['hash'], model, self.prompt_hash,
+                                  sample, comparison['winner'], comparison['claude_response'])
+
+    def _cast_votes(self, votes, max_workers=None):
+        """
+        All `votes` at once: stored ones from the `ComparisonStore`, the rest in
+        parallel threads (at most `max_workers` at a time, if given).
+        """
+        comparisons = [self._cached_vote(resumes, is_A, self.model, sample) for resumes, is_A, sample in votes]
+        missing = [i for i, comparison in enumerate(comparisons) if comparison is None]
+        if not missing:
+            return comparisons
+
+        print(f"Comparing resumes... ({len(missing)} at once)")
+        with ThreadPoolExecutor(max_workers=min(len(missing), max_workers or len(missing))) as executor:
+            futures = {i: executor.submit(self._request_comparison, votes[i][0], votes[i][1], self.model) for i in missing}
+
+        for i, future in futures.items():
+            self.num_calls[self.model] += 1
+            comparisons[i], swapped_mediatype = future.result()
+            self.should_swap_mediatype = self.should_swap_mediatype or swapped_mediatype
+            self._store_vote(votes[i][0], self.model, votes[i][2], comparisons[i])
+        return comparisons
+
+    @staticmethod
+    def _count_votes(tally, comparisons):
+        """Add `comparisons` to `tally`; votes without a winner don't count."""
+        for comparison in comparisons:
+            if comparison['winner'] is None:
+                print("WARNING: Claude did not state winner; asking again")
+            elif comparison['to_be_ranked_resume'] == comparison['winner']:
+                tally['wins'] += 1
+                tally['win_comparison'] = comparison
+            else:
+                tally['losses'] += 1
+                tally['loss_comparison'] = comparison
 
     @staticmethod
     def pretty_print(comparison):
@@ -224,45 +561,191 @@ You MUST end your response with 'I prefer Resume A' or 'I prefer Resume B'."""
             else:
                 print(f'{key}: {value}')
     
-    def best_of_n(self, n, unranked_filename, ranked_filename):
+    def best_of_n(self, n, unranked_filename, ranked_filename, opponent_is_ranked=True):
         """Make LLM compare resumes best-of-n style.
-        The return format is identical to a regular comparison for now."""
+        The return format is identical to a regular comparison for now.
+        `opponent_is_ranked=False` reads the opponent from the unranked folder.
+
+        Votes are sent in parallel waves. A wave is only as big as the number of
+        votes that could all still be needed (2 for best of 3, then 1 more if they
+        split), so this never makes more calls than voting one at a time would."""
         if n % 2 == 0:
             raise ValueError('n must be odd for best of n')
         wins_required = (n + 1) // 2
 
         print(f"Starting best of {n} comparison")
 
-        self.construct_resumes_dict(unranked_filename, ranked_filename)
+        self.construct_resumes_dict(unranked_filename, ranked_filename, opponent_is_ranked)
 
-        to_be_ranked_wins, to_be_ranked_losses = 0, 0
+        # Decides which A/B order the first vote uses; after that the orders alternate
+        self.randomise_resumes()
+        self.should_swap_mediatype = False
 
         # Store one comparison where to_be_ranked wins, one where it loses
-        win_comparison, loss_comparison = None, None
-        
-        for _ in range(n):
-            comparison = self.compare_resumes_with_llm()
-            if comparison['to_be_ranked_resume'] == comparison['winner']:
-                to_be_ranked_wins += 1
-                win_comparison = comparison
-            else:
-                to_be_ranked_losses += 1
-                loss_comparison = comparison
+        tally = {'wins': 0, 'losses': 0, 'win_comparison': None, 'loss_comparison': None}
+
+        # Votes taken from the comparison store so far, per A/B order
+        samples = {}
+
+        num_votes = 0
+        while num_votes < 2 * n:
+            wave = wins_required - max(tally['wins'], tally['losses'])
+            votes = self._plan_votes(self.current_resumes, self.to_be_ranked_is_A, num_votes, wave, samples)
+            num_votes += wave
 
-            self.pretty_print(comparison)
+            comparisons = self._cast_votes(votes)
+            for comparison in comparisons:
+                self.pretty_print(comparison)
+            self._count_votes(tally, comparisons)
 
-            if to_be_ranked_wins == wins_required:
-                print(f'Win; wins={to_be_ranked_wins}, losses={to_be_ranked_losses}')
-                return win_comparison
+            if tally['wins'] == wins_required:
+                print(f'Win; wins={tally['wins']}, losses={tally['losses']}')
+                return tally['win_comparison']
             
-            if to_be_ranked_losses == wins_required:
-                print(f'Loss; wins={to_be_ranked_wins}, losses={to_be_ranked_losses}')
-                return loss_comparison
+            if tally['losses'] == wins_required:
+                print(f'Loss; wins={tally['wins']}, losses={tally['losses']}')
+                return tally['loss_comparison']
+
+        # Claude kept not stating a winner
+        return comparisons[-1]
 
     def main(self, unranked_filename, ranked_filename):
         self.construct_resumes_dict(unranked_filename, ranked_filename)
-        return self.compare_resumes_with_llm()
+        return self._compare_current(samples={})
+
+    def explain(self, unranked_filename, ranked_filename, opponent_is_ranked=True):
+        """
+        The full written comparison of two resumes (the essay prompt), for auditing a
+        fast verdict. It is kept in the `ComparisonStore`, so a pair is only explained once.
+        """
+        resumes, to_be_ranked_is_A = self._fixed_labels(self._build_resumes(unranked_filename, ranked_filename, opponent_is_ranked))
+        key = (resumes['Resume A']['hash'], resumes['Resume B']['hash'], self.model, self.essay_prompt_hash, 0)
+
+        cached = self.comparison_store.get(*key) if self.comparison_store is not None else None
+        if cached is not None:
+            return self._comparison(resumes, to_be_ranked_is_A, cached['winner'], cached['claude_response'])
+
+        self.num_calls[self.model] += 1
+        comparison, _ = self._request_comparison(resumes, to_be_ranked_is_A, self.model, fast=False)
+        if self.comparison_store is not None and comparison['winner'] is not None:
+            self.comparison_store.put(*key, comparison['winner'], comparison['claude_response'])
+        return comparison
     
+class AsyncLLMResumeComparer(LLMResumeComparer):
+    """
+    Same comparisons as `LLMResumeComparer`, made with the async client so that
+    many of them can wait on the network at once. At most `max_concurrency`
+    requests are in flight at any time; when they are all taken, the next free
+    one goes to the waiting call in the highest lane (see `LaneSemaphore`).
+
+    Unlike `LLMResumeComparer` this keeps no per-comparison state on `self`, so a
+    single instance can be shared by every concurrent task.
+    """
+    def __init__(self, resume_folder, model='sonnet', temperature=0, comparison_store=None, normalizer=None,
+                 payload_cache=None, max_concurrency=8, max_attempts=3, fast_verdict=False, scheduler=None, telemetry=None):
+        super().__init__(resume_folder, model, temperature, comparison_store, normalizer, payload_cache,
+                         fast_verdict, max_attempts, scheduler, telemetry)
+        self.client = anthropic.AsyncAnthropic(max_retries=0)
+        self.semaphore = LaneSemaphore(max_concurrency)
+
+        # unranked filename -> {'haiku': calls, 'sonnet': calls}
+        self.calls_by_resume = {}
+
+    def _count_call(self, unranked_filename, model):
+        self.num_calls[model] += 1
+        calls = self.calls_by_resume.setdefault(unranked_filename, {'haiku': 0, 'sonnet': 0})
+        calls[model] += 1
+
+    async def _create_message(self, resumes, to_be_ranked_is_A, model, stats=None, lane='default'):
+        async with self.semaphore.slot(lane):
+            try:
+                return await self._schedule_async(self._message_params(resumes, to_be_ranked_is_A, model), model, stats, lane)
+            except anthropic.BadRequestError as error:
+                if classify_error(error) != 'media_type':
+                    raise
+                mediatype_A, mediatype_B = self._swapped_mediatypes(resumes, to_be_ranked_is_A)
+                if stats is not None:
+                    stats['retries'] += 1
+                return await self._schedule_async(self._message_params(resumes, to_be_ranked_is_A, model, mediatype_A, mediatype_B), model, stats, lane)
+
+    async def _schedule_async(self, params, model, stats=None, lane='default'):
+        return await self.scheduler.create_async(self.client.messages.create, params, model, lane, stats)
+
+    async def _request_comparison_async(self, unranked_filename, resumes, to_be_ranked_is_A, model, lane='default'):
+        self._count_call(unranked_filename, model)
+        stats = {}
+        message = await self._create_message(resumes, to_be_ranked_is_A, model, stats, lane)
+        self._record_usage(resumes, to_be_ranked_is_A, model, message, stats)
+        winner, text = self._read_message(message)
+        return self._comparison(resumes, to_be_ranked_is_A, winner, text)
+
+    async def _cast_vote(self, unranked_filename, resumes, to_be_ranked_is_A, sample, model, lane='default'):
+        comparison = self._cached_vote(resumes, to_be_ranked_is_A, model, sample)
+        if comparison is None:
+            comparison = await self._request_comparison_async(unranked_filename, resumes, to_be_ranked_is_A, model, lane)
+            self._store_vote(resumes, model, sample, comparison)
+        return comparison
+
+    async def main(self, unranked_filename, ranked_filename, model=None, opponent_is_ranked=True, samples=None, lane='default'):
+        """
+        One comparison in a random A/B order. Instead of waiting for a key press,
+        retries up to `max_attempts` times when Claude does not state a winner.
+        `opponent_is_ranked=False` reads the opponent from the unranked folder.
+        `lane` is the `RequestScheduler` lane the call waits in.
+        """
+        model = model or self.model
+        samples = {} if samples is None else samples
+        resumes = self._build_resumes(unranked_filename, ranked_filename, opponent_is_ranked)
+        to_be_ranked_is_A = False
+        if randint(0, 1):
+            resumes = self._swap(resumes)
+            to_be_ranked_is_A = True
+
+        cached = self._lookup(resumes, to_be_ranked_is_A, model, samples)
+        if cached is not None:
+            return cached[2]
+
+        for _ in range(self.max_attempts):
+            comparison = await self._request_comparison_async(unranked_filename, resumes, to_be_ranked_is_A, model, lane)
+            if comparison['winner'] is not None:
+                break
+            print(f"WARNING: Claude did not state winner ({unranked_filename} vs {ranked_filename}), retrying")
+
+        self._remember(resumes, model, samples, comparison)
+        return comparison
+
+    async def best_of_n(self, n, unranked_filename, ranked_filename, model=None, opponent_is_ranked=True, lane='default'):
+        """Async version of `LLMResumeComparer.best_of_n`, with the same parallel waves, waiting in `lane`."""
+        if n % 2 == 0:
+            raise ValueError('n must be odd for best of n')
+        wins_required = (n + 1) // 2
+
+        model = model or self.model
+        resumes = self._build_resumes(unranked_filename, ranked_filename, opponent_is_ranked)
+        to_be_ranked_is_A = False
+        if randint(0, 1):
+            resumes = self._swap(resumes)
+            to_be_ranked_is_A = True
+
+        tally = {'wins': 0, 'losses': 0, 'win_comparison': None, 'loss_comparison': None}
+        samples = {}
+
+        num_votes = 0
+        while num_votes < 2 * n:
+            wave = wins_required - max(tally['wins'], tally['losses'])
+            votes = self._plan_votes(resumes, to_be_ranked_is_A, num_votes, wave, samples)
+            num_votes += wave
+
+            comparisons = await asyncio.gather(*(self._cast_vote(unranked_filename, *vote, model, lane) for vote in votes))
+            self._count_votes(tally, comparisons)
+
+            if tally['wins'] == wins_required:
+                return tally['win_comparison']
+            if tally['losses'] == wins_required:
+                return tally['loss_comparison']
+
+        return comparisons[-1]
+
 if __name__ == "__main__":
     resume_comparer = LLMResumeComparer(resume_folder='test_resumes', model='sonnet', temperature=0)
     comparison = resume_comparer.best_of_n(1, '000-jorge.png', '001-resume_test_update.jpg')
@@ -272,5 +755,4 @@ BACKLOG
 
 - write a function that pretty-prints a `comparison` dictionary (ideally make a `Comparison` object)
 - modify best of n comparison so that it accepts an initial value for wins / losses
-- create timers + api cost calculators
 """
\ No newline at end of file
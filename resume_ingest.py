@@ -0,0 +1,211 @@
+import io
+import json
+import os
+from comparison_store import ComparisonStore
+
+try:
+    from PIL import Image
+except ImportError:
+    # Without Pillow there is no PDF rendering and no near-duplicate check
+    Image = None
+
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+
+# (first bytes of the file, media type); WEBP is checked separately
+MAGIC_BYTES = ((b'\x89PNG\r\n\x1a\n', 'image/png'),
+               (b'\xff\xd8\xff', 'image/jpeg'),
+               (b'GIF87a', 'image/gif'),
+               (b'GIF89a', 'image/gif'),
+               (b'%PDF-', 'application/pdf'))
+
+def sniff_media_type(data):
+    """The media type of a file from its first bytes, or None if it isn't one we can send."""
+    for magic, media_type in MAGIC_BYTES:
+        if data.startswith(magic):
+            return media_type
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    return None
+
+def perceptual_hash(data, hash_size=16):
+    """
+    Difference hash of an image: one bit per neighbouring pair of pixels of a
+    (hash_size + 1) x hash_size grayscale thumbnail, set when the left one is brighter.
+    Rescaled, recompressed or slightly edited copies get hashes a few bits apart.
+    Returns None without Pillow or for data it can't read.
+    """
+    if Image is None:
+        return None
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            pixels = image.convert('L').resize((hash_size + 1, hash_size), Image.LANCZOS).tobytes()
+    except OSError:
+        return None
+
+    bits = 0
+    for row in range(hash_size):
+        for column in range(hash_size):
+            left = pixels[row * (hash_size + 1) + column]
+            bits = bits << 1 | (left > pixels[row * (hash_size + 1) + column + 1])
+    return bits
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+def manifest_path(resume_folder):
+    return f'./{resume_folder}/manifest.json'
+
+def load_manifest(resume_folder):
+    """The manifest written by `ResumeIngest.run()`, or an empty one."""
+    path = manifest_path(resume_folder)
+    if not os.path.exists(path):
+        return {'files': {}}
+    with open(path, 'r') as file:
+        return json.load(file)
+
+def manifest_media_types(manifest):
+    """SHA-256 -> media type of every resume the manifest kept."""
+    return {entry['hash']: entry['media_type'] for entry in manifest['files'].values() if entry['status'] == 'ok'}
+
+class ResumeIngest:
+    """
+    Pre-flight pass over the unranked folder, before any comparison is paid for:
+    1. Sniff each file's real format from its magic bytes
+    2. Render PDF resumes to one PNG (the first `max_pages` pages, one under the other);
+       the PDF itself moves to storage/originals
+    3. Move exact duplicates (same SHA-256) of a ranked or earlier unranked resume to
+       storage/duplicates
+    4. Flag near-duplicates (perceptual hashes at most `max_distance` bits apart) for review;
+       they stay in the unranked folder, since two people's resumes on one template can be as
+       close as a rescaled copy
+    5. Move files that aren't a PDF or an image the API accepts to storage/unsupported
+
+    Nothing is deleted or overwritten; a file that would clash with one already in
+    storage gets a suffix. Every file is recorded in manifest.json with its status,
+    hash and media type; `LLMResumeComparer` takes the media type from there.
+
+    Parameters:
+    - max_distance (int): most bits two perceptual hashes may differ by to be flagged as near-duplicates.
+        0 turns the check off.
+    - pdf_scale (float): PDF points to pixels (2.0 is 144 dpi).
+    """
+    def __init__(self, resume_folder, max_distance=8, hash_size=16, pdf_scale=2.0, max_pages=2):
+        self.resume_folder = resume_folder
+        self.max_distance = max_distance
+        self.hash_size = hash_size
+        self.pdf_scale = pdf_scale
+        self.max_pages = max_pages
+
+        # SHA-256 -> filename, and (perceptual hash, filename), of every resume kept so far
+        self.hashes = {}
+        self.perceptual_hashes = []
+
+    def run(self):
+        """Ingest every file in the unranked folder; returns the manifest."""
+        manifest = load_manifest(self.resume_folder)
+
+        for filename in sorted(os.listdir(f'./{self.resume_folder}/ranked')):
+            with open(f'./{self.resume_folder}/ranked/{filename}', 'rb') as file:
+                self._keep(file.read(), filename)
+
+        counts = {}
+        for filename in sorted(os.listdir(f'./{self.resume_folder}/unranked')):
+            entry = self._ingest(filename)
+            manifest['files'][entry.pop('filename')] = entry
+            counts[entry['status']] = counts.get(entry['status'], 0) + 1
+
+        with open(manifest_path(self.resume_folder), 'w') as file:
+            json.dump(manifest, file, indent=4)
+        print(f'ingest: {counts}')
+        return manifest
+
+    def _ingest(self, filename):
+        with open(f'./{self.resume_folder}/unranked/{filename}', 'rb') as file:
+            data = file.read()
+        entry = {'filename': filename, 'source': filename, 'media_type': sniff_media_type(data)}
+
+        if entry['media_type'] == 'application/pdf':
+            rendered = self.render_pdf(data)
+            if rendered is None:
+                return self._set_aside(entry, 'unsupported', 'unsupported', note='no PDF renderer installed')
+            stored_as = self._move(filename, 'originals')
+            if stored_as != filename:
+                entry['stored_as'] = stored_as
+            entry['filename'] = self._free_name(f'{os.path.splitext(filename)[0]}.png')
+            with open(f'./{self.resume_folder}/unranked/{entry['filename']}', 'wb') as file:
+                file.write(rendered)
+            data, entry['media_type'] = rendered, 'image/png'
+
+        if entry['media_type'] is None:
+            return self._set_aside(entry, 'unsupported', 'unsupported')
+
+        entry['hash'] = ComparisonStore.hash_bytes(data)
+        if entry['hash'] in self.hashes:
+            return self._set_aside(entry, 'duplicate', 'duplicates', duplicate_of=self.hashes[entry['hash']])
+
+        phash = perceptual_hash(data, self.hash_size)
+        if phash is not None and self.max_distance > 0:
+            for other_phash, other in self.perceptual_hashes:
+                if hamming_distance(phash, other_phash) <= self.max_distance:
+                    entry['near_duplicate_of'] = other
+                    print(f"{entry['source']}: near-duplicate of {other}, kept for review")
+                    break
+
+        self._keep(data, entry['filename'], phash)
+        entry['status'] = 'ok'
+        return entry
+
+    def _keep(self, data, filename, phash=None):
+        self.hashes.setdefault(ComparisonStore.hash_bytes(data), filename)
+        phash = perceptual_hash(data, self.hash_size) if phash is None else phash
+        if phash is not None:
+            self.perceptual_hashes.append((phash, filename))
+
+    def _set_aside(self, entry, status, folder, **details):
+        stored_as = self._move(entry['filename'], folder)
+        if stored_as != entry['filename']:
+            details['stored_as'] = stored_as
+        entry.update(status=status, **details)
+        print(f"{entry['source']}: {status}{f' of {details['duplicate_of']}' if 'duplicate_of' in details else ''}")
+        return entry
+
+    def _move(self, filename, folder):
+        """Move an unranked file to storage/`folder`; returns its name there."""
+        os.makedirs(f'./{self.resume_folder}/storage/{folder}', exist_ok=True)
+        stored_as = self._free_name(filename, f'storage/{folder}')
+        os.rename(f'./{self.resume_folder}/unranked/{filename}', f'./{self.resume_folder}/storage/{folder}/{stored_as}')
+        return stored_as
+
+    def _free_name(self, filename, folder='unranked'):
+        """`filename`, or `filename` with a suffix if `folder` already has one."""
+        stem, extension = os.path.splitext(filename)
+        candidate, suffix = filename, 1
+        while os.path.exists(f'./{self.resume_folder}/{folder}/{candidate}'):
+            candidate, suffix = f'{stem}-{suffix}{extension}', suffix + 1
+        return candidate
+
+    def render_pdf(self, data):
+        """PNG of the first `max_pages` pages, one under the other; None without pypdfium2 and Pillow."""
+        if pdfium is None or Image is None:
+            return None
+
+        document = pdfium.PdfDocument(data)
+        try:
+            pages = [document[index].render(scale=self.pdf_scale).to_pil()
+                     for index in range(min(self.max_pages, len(document)))]
+        finally:
+            document.close()
+
+        width = max(page.width for page in pages)
+        image = Image.new('RGB', (width, sum(page.height for page in pages)), 'white')
+        top = 0
+        for page in pages:
+            image.paste(page, (0, top))
+            top += page.height
+
+        buffer = io.BytesIO()
+        image.save(buffer, format='PNG')
+        return buffer.getvalue()
@@ -1,7 +1,24 @@
-from resume_comparer import LLMResumeComparer
+from resume_comparer import LLMResumeComparer, AsyncLLMResumeComparer
 from rankstring import RankString
+from rank_search import BinaryInsertionSearch, ConcurrentInsertion
+from rank_index import RankIndex
+from batch_insertion import BatchInsertion
+from rating_engine import RatingEngine
+from tournament import Tournament
+from shortlist import Shortlist
+from listwise_comparer import ListwiseComparer, ListwiseSort
+from pointwise_scorer import PointwiseScorer
+from cascade_policy import CascadePolicy, Option
+from resume_ingest import ResumeIngest, manifest_media_types
+from insert_journal import InsertJournal
+from job_queue import JobQueue
+from prefetcher import Prefetcher
+from verdict_graph import VerdictGraph
+from repair import Repair
+import asyncio
 import os
 import json
+import time
 
 class ResumeSorter:
     """
@@ -10,27 +27,97 @@ class ResumeSorter:
 
     Parameters:
     - resume_folder (str): name of the folder that contains 'ranked', 'unranked' and 'storage' folders.
+    - strategy (str): how `find_rank()` searches for the rank of a resume.
+        'walk': start at the median and move one rank per comparison (O(n) calls).
+        'binary': noisy binary search, see `BinaryInsertionSearch` (O(log n) calls).
+    - use_index (bool): keep the ranking in rankings.json (see `RankIndex`) instead of
+        renaming every file below the insertion point. The NNN-filename layout is
+        then written once, by `export_ranked_folder()` at the end of `insert_all()`.
+    - fast_verdict (bool): ask for a short structured verdict instead of an essay
+        (see `LLMResumeComparer`); `resume_comparer.explain()` fetches the essay for audits.
+    - cascade (bool): pick the model and number of votes of each comparison with a
+        `CascadePolicy` fitted to the comparison history, instead of the fixed schedule.
+        The policy is fitted at the start of `insert_all()`, or by `fit_cascade_policy()`.
+        The walk also sends a small random share of its Haiku steps to Sonnet, so the fit is unbiased.
+    - prescore (bool): give every resume a cheap absolute score first (see `PointwiseScorer`),
+        and start each `find_rank()` where similarly scored resumes already sit instead of at
+        the median. Scored at the start of `insert_all()`, or by `prescore_all()`.
+    - prefetch (int): with strategy='walk', send the Haiku votes of the next `prefetch` steps
+        while waiting on the current one (see `Prefetcher`). 0 turns it off.
+    - transitivity (bool): keep every verdict of the run in a `VerdictGraph`, and skip a
+        comparison the graph already implies (X beat Z and Z beat Y, both confidently).
+
+    Every verdict and every batch of renames is written to an `InsertJournal` before it
+    is applied. A run that is cut short picks up the resume it was ranking without
+    paying for its comparisons again.
     """
-    def __init__(self, resume_folder, debug=False):
-        self.resume_comparer = LLMResumeComparer(resume_folder)
+    STRATEGIES = ('walk', 'binary')
+
+    def __init__(self, resume_folder, debug=False, strategy='walk', use_index=False, fast_verdict=False, cascade=False,
+                 prescore=False, prefetch=0, transitivity=False):
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f'unknown strategy {strategy!r}')
+
+        self.resume_comparer = LLMResumeComparer(resume_folder, fast_verdict=fast_verdict)
         self.resume_folder = resume_folder
         self.debug = debug
+        self.strategy = strategy
 
-        # Store comparisons
+        # Comparisons made this run (every comparison is also kept in the comparer's `ComparisonStore`)
         self.comparisons = []
 
+        # Number of calls per model that each inserted resume needed
+        self.calls_per_insert = {}
+
         self.rank_string = RankString()
 
+        # Finishes the renames of a run that was cut short, before the index looks at the folder
+        self.journal = InsertJournal.open(resume_folder)
+
+        self.rank_index = RankIndex.open(resume_folder) if use_index else None
+
+        self.cascade = cascade
+        self.cascade_policy = None
+
+        # Filename (without rank) -> pointwise score, see `prescore_all()`
+        self.prescore = prescore
+        self.scorer = None
+        self.prior_scores = {}
+        # Pairwise calls the scores saved on each insert, estimated
+        self.prior_savings = []
+
+        self.prefetcher = Prefetcher(self.resume_comparer, prefetch) if prefetch else None
+
+        # Verdicts of this run, see `_inferred_or`
+        self.verdict_graph = VerdictGraph() if transitivity else None
+
     def find_rank(self):
+        self.prior_window = self._prior_window()
+        if self.strategy == 'binary':
+            return self._find_rank_binary()
+        return self._find_rank_walk()
+
+    def _find_rank_walk(self):
         """
         Algorithm:
         1. Sonnet (best of 3) to determine initial direction of resume
         2. Keep using Haiku (best of 1) until direction seems to change
         3. Confirm direction change with Sonnet (best of 1)
+
+        With a `cascade_policy`, the policy picks the model and votes of every step but
+        the confirmations instead, from a quarter of the ranks the resume can still end
+        up in (see `_walk_distance`), as `BinaryInsertionSearch` does. Confirmations
+        stay Sonnet: a Haiku one would only re-read the vote it is meant to check.
+        With pointwise scores (`prescore`), the walk starts from the scores' estimate instead of the median.
         """
+        policy = self.cascade_policy
+        median = (self.num_ranked_resumes - 1) // 2
+        if self.prior_window is not None:
+            # Where similarly scored resumes sit
+            median = min(self.prior_window[0], self.num_ranked_resumes - 1)
 
         # Initial rank is median
-        self.current_rank = (self.num_ranked_resumes - 1) // 2
+        self.current_rank = median
         
         first_comparison_is_win = None            
 
@@ -40,20 +127,12 @@ class ResumeSorter:
 
             # Determine initial direction
             if first_comparison_is_win == None:
-                comparison = self._bon_with_ranked_at_curr(self.current_rank, n=3)
-
-                # There might have been a filetype error; change .jpg to .png (or vice versa)
-                if self.resume_comparer.should_swap_mediatype:
-                    old_directory = f'./{self.resume_folder}/unranked/{self.to_be_ranked_filename}'
-                    mediatype = self.to_be_ranked_filename[-3:]
-                    filename = self.to_be_ranked_filename[:-3]
-                    mediatype = 'png' if mediatype == 'jpg' else 'jpg'
+                if policy is not None:
+                    comparison = self._ask_ranked_at_curr(self.current_rank, policy.choose(self._walk_distance(None)))
+                else:
+                    comparison = self._bon_with_ranked_at_curr(self.current_rank, n=3)
+                self._swap_mediatype_if_needed()
 
-                    self.to_be_ranked_filename = filename + mediatype
-                    new_directory = f'./{self.resume_folder}/unranked/{self.to_be_ranked_filename}'
-
-                    os.rename(old_directory, new_directory)
-                    
                 first_comparison_is_win = self._is_winner_to_be_ranked(comparison)
                 print('first: win' if first_comparison_is_win else 'first: loss')
                 # Increment or decrement rank
@@ -61,15 +140,23 @@ class ResumeSorter:
                 continue
 
             # Make comparison between two resumes
-            comparison = {'winner': None}
-            while comparison['winner'] == None:
-                comparison = self._compare_with_ranked_at_curr(self.current_rank)
+            if policy is not None:
+                option = policy.choose(self._walk_distance(first_comparison_is_win))
+                comparison = self._ask_ranked_at_curr(self.current_rank, option)
+            else:
+                self._prefetch(-1 if first_comparison_is_win else +1)
+                comparison = {'winner': None}
+                while comparison['winner'] == None:
+                    comparison = self._compare_with_ranked_at_curr(self.current_rank)
 
             comparison_is_win = self._is_winner_to_be_ranked(comparison)
             print('win' if comparison_is_win else 'loss')
 
             # If direction seems to change, do best of 3 to confirm
             if first_comparison_is_win != comparison_is_win:
+                if policy is not None:
+                    # Not the policy's choice, but part of the projected cost
+                    policy.project(Option('sonnet', 1), 1)
                 comparison = self._bon_with_ranked_at_curr(self.current_rank, n=1)
                 comparison_is_win = self._is_winner_to_be_ranked(comparison)
                 # If confirmed comparison did in fact change, end loop
@@ -78,12 +165,109 @@ class ResumeSorter:
                         self._incr_rank(comparison_is_win)
                     break
                 # Otherwise continue
+            elif policy is not None and policy.audit(option):
+                self._audit(self.current_rank)
 
             # Increment or decrement rank            
             done = self._incr_rank(first_comparison_is_win)
 
+        if self.prefetcher is not None:
+            self.prefetcher.cancel()
         print(f'final rank = {self.current_rank}')
         return self.current_rank # todo: change so that this is just accessed not returned
+
+    def _walk_distance(self, is_moving_up):
+        """
+        A quarter of the ranks the resume can still end up in, at least 1: the whole
+        list before the first step (`is_moving_up` None), the ranks above the current
+        one when moving up and those below it when moving down.
+        """
+        if is_moving_up is None:
+            lo, hi = 0, self.num_ranked_resumes
+        elif is_moving_up:
+            lo, hi = 0, self.current_rank
+        else:
+            lo, hi = self.current_rank, self.num_ranked_resumes
+        return max(1, (hi - lo + 1) // 4)
+
+    def _prefetch(self, direction):
+        """
+        Send the Haiku votes of this step and the next `prefetch` steps in `direction`,
+        if not sent already, and wait for this step's: `_compare_with_ranked_at_curr`
+        then finds it in the comparison store.
+        """
+        if self.prefetcher is None or (self.journal is not None and self.journal.replaying()):
+            return
+        ranks = [self.current_rank + direction * step for step in range(self.prefetcher.depth + 1)]
+        opponents = [self.ranked_filenames[rank] for rank in ranks if 0 <= rank < self.num_ranked_resumes]
+        self.prefetcher.prefetch(self.to_be_ranked_filename, opponents)
+        self.prefetcher.collect(self.to_be_ranked_filename, opponents[0])
+
+    def _find_rank_binary(self):
+        """
+        Noisy binary search; the steps are decided by `BinaryInsertionSearch`. With pointwise
+        scores the search starts in their window; if that was wrong, a confirmation reopens it.
+        """
+        lo, hi = self.prior_window[1:] if self.prior_window is not None else (0, None)
+        search = BinaryInsertionSearch(self.num_ranked_resumes, lo=lo, hi=hi, policy=self.cascade_policy)
+
+        while (step := search.next_step()) is not None:
+            self.current_rank = step.rank
+            print(f'{self.current_rank=}')
+
+            comparison = self._ask_ranked_at_curr(step.rank, Option(step.model, step.n))
+            self._swap_mediatype_if_needed()
+
+            comparison_is_win = self._is_winner_to_be_ranked(comparison)
+            print('win' if comparison_is_win else 'loss')
+            search.record(comparison_is_win)
+
+        self.current_rank = search.rank
+        print(f'final rank = {self.current_rank} after {search.num_steps} comparisons ({search.backtracks} backtracks)')
+        return self.current_rank
+
+    def _prior_window(self):
+        """(start, lo, hi) for the resume being ranked, from the pointwise scores; None without them."""
+        score = self.prior_scores.get(self.to_be_ranked_filename)
+        if score is None:
+            return None
+        ranked_scores = [self.prior_scores.get(self.rank_string.rm_rankstring_from_filename(filename))
+                         for filename in self.ranked_filenames]
+        return PointwiseScorer.window(score, ranked_scores)
+
+    def _prior_saving(self, rank):
+        """
+        Pairwise calls the pointwise prior saved on the insert that ended at `rank`: the calls
+        the search needs to get there from the middle, less those it needs from the prior's
+        estimate, counting one call per step.
+        """
+        if self.strategy == 'binary':
+            return self._search_calls(rank) - self._search_calls(rank, *self.prior_window[1:])
+        median = (self.num_ranked_resumes - 1) // 2
+        return abs(rank - median) - abs(rank - min(self.prior_window[0], self.num_ranked_resumes - 1))
+
+    def _search_calls(self, rank, lo=0, hi=None):
+        """Calls a `BinaryInsertionSearch` makes to end at `rank` when every vote agrees."""
+        search = BinaryInsertionSearch(self.num_ranked_resumes, lo=lo, hi=hi)
+        calls = 0
+        while (step := search.next_step()) is not None:
+            calls += (step.n + 1) // 2
+            search.record(step.rank >= rank)
+        return calls
+
+    def _swap_mediatype_if_needed(self):
+        """There might have been a filetype error; change .jpg to .png (or vice versa)"""
+        if not self.resume_comparer.should_swap_mediatype:
+            return
+
+        old_filename = self.to_be_ranked_filename
+        mediatype = self.to_be_ranked_filename[-3:]
+        filename = self.to_be_ranked_filename[:-3]
+        mediatype = 'png' if mediatype == 'jpg' else 'jpg'
+
+        self.to_be_ranked_filename = filename + mediatype
+        self._rename([(f'unranked/{old_filename}', f'unranked/{self.to_be_ranked_filename}')])
+        self.resume_comparer.should_swap_mediatype = False
     
     def _incr_rank(self, comparison_is_win):
         """
@@ -99,45 +283,131 @@ class ResumeSorter:
         
         return False
 
-    def _bon_with_ranked_at_curr(self, current_rank, n=3):
+    def _ask_ranked_at_curr(self, current_rank, option):
+        """Compare with ranked resume at rank `current_rank`, with `option.model` and best of `option.n`"""
+        if option.model == 'haiku' and option.n == 1:
+            comparison = {'winner': None}
+            while comparison['winner'] == None:
+                comparison = self._compare_with_ranked_at_curr(current_rank)
+            return comparison
+        return self._bon_with_ranked_at_curr(current_rank, n=option.n, model=option.model)
+
+    def _audit(self, current_rank):
+        """
+        Ask Sonnet once more about a step that didn't change direction, for the policy's fit
+        (see `CascadePolicy.audit()`). Never inferred from the verdict graph, and never steers the walk.
+        """
+        ranked_resume_at_curr = self.ranked_filenames[current_rank]
+        print(f'AUDIT: {self.to_be_ranked_filename} vs {ranked_resume_at_curr}')
+        self.resume_comparer.model = 'sonnet'
+        self._journalled(ranked_resume_at_curr, 'sonnet', 1,
+                         lambda: self.resume_comparer.best_of_n(1, self.to_be_ranked_filename, ranked_resume_at_curr))
+        self.resume_comparer.comparison_store.put_audit(
+            self.resume_comparer.image_hash(False, self.to_be_ranked_filename),
+            self.resume_comparer.image_hash(True, ranked_resume_at_curr),
+            self.resume_comparer.prompt_hash, self.cascade_policy.audit_rate)
+
+    def _bon_with_ranked_at_curr(self, current_rank, n=3, model='sonnet'):
         """Best of n comparison with ranked resume at rank `current_rank`"""
         ranked_resume_at_curr = self.ranked_filenames[current_rank]
         print(f'COMPARISON: {self.to_be_ranked_filename} vs {ranked_resume_at_curr}')
-        self.resume_comparer.model = 'sonnet'
-        print('model=sonnet')
-        comparison = self.resume_comparer.best_of_n(n, self.to_be_ranked_filename, ranked_resume_at_curr)
+        self.resume_comparer.model = model
+        print(f'model={model}')
+        comparison = self._journalled(ranked_resume_at_curr, model, n, lambda: self._inferred_or(
+            ranked_resume_at_curr, model, n, lambda: self.resume_comparer.best_of_n(n, self.to_be_ranked_filename, ranked_resume_at_curr)))
+        self.comparisons.append(comparison)
         if self.debug:
             input('Best of n complete. Continue?')
         return comparison
 
-    def _compare_with_ranked_at_curr(self, current_rank):
+    def _compare_with_ranked_at_curr(self, current_rank, model='haiku'):
         """Compare resume with ranked resume at rank `current_rank`"""
         ranked_resume_at_curr = self.ranked_filenames[current_rank]
         print(f'COMPARISON: {self.to_be_ranked_filename} vs {ranked_resume_at_curr}')
-        self.resume_comparer.model = 'haiku'
-        print('model=haiku')
-        comparison = self.resume_comparer.main(self.to_be_ranked_filename, ranked_resume_at_curr)
+        self.resume_comparer.model = model
+        print(f'model={model}')
+        comparison = self._journalled(ranked_resume_at_curr, model, 1, lambda: self._inferred_or(
+            ranked_resume_at_curr, model, 1, lambda: self.resume_comparer.main(self.to_be_ranked_filename, ranked_resume_at_curr)))
+        self.comparisons.append(comparison)
         self.resume_comparer.pretty_print(comparison)
         if self.debug:
             input('Continue?')
         return comparison
     
+    def _journalled(self, opponent, model, n, compare):
+        """The verdict the journal kept from a run that was cut short, or else `compare()`, journalled."""
+        if self.journal is None:
+            return compare()
+
+        comparison = self.journal.replayed(opponent, model, n)
+        if comparison is not None:
+            print('Verdict replayed from the journal')
+            return comparison
+
+        comparison = compare()
+        if comparison['winner'] is not None:
+            self.journal.record(opponent, model, n, comparison)
+        return comparison
+
+    def _inferred_or(self, opponent, model, n, compare):
+        """
+        The verdict the `VerdictGraph` implies between the resume being ranked and
+        `opponent`, if it is confident enough; otherwise `compare()`, added to the graph.
+        """
+        graph = self.verdict_graph
+        if graph is None:
+            return compare()
+
+        to_be_ranked_hash = self.resume_comparer.image_hash(False, self.to_be_ranked_filename)
+        opponent_hash = self.resume_comparer.image_hash(True, opponent)
+        graph.names.update({to_be_ranked_hash: self.to_be_ranked_filename, opponent_hash: opponent})
+
+        inferred = graph.infer(to_be_ranked_hash, opponent_hash)
+        if inferred is not None:
+            to_be_ranked_wins, confidence, chain = inferred
+            graph.num_inferred += 1
+            graph.calls_skipped += (n + 1) // 2
+            reason = f'Inferred from earlier verdicts: {graph.describe(chain)} (confidence {confidence:.3f})'
+            print(reason)
+            return {'Resume A': opponent, 'Resume B': self.to_be_ranked_filename,
+                    'winner': 'Resume B' if to_be_ranked_wins else 'Resume A',
+                    'to_be_ranked_resume': 'Resume B', 'claude_response': reason}
+
+        comparison = compare()
+        if comparison['winner'] is not None:
+            graph.add(to_be_ranked_hash, opponent_hash, self._is_winner_to_be_ranked(comparison), model, n)
+        return comparison
+
+    def _rename(self, moves):
+        """Make (source, target) renames, paths relative to the resume folder; journalled first, so never half done."""
+        if self.journal is not None:
+            self.journal.rename(moves)
+            return
+        for source, target in moves:
+            os.rename(f'./{self.resume_folder}/{source}', f'./{self.resume_folder}/{target}')
+
     @staticmethod
     def _is_winner_to_be_ranked(comparison):
         return comparison['winner'] == comparison['to_be_ranked_resume']
     
     def insert_unranked_file(self, rank):
         """Move unranked file into ranked folder based on its final rank."""
+        if self.rank_index is not None:
+            # One rename; the rank only goes into rankings.json
+            self.rank_index.insert(rank, self.to_be_ranked_filename)
+            os.rename(f'./{self.resume_folder}/unranked/{self.to_be_ranked_filename}', f'./{self.resume_folder}/ranked/{self.to_be_ranked_filename}')
+            return
 
         # Derank everything with rank >= `rank`
-        for filename in self.ranked_filenames[rank:]:
-            os.rename(f'./{self.resume_folder}/ranked/{filename}', f'./{self.resume_folder}/ranked/{self.rank_string.increment_ranked_filename(filename)}')
+        moves = [(f'ranked/{filename}', f'ranked/{self.rank_string.increment_ranked_filename(filename)}')
+                 for filename in self.ranked_filenames[rank:]]
 
         # Add the rank to the to-be-ranked filename
         new_filename = self.rank_string.add_rankstring_to_filename(self.to_be_ranked_filename, rank)
 
         # Move from unranked folder to ranked folder
-        os.rename(f'./{self.resume_folder}/unranked/{self.to_be_ranked_filename}', f'./{self.resume_folder}/ranked/{new_filename}')
+        moves.append((f'unranked/{self.to_be_ranked_filename}', f'ranked/{new_filename}'))
+        self._rename(moves)
 
     def unrank_files(self, idx_low=None, idx_high=None):
         """Move ranked files with index in `range(idx_low, idx_high)` back into the unranked folder."""
@@ -156,6 +426,17 @@ class ResumeSorter:
             raise ValueError('bad low index')
         if idx_high not in range(1, self.num_ranked_resumes+1):
             raise ValueError('bad high index')
+
+        if self.rank_index is not None:
+            for _ in range(idx_low, idx_high):
+                # Move first: if we crash in between, `RankIndex.open` moves the file back
+                name = self.rank_index.name_at(idx_low)
+                path = self.rank_index[idx_low]
+                os.rename(f'./{self.resume_folder}/ranked/{path}', f'./{self.resume_folder}/unranked/{name}')
+                self.rank_index.remove(idx_low)
+                print(f'Unranked {path}')
+            self.rank_index.checkpoint()
+            return
         
         # Move the files
         for i in range(idx_low, idx_high):
@@ -175,29 +456,67 @@ class ResumeSorter:
             os.rename(f'./{self.resume_folder}/ranked/{filename}', f'./{self.resume_folder}/ranked/{new_filename}')
     
     def read_ranked_folder(self):
-        self.num_ranked_resumes = len(os.listdir(f'./{self.resume_folder}/ranked'))
-        self.ranked_filenames = os.listdir(f'./{self.resume_folder}/ranked')
-        self.ranked_filenames.sort()
+        if self.rank_index is not None:
+            # Indexable in O(log n), like a list
+            self.ranked_filenames = self.rank_index
+        else:
+            self.ranked_filenames = sorted(os.listdir(f'./{self.resume_folder}/ranked'), key=self.rank_string.sort_key)
+        self.num_ranked_resumes = len(self.ranked_filenames)
+
+    def export_ranked_folder(self, width=None):
+        """Write the NNN-filename layout for the ranking in rankings.json (`use_index` only)."""
+        if self.rank_index is None:
+            raise ValueError('the ranked folder is only exported when use_index=True')
+        self.rank_index.export(width)
+
+    def fit_cascade_policy(self, **policy_kwargs):
+        """
+        Fit a `CascadePolicy` to the stored verdicts between ranked resumes; `find_rank()`
+        uses it from then on. Returns the policy.
+        """
+        self.read_ranked_folder()
+        ranks = {self.resume_comparer.image_hash(True, filename): rank
+                 for rank, filename in enumerate(self.ranked_filenames)}
+        store, prompt_hash = self.resume_comparer.comparison_store, self.resume_comparer.prompt_hash
+        self.cascade_policy = CascadePolicy(**policy_kwargs).fit(store.verdicts(prompt_hash), ranks, store.audits(prompt_hash))
+        return self.cascade_policy
 
     def insert(self, to_be_ranked_filename):
         # Re-read ranked folder
         self.read_ranked_folder()
 
         # If ranked folder empty, initialise
+        if self.num_ranked_resumes == 0 and self.rank_index is not None:
+            self.to_be_ranked_filename = to_be_ranked_filename
+            self.insert_unranked_file(0)
+            return
         if self.num_ranked_resumes == 0:
             new_filename = self.rank_string.add_rankstring_to_filename(to_be_ranked_filename, rank=0)
-            os.rename(f'./{self.resume_folder}/unranked/{to_be_ranked_filename}', f'./{self.resume_folder}/ranked/{new_filename}')
+            self._rename([(f'unranked/{to_be_ranked_filename}', f'ranked/{new_filename}')])
             return
 
         # Insert
         print(f'Ranking: {to_be_ranked_filename}')
         self.to_be_ranked_filename = to_be_ranked_filename
+        self.journal.start(to_be_ranked_filename, self.num_ranked_resumes)
+        num_calls_before = dict(self.resume_comparer.num_calls)
         rank = self.find_rank()
         self.insert_unranked_file(rank)
+        self.journal.clear()
+        if self.prior_window is not None:
+            self.prior_savings.append(self._prior_saving(rank))
 
-    def _update_usage_json(self, num_calls):
+        # Report how many calls this insert needed
+        calls = {model: self.resume_comparer.num_calls[model] - num_calls_before.get(model, 0)
+                 for model in self.resume_comparer.num_calls}
+        self.calls_per_insert[to_be_ranked_filename] = calls
+        print(f'{to_be_ranked_filename}: rank={rank}, calls={calls}')
+
+    def _update_usage_json(self, num_calls, payload=None, tokens=None):
         """
-        usage.json stores how many times each model was called.
+        usage.json stores how many times each model was called, how many
+        bytes and image tokens the `ImageNormalizer` saved, and the token totals
+        (including input tokens read from the prompt cache).
         This function updates the json at the end of `insert_all()`.
         """
         filepath = f'{self.resume_folder}/usage.json'
@@ -211,19 +530,364 @@ class ResumeSorter:
             else:
                 usage_data['num_calls'][key] = value
 
+        for section, counts in (('payload', payload), ('tokens', tokens)):
+            if counts is None:
+                continue
+            totals = usage_data.setdefault(section, {})
+            for key, value in counts.items():
+                totals[key] = totals.get(key, 0) + value
+
         with open(filepath, 'w') as file:
             json.dump(usage_data, file, indent=4)
 
-    def insert_all(self):
-        for filename in os.listdir(f'./{self.resume_folder}/unranked'):  
-            self.insert(filename)
-            if self.debug:
-                self.read_ranked_folder()
-                print(f'ranked_files={self.ranked_filenames}')
-        
-        num_calls = self.resume_comparer.num_calls
+    def prescore_all(self):
+        """
+        Score every resume, ranked and unranked, with a `PointwiseScorer` (scores already
+        in scores.json are not asked again). `find_rank()` uses the scores from then on.
+        """
+        self.read_ranked_folder()
+        items = [(filename, True) for filename in self.ranked_filenames]
+        items += [(filename, False) for filename in os.listdir(f'./{self.resume_folder}/unranked')]
+
+        if self.scorer is None:
+            self.scorer = PointwiseScorer(self.resume_comparer)
+        scores = self.scorer.score_all(items)
+        ranked = set(self.ranked_filenames)
+        # Ranked files are keyed by their name without the rank string, which is the name
+        # they had in unranked/; unranked names are kept as they are, digits and all
+        self.prior_scores = {self.rank_string.rm_rankstring_from_filename(filename) if filename in ranked else filename: score
+                             for filename, score in scores.items()}
+        return self.prior_scores
+
+    def prior_report(self):
+        """Prints and returns what the pointwise scores cost and the pairwise calls they saved."""
+        report = {'scoring_calls': self.scorer.num_calls if self.scorer is not None else 0,
+                  'inserts': len(self.prior_savings),
+                  'pairwise_calls_saved': sum(self.prior_savings)}
+        print(f"pointwise prior: {report['scoring_calls']} scoring calls saved about "
+              f"{report['pairwise_calls_saved']} pairwise calls over {report['inserts']} inserts")
+        return report
+
+    def ingest(self, **ingest_kwargs):
+        """
+        Run a `ResumeIngest` over the unranked folder: PDFs are rendered to images and
+        duplicates set aside, and the comparer takes media types from its manifest.
+        Returns the manifest.
+        """
+        manifest = ResumeIngest(self.resume_folder, **ingest_kwargs).run()
+        self.resume_comparer.media_types = manifest_media_types(manifest)
+        return manifest
+
+    def insert_all(self, concurrency=None, offline=False, ingest=False, distributed=False, queue_path=None):
+        """
+        Rank every file in the unranked folder; with `ingest=True`, after running `ingest()`.
+
+        With `concurrency=None` the files are inserted one at a time using `strategy`.
+        Otherwise they are all inserted at once against a snapshot of the ranked
+        folder (see `ConcurrentInsertion`), with up to `concurrency` requests in flight.
+        With `offline=True` the same insertion is made in rounds of Message Batches
+        (see `BatchInsertion`); an interrupted offline run continues where it stopped.
+        With `distributed=True` this process only coordinates: the comparisons of the
+        same insertion go into a `JobQueue` (`queue_path`, by default jobs.sqlite in
+        the resume folder) and are made by `Worker` processes (python job_queue.py worker ...).
+        """
+        if ingest:
+            self.ingest()
+        filenames = os.listdir(f'./{self.resume_folder}/unranked')
+        if self.journal.pending is not None:
+            # Finish the resume a cut short run was ranking first, while its verdicts still apply
+            filenames.sort(key=lambda filename: filename != self.journal.pending['filename'])
+        if self.cascade:
+            self.fit_cascade_policy()
+        if self.prescore:
+            self.prescore_all()
+        num_calls_before = dict(self.resume_comparer.num_calls)
+
+        if offline:
+            num_calls, payload, tokens = self._insert_all_offline(filenames)
+        elif distributed:
+            num_calls, payload, tokens = self._insert_all_distributed(filenames, queue_path)
+            # Made by the workers
+            num_calls_before = {}
+        elif concurrency:
+            num_calls, payload, tokens = asyncio.run(self._insert_all_concurrent(filenames, concurrency))
+            # Made by a comparer of its own
+            num_calls_before = {}
+        else:
+            for filename in filenames:  
+                self.insert(filename)
+                if self.debug:
+                    self.read_ranked_folder()
+                    print(f'ranked_files={self.ranked_filenames}')
+            if self.prefetcher is not None:
+                self.prefetcher.finish()
+            num_calls = self.resume_comparer.num_calls
+            payload = self.resume_comparer.payload_report()
+            tokens = self.resume_comparer.token_report()
+
         print(f'num_calls={num_calls}')
-        self._update_usage_json(num_calls)
+        self.resume_comparer.scheduler.report()
+        self._update_usage_json(num_calls, payload, tokens)
+        if self.rank_index is not None:
+            self.export_ranked_folder()
+        self.resume_comparer.comparison_store.save_stats()
+
+        if self.cascade_policy is not None:
+            self.cascade_policy.record({model: calls - num_calls_before.get(model, 0) for model, calls in num_calls.items()})
+            self.cascade_policy.report()
+        if self.prescore:
+            self.prior_report()
+        if self.verdict_graph is not None:
+            self.verdict_graph.report()
+
+    async def _insert_all_concurrent(self, filenames, concurrency):
+        """
+        Runs a `ConcurrentInsertion`, starting each comparison as soon as it is known.
+        Returns num_calls and the payload and token reports.
+        """
+        resume_comparer = AsyncLLMResumeComparer(self.resume_folder, max_concurrency=concurrency,
+                                                 comparison_store=self.resume_comparer.comparison_store,
+                                                 normalizer=self.resume_comparer.normalizer,
+                                                 payload_cache=self.resume_comparer.payload_cache,
+                                                 fast_verdict=self.resume_comparer.fast_verdict,
+                                                 scheduler=self.resume_comparer.scheduler,
+                                                 telemetry=self.resume_comparer.telemetry)
+
+        self.read_ranked_folder()
+        insertion = ConcurrentInsertion(filenames, self.ranked_filenames, policy=self.cascade_policy)
+
+        in_flight = {}
+        while not insertion.done:
+            for job in insertion.pending_jobs():
+                in_flight[asyncio.create_task(self._run_job(resume_comparer, job))] = job
+            if not in_flight:
+                break
+
+            finished, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            for task in finished:
+                job = in_flight.pop(task)
+                self.comparisons.append(task.result())
+                insertion.record(job, self._is_winner_to_be_ranked(task.result()))
+
+        self._write_ranked_order(insertion.final_order())
+
+        self.calls_per_insert.update(resume_comparer.calls_by_resume)
+        for filename, calls in resume_comparer.calls_by_resume.items():
+            print(f'{filename}: calls={calls}')
+        return resume_comparer.num_calls, resume_comparer.payload_report(), resume_comparer.token_report()
+
+    def _insert_all_offline(self, filenames, poll_interval=60):
+        """Runs a `BatchInsertion`. Returns num_calls and the payload and token reports."""
+        self.read_ranked_folder()
+        batch_insertion = BatchInsertion(self.resume_comparer, f'./{self.resume_folder}/batch_state.json', poll_interval,
+                                         policy=self.cascade_policy)
+        order = batch_insertion.run(filenames, self.ranked_filenames)
+        self.comparisons.extend(batch_insertion.comparisons)
+
+        self._write_ranked_order(order)
+        return self.resume_comparer.num_calls, self.resume_comparer.payload_report(), self.resume_comparer.token_report()
+
+    def _insert_all_distributed(self, filenames, queue_path=None, poll_interval=0.5):
+        """
+        Runs a `ConcurrentInsertion` whose comparisons are made by `Worker` processes.
+        Returns num_calls; the payload and token reports are the workers' (see their telemetry).
+        """
+        queue = JobQueue(queue_path) if queue_path else JobQueue.for_folder(self.resume_folder)
+        queue.open()
+
+        self.read_ranked_folder()
+        insertion = ConcurrentInsertion(filenames, self.ranked_filenames, policy=self.cascade_policy)
+
+        num_calls = {'haiku': 0, 'sonnet': 0}
+        # job id -> Job
+        in_flight = {}
+        while not insertion.done:
+            for job in insertion.pending_jobs():
+                in_flight[queue.put(self._queue_job(job))] = job
+            if not in_flight:
+                break
+
+            results = queue.results(list(in_flight))
+            if not results:
+                time.sleep(poll_interval)
+                continue
+            for job_id, result in results.items():
+                job = in_flight.pop(job_id)
+                comparison = result['comparison']
+                self.comparisons.append(comparison)
+                insertion.record(job, self._is_winner_to_be_ranked(comparison))
+                for model, calls in result['calls'].items():
+                    num_calls[model] = num_calls.get(model, 0) + calls
+                    self.calls_per_insert.setdefault(job.to_be_ranked, {}).setdefault(model, 0)
+                    self.calls_per_insert[job.to_be_ranked][model] += calls
+
+        self._write_ranked_order(insertion.final_order())
+        queue.finish()
+        queue.close()
+        return num_calls, None, None
+
+    def _queue_job(self, job):
+        """A `ConcurrentInsertion` job as a `JobQueue` job: the two resumes with the hashes of their contents."""
+        return {'key': job.key, 'to_be_ranked': job.to_be_ranked, 'opponent': job.opponent,
+                'opponent_is_ranked': job.opponent_is_ranked, 'model': job.model, 'n': job.n,
+                'to_be_ranked_hash': self.resume_comparer.image_hash(False, job.to_be_ranked),
+                'opponent_hash': self.resume_comparer.image_hash(job.opponent_is_ranked, job.opponent)}
+
+    def rate_all(self, **engine_kwargs):
+        """
+        Rank every resume, ranked and unranked, with a `RatingEngine`: a Bradley-Terry
+        fit over every stored comparison, asking Claude only for the most informative
+        pairs until the order is stable. Ranked resumes can move too.
+        The scores and their uncertainties are saved in ratings.json.
+        """
+        self.read_ranked_folder()
+        items = [(filename, True) for filename in self.ranked_filenames]
+        items += [(filename, False) for filename in os.listdir(f'./{self.resume_folder}/unranked')]
+
+        engine = RatingEngine(self.resume_comparer, items, **engine_kwargs)
+        order = engine.run()
+        self._write_ranked_order(order)
+
+        ratings = {self.rank_string.rm_rankstring_from_filename(filename): rating
+                   for filename, rating in engine.ratings().items()}
+        with open(f'./{self.resume_folder}/ratings.json', 'w') as file:
+            json.dump(ratings, file, indent=4)
+
+        self._update_usage_json({self.resume_comparer.model: engine.num_calls},
+                                self.resume_comparer.payload_report(), self.resume_comparer.token_report())
+        if self.rank_index is not None:
+            self.export_ranked_folder()
+        self.resume_comparer.comparison_store.save_stats()
+        return engine
+
+    def tournament_all(self, max_concurrency=16):
+        """
+        Rank every resume, ranked and unranked, with a sorting network (see `Tournament`).
+        Every comparison in a round is independent, so each round goes out as one
+        concurrent wave: the wall time grows with the number of rounds, not calls.
+        Returns `Tournament.report()`, which compares the calls and rounds with `insert_all()`.
+        """
+        self.read_ranked_folder()
+        items = [(filename, True) for filename in self.ranked_filenames]
+        items += [(filename, False) for filename in os.listdir(f'./{self.resume_folder}/unranked')]
+
+        tournament = Tournament(self.resume_comparer, items, max_concurrency)
+        self._write_ranked_order(tournament.run())
+
+        self._update_usage_json({self.resume_comparer.model: tournament.num_calls},
+                                self.resume_comparer.payload_report(), self.resume_comparer.token_report())
+        if self.rank_index is not None:
+            self.export_ranked_folder()
+        self.resume_comparer.comparison_store.save_stats()
+        return tournament.report()
+
+    def listwise_all(self, k=6, max_concurrency=16, **sort_kwargs):
+        """
+        Rank every resume, ranked and unranked, with calls that each rank `k` of them
+        at once (see `ListwiseComparer` and `ListwiseSort`): about n / k calls per round
+        instead of one call per pair. Ranked resumes can move too.
+        Returns `ListwiseSort.report()`, which compares the calls with `insert_all()`.
+        """
+        self.read_ranked_folder()
+        items = [(filename, True) for filename in self.ranked_filenames]
+        items += [(filename, False) for filename in os.listdir(f'./{self.resume_folder}/unranked')]
+
+        listwise = ListwiseComparer(self.resume_comparer, k, max_concurrency)
+        listwise_sort = ListwiseSort(listwise, items, **sort_kwargs)
+        self._write_ranked_order(listwise_sort.run())
+
+        self._update_usage_json({self.resume_comparer.model: listwise_sort.num_calls},
+                                self.resume_comparer.payload_report(), self.resume_comparer.token_report())
+        if self.rank_index is not None:
+            self.export_ranked_folder()
+        self.resume_comparer.comparison_store.save_stats()
+        return listwise_sort.report()
+
+    def shortlist_all(self, k, margin=None, max_concurrency=16, seed=None):
+        """
+        Find the best `k` resumes, ranked and unranked, without ordering the others
+        (see `Shortlist`). The shortlist goes into the ranked folder, best first, and
+        every other resume into the 'rest' folder, unordered. Returns `Shortlist.report()`.
+        """
+        self.read_ranked_folder()
+        items = [(filename, True) for filename in self.ranked_filenames]
+        items += [(filename, False) for filename in os.listdir(f'./{self.resume_folder}/unranked')]
+
+        shortlist = Shortlist(self.resume_comparer, items, k, margin, max_concurrency, seed=seed)
+        top, rest = shortlist.run()
+
+        os.makedirs(f'./{self.resume_folder}/rest', exist_ok=True)
+        moves = []
+        for filename, is_ranked in rest:
+            if not is_ranked:
+                moves.append((f'unranked/{filename}', f'rest/{filename}'))
+            elif self.rank_index is not None:
+                entry = self.rank_index.remove(self.rank_index.rank_of(filename))
+                moves.append((f'ranked/{filename}', f"rest/{entry['name']}"))
+            else:
+                moves.append((f'ranked/{filename}', f'rest/{self.rank_string.rm_rankstring_from_filename(filename)}'))
+        self._rename(moves)
+        self._write_ranked_order(top)
+
+        self._update_usage_json(shortlist.num_calls, self.resume_comparer.payload_report(), self.resume_comparer.token_report())
+        if self.rank_index is not None:
+            self.export_ranked_folder()
+        self.resume_comparer.comparison_store.save_stats()
+        return shortlist.report()
+
+    def repair(self, extra_votes=3, **repair_kwargs):
+        """
+        Check the ranked folder against every stored verdict and fix only the pairs
+        that disagree with it (see `Repair`): contradicting and cyclic pairs get
+        `extra_votes` new votes, and the stretches still in doubt are re-sorted in
+        place. Returns `Repair.report()`, which compares the calls with ranking from scratch.
+        """
+        self.read_ranked_folder()
+        repair = Repair(self.resume_comparer, list(self.ranked_filenames), extra_votes, **repair_kwargs)
+        self._write_ranked_order([(filename, True) for filename in repair.run()])
+
+        self._update_usage_json({self.resume_comparer.model: repair.num_calls},
+                                self.resume_comparer.payload_report(), self.resume_comparer.token_report())
+        if self.rank_index is not None:
+            self.export_ranked_folder()
+        self.resume_comparer.comparison_store.save_stats()
+        return repair.report()
+
+    @staticmethod
+    async def _run_job(resume_comparer, job):
+        print(f'COMPARISON: {job.to_be_ranked} vs {job.opponent} (model={job.model}, n={job.n})')
+        return await resume_comparer.best_of_n(job.n, job.to_be_ranked, job.opponent, model=job.model,
+                                               opponent_is_ranked=job.opponent_is_ranked, lane=job.lane)
+
+    def _write_ranked_order(self, order):
+        """
+        Rename the ranked folder to match `order`, a list of (filename, is_ranked) pairs.
+        Unranked files are moved into the ranked folder. Ranked files may also change
+        order (see `rate_all()`); a file's new name only differs from its old one in
+        the rank prefix, so no rename overwrites another file.
+        """
+        if self.rank_index is not None:
+            for rank, (filename, is_ranked) in enumerate(order):
+                if not is_ranked:
+                    self.rank_index.insert(rank, filename)
+                    os.rename(f'./{self.resume_folder}/unranked/{filename}', f'./{self.resume_folder}/ranked/{filename}')
+                elif self.rank_index[rank] != filename:
+                    entry = self.rank_index.remove(self.rank_index.rank_of(filename))
+                    self.rank_index.insert(rank, entry['name'], entry['path'])
+            return
+
+        moves = []
+        for rank in reversed(range(len(order))):
+            filename, is_ranked = order[rank]
+            if is_ranked:
+                og_filename = self.rank_string.rm_rankstring_from_filename(filename)
+                new_filename = self.rank_string.add_rankstring_to_filename(og_filename, rank)
+                if new_filename != filename:
+                    moves.append((f'ranked/{filename}', f'ranked/{new_filename}'))
+            else:
+                new_filename = self.rank_string.add_rankstring_to_filename(filename, rank)
+                moves.append((f'unranked/{filename}', f'ranked/{new_filename}'))
+        self._rename(moves)
 
 if __name__ == '__main__':
     RESUME_FOLDER = 'resumes_uk copy'
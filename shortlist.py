@@ -0,0 +1,140 @@
+import random
+from tournament import Tournament, merge_sort_network
+
+class Shortlist:
+    """
+    Finds the best `k` resumes without ordering the rest of the pool.
+
+    1. Elimination (Haiku, best of 1): quickselect. Every resume still in the pool
+       is compared with a random pivot, all in one concurrent wave. If at least
+       `k + margin` resumes beat the pivot, the pivot and everything it beat go to
+       the rest. Otherwise those that beat it are in, and the search goes on among
+       the ones it beat. This stops once `k + margin` candidates are left, after
+       about 2n calls on average.
+    2. Ordering (Sonnet): the candidates are sorted with a `Tournament`. The best `k`
+       are the shortlist and the other `margin` go to the rest.
+
+    A resume Haiku wrongly says beat the pivot only takes up a place in the
+    tournament, which the margin is there for. One it wrongly says lost to the pivot
+    is gone for good if the pivot is cut, and has to compete for the places that are
+    left otherwise. So when fewer than `margin` places would be left for the losers
+    (none at all when the pivot is cut), each loser gets a second vote against the
+    pivot, with the labels the other way round, and only counts as a loser if it
+    loses that one too. The second vote is Haiku's, unless the pivot is cut with
+    fewer than `margin` resumes to spare: then it sits just below the cut, where
+    Haiku makes most of its mistakes, and the vote is Sonnet's. A top-k resume is
+    then only lost if two votes against a pivot below it are wrong.
+
+    The number of calls grows linearly with the pool (about 3n Haiku calls); only the
+    k + margin candidates and the losers of pivots just below the cut get a Sonnet vote.
+
+    Parameters:
+    - resume_comparer (LLMResumeComparer): makes the comparisons.
+    - items (list): (filename, is_ranked) pairs; `is_ranked` says which folder the file is in.
+    - k (int): size of the shortlist.
+    - margin (int): candidates kept past `k` for the Sonnet round; defaults to max(3, k // 2).
+    """
+    def __init__(self, resume_comparer, items, k, margin=None, max_concurrency=16, max_attempts=3, seed=None):
+        if k < 1:
+            raise ValueError('k must be at least 1')
+        self.resume_comparer = resume_comparer
+        self.items = list(items)
+        self.k = min(k, len(self.items))
+        self.margin = max(3, k // 2) if margin is None else margin
+        self.max_concurrency = max_concurrency
+        self.max_attempts = max_attempts
+        self.random = random.Random(seed)
+
+        self.images = [{'filename': filename, **resume_comparer.get_image(is_ranked, filename)}
+                       for filename, is_ranked in self.items]
+
+        self.num_calls = {'haiku': 0, 'sonnet': 0}
+        self.rounds = 0
+
+    def run(self):
+        """Returns (shortlist, rest): the best `k` (filename, is_ranked) pairs, best first, and the others."""
+        candidates, rest = self._eliminate(self.k + self.margin)
+        print(f'Elimination: {len(candidates)} candidates left after {self.rounds} rounds')
+
+        model = self.resume_comparer.model
+        self.resume_comparer.model = 'sonnet'
+        try:
+            tournament = Tournament(self.resume_comparer, [self.items[index] for index in candidates],
+                                    self.max_concurrency, self.max_attempts)
+            order = tournament.run()
+        finally:
+            self.resume_comparer.model = model
+        self.num_calls['sonnet'] += tournament.num_calls
+        self.rounds += tournament.rounds
+
+        rest = [self.items[index] for index in rest] + order[self.k:]
+        return order[:self.k], rest
+
+    def _eliminate(self, target):
+        """Haiku quickselect down to `target` candidates. Returns (candidates, rest) as indices into `items`."""
+        kept, pool, rest = [], list(range(len(self.items))), []
+        while len(kept) + len(pool) > target:
+            needed = target - len(kept)
+            pivot = self.random.choice(pool)
+            others = [index for index in pool if index != pivot]
+            wins = self._beats_pivot(pivot, others)
+            better = [index for index, win in zip(others, wins) if win]
+            worse = [index for index, win in zip(others, wins) if not win]
+
+            # Places left for the resumes that lost once the pivot and those that beat it are in; negative if they are cut
+            places_left = needed - len(better) - 1
+            if worse and places_left < self.margin:
+                # A loser only loses if it loses a second vote too; just below the cut, that one is Sonnet's
+                model = 'sonnet' if -self.margin <= places_left < 0 else 'haiku'
+                rechecked = self._beats_pivot(pivot, worse, model, swap=True)
+                better += [index for index, win in zip(worse, rechecked) if win]
+                worse = [index for index, win in zip(worse, rechecked) if not win]
+
+            if len(better) >= needed:
+                rest += worse + [pivot]
+                pool = better
+            else:
+                kept += better + [pivot]
+                pool = worse
+        return kept + pool, rest
+
+    def _beats_pivot(self, pivot, others, model='haiku', swap=False):
+        """
+        One concurrent wave with `model`: does each resume in `others` beat `pivot`?
+        `swap` asks with the labels the other way round from the first time.
+        """
+        self.rounds += 1
+        # Votes as (resumes, to_be_ranked_is_A, sample); the challenger plays the one being ranked
+        votes = [self.resume_comparer._fixed_labels({'Resume A': self.images[pivot], 'Resume B': self.images[index]})
+                 for index in others]
+        if swap:
+            votes = [(self.resume_comparer._swap(resumes), not to_be_ranked_is_A) for resumes, to_be_ranked_is_A in votes]
+
+        comparer_model = self.resume_comparer.model
+        self.resume_comparer.model = model
+        try:
+            wins = [None] * len(votes)
+            undecided = list(range(len(votes)))
+            for attempt in range(self.max_attempts):
+                calls_before = self.resume_comparer.num_calls[model]
+                comparisons = self.resume_comparer._cast_votes([(*votes[v], attempt) for v in undecided],
+                                                               max_workers=self.max_concurrency)
+                self.num_calls[model] += self.resume_comparer.num_calls[model] - calls_before
+
+                for v, comparison in zip(undecided, comparisons):
+                    if comparison['winner'] is not None:
+                        wins[v] = comparison['winner'] == comparison['to_be_ranked_resume']
+                undecided = [v for v in undecided if wins[v] is None]
+                if not undecided:
+                    break
+        finally:
+            self.resume_comparer.model = comparer_model
+        return [bool(win) for win in wins]
+
+    def report(self):
+        """Calls per model, next to what ordering the whole pool with a `Tournament` would have made."""
+        report = {'resumes': len(self.items), 'k': self.k, 'calls': dict(self.num_calls), 'rounds': self.rounds,
+                  'tournament_comparisons': sum(len(comparators) for comparators in merge_sort_network(len(self.items)))}
+        print(f"shortlist: top {self.k} of {len(self.items)} in {report['rounds']} rounds, calls={report['calls']}; "
+              f"ordering everything would take {report['tournament_comparisons']} comparisons")
+        return report
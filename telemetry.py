@@ -0,0 +1,153 @@
+import argparse
+import json
+import os
+import re
+import threading
+import time
+
+# US dollars per million tokens: input, output, prompt cache write, prompt cache read
+PRICES = {'haiku': {'input_tokens': 0.25, 'output_tokens': 1.25,
+                    'cache_creation_input_tokens': 0.30, 'cache_read_input_tokens': 0.03},
+          'sonnet': {'input_tokens': 3.00, 'output_tokens': 15.00,
+                     'cache_creation_input_tokens': 3.75, 'cache_read_input_tokens': 0.30}}
+
+# Message Batches cost half as much
+BATCH_DISCOUNT = 0.5
+
+TOKEN_KEYS = ('input_tokens', 'cache_creation_input_tokens', 'cache_read_input_tokens', 'output_tokens')
+
+def call_cost(model, tokens, batch=False):
+    """Cost in US dollars of one call, from its token counts."""
+    prices = PRICES.get(model)
+    if prices is None:
+        return 0.0
+    cost = sum(tokens.get(key, 0) * prices[key] for key in TOKEN_KEYS) / 1_000_000
+    return cost * BATCH_DISCOUNT if batch else cost
+
+def read_log(log_path):
+    """Every record in a call log."""
+    if not os.path.exists(log_path):
+        return []
+    with open(log_path, 'r') as file:
+        # The last line may be cut short if a run was killed mid-write
+        return [json.loads(line) for line in file if line.strip().endswith('}')]
+
+class Telemetry:
+    """
+    Keeps a record of every call to Claude as it happens, so nothing is lost when
+    a run crashes before `insert_all()` writes usage.json.
+
+    - `log_path`: one JSON line per call (the resumes, model, wall time, time queued
+      in the `RequestScheduler`, retries, token counts and cost), appended and flushed
+      after every call.
+    - `metrics_path`: Prometheus text format totals per model (calls, tokens, cost,
+      retries, seconds), rewritten after every call. Point node_exporter's textfile
+      collector at the folder, or just read it.
+
+    Every `Worker` process appends to the same log but writes its own metrics file
+    (metrics-<worker>.prom), with only its own calls and a `worker` label, so no
+    process overwrites another's totals and no counter goes backwards; add them up
+    across the label for the whole run.
+
+    The totals start from the records this process (or the earlier runs with the same
+    `worker`) already logged, so they cover every run. `summary()` breaks cost and
+    latency down per resume that was ranked.
+    """
+    def __init__(self, log_path, metrics_path=None, worker=None):
+        self.log_path = log_path
+        self.metrics_path = metrics_path
+        self.worker = worker
+        self.lock = threading.Lock()
+
+        # model -> totals
+        self.totals = {}
+        for record in read_log(log_path):
+            if record.get('worker') == worker:
+                self._add(record)
+
+    @classmethod
+    def for_folder(cls, resume_folder, worker=None):
+        """The coordinator's telemetry, or with `worker` that worker's (see `Worker`)."""
+        # Worker ids are host:pid by default; keep the filename portable
+        metrics_filename = 'metrics.prom' if worker is None else f"metrics-{re.sub(r'[^\w.-]', '_', worker)}.prom"
+        return cls(f'./{resume_folder}/calls.jsonl', f'./{resume_folder}/{metrics_filename}', worker)
+
+    def record(self, model, to_be_ranked, opponent, tokens, stats=None, batch=False):
+        """Log one call. `stats` is what the `RequestScheduler` measured (see `RequestScheduler.create`)."""
+        stats = stats or {}
+        record = {'time': time.time(), 'model': model, 'to_be_ranked': to_be_ranked, 'opponent': opponent,
+                  'wall_seconds': round(stats.get('wall_seconds', 0.0), 3),
+                  'queue_seconds': round(stats.get('queue_seconds', 0.0), 3),
+                  'retries': stats.get('retries', 0), 'batch': batch, 'worker': self.worker,
+                  **{key: tokens.get(key, 0) for key in TOKEN_KEYS},
+                  'cost_usd': call_cost(model, tokens, batch)}
+
+        with self.lock:
+            os.makedirs(os.path.dirname(self.log_path) or '.', exist_ok=True)
+            with open(self.log_path, 'a') as file:
+                file.write(json.dumps(record) + '\n')
+            self._add(record)
+            if self.metrics_path is not None:
+                self._write_metrics()
+        return record
+
+    def _add(self, record):
+        totals = self.totals.setdefault(record['model'], {'calls': 0, 'retries': 0, 'cost_usd': 0.0,
+                                                          'wall_seconds': 0.0, 'queue_seconds': 0.0,
+                                                          **{key: 0 for key in TOKEN_KEYS}})
+        totals['calls'] += 1
+        for key in ('retries', 'cost_usd', 'wall_seconds', 'queue_seconds', *TOKEN_KEYS):
+            totals[key] += record[key]
+
+    def _write_metrics(self):
+        lines = []
+        worker = '' if self.worker is None else f',worker="{self.worker}"'
+
+        def metric(name, kind, help_text, values):
+            lines.extend([f'# HELP resume_sorter_{name} {help_text}', f'# TYPE resume_sorter_{name} {kind}'])
+            lines.extend(f'resume_sorter_{name}{{{labels}{worker}}} {value}' for labels, value in values)
+
+        models = sorted(self.totals)
+        metric('calls_total', 'counter', 'Calls to Claude.',
+               [(f'model="{model}"', self.totals[model]['calls']) for model in models])
+        metric('retries_total', 'counter', 'Retries after a transient error.',
+               [(f'model="{model}"', self.totals[model]['retries']) for model in models])
+        metric('tokens_total', 'counter', 'Tokens, by kind.',
+               [(f'model="{model}",kind="{key}"', self.totals[model][key]) for model in models for key in TOKEN_KEYS])
+        metric('cost_usd_total', 'counter', 'Cost in US dollars.',
+               [(f'model="{model}"', round(self.totals[model]['cost_usd'], 6)) for model in models])
+        metric('call_seconds_total', 'counter', 'Wall time of the calls, retries included.',
+               [(f'model="{model}"', round(self.totals[model]['wall_seconds'], 3)) for model in models])
+        metric('queue_seconds_total', 'counter', 'Time calls waited for the rate limits.',
+               [(f'model="{model}"', round(self.totals[model]['queue_seconds'], 3)) for model in models])
+
+        temp_path = f'{self.metrics_path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w') as file:
+            file.write('\n'.join(lines) + '\n')
+        os.replace(temp_path, self.metrics_path)
+
+def summary(log_path):
+    """
+    Prints and returns cost and latency per ranked resume:
+    {to_be_ranked: {'calls': {model: n}, 'cost_usd', 'wall_seconds', 'queue_seconds', 'retries'}}
+    """
+    resumes = {}
+    for record in read_log(log_path):
+        resume = resumes.setdefault(record['to_be_ranked'], {'calls': {}, 'cost_usd': 0.0, 'wall_seconds': 0.0,
+                                                             'queue_seconds': 0.0, 'retries': 0})
+        resume['calls'][record['model']] = resume['calls'].get(record['model'], 0) + 1
+        for key in ('cost_usd', 'wall_seconds', 'queue_seconds', 'retries'):
+            resume[key] += record[key]
+
+    print(f"{'resume':<40} {'calls':>6} {'cost $':>9} {'wall s':>8} {'queued s':>9} {'retries':>8}")
+    for filename, resume in sorted(resumes.items(), key=lambda item: -item[1]['cost_usd']):
+        print(f"{filename[:40]:<40} {sum(resume['calls'].values()):>6} {resume['cost_usd']:>9.4f} "
+              f"{resume['wall_seconds']:>8.1f} {resume['queue_seconds']:>9.1f} {resume['retries']:>8}")
+    total_cost = sum(resume['cost_usd'] for resume in resumes.values())
+    print(f'{len(resumes)} resumes, ${total_cost:.4f} in total')
+    return resumes
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Cost and latency of the calls to Claude, per ranked resume.')
+    parser.add_argument('resume_folder')
+    summary(f'./{parser.parse_args().resume_folder}/calls.jsonl')
@@ -0,0 +1,81 @@
+import json
+import os
+import anthropic
+import pytest
+from anthropic_stub import MessagesStub
+from batch_insertion import BatchInsertion
+from conftest import RANKED, UNRANKED, Interrupted, respond
+from rank_search import ConcurrentInsertion
+from resume_sorter import ResumeSorter
+
+class TestBatchInsertion:
+
+    @pytest.fixture(autouse=True)
+    def setup(self, resume_folder, monkeypatch):
+        self.resume_folder = resume_folder
+        monkeypatch.setattr(BatchInsertion, '_wait', lambda self: None)
+        with MessagesStub(respond) as self.stub:
+            yield
+
+    def sorter(self):
+        sorter = ResumeSorter(self.resume_folder)
+        sorter.resume_comparer.client = anthropic.Anthropic(base_url=self.stub.url, api_key='test', max_retries=0)
+        return sorter
+
+    def assert_ranked(self):
+        ranked = sorted(os.listdir(f'./{self.resume_folder}/ranked'))
+        assert ranked == [f'{rank:03}-{name}' for rank, name in enumerate(sorted(['c.png', 'm.png', 'x.png'] + UNRANKED))]
+        assert os.listdir(f'./{self.resume_folder}/unranked') == []
+
+    def test_offline_insert_all(self):
+        sorter = self.sorter()
+        sorter.insert_all(offline=True)
+        self.assert_ranked()
+
+        # Every comparison went through a batch, none through messages.create
+        batched = sum(len(batch['requests']) for batch in self.stub.batches.values())
+        assert batched == len(self.stub.requests)
+        assert batched == sum(sorter.resume_comparer.num_calls.values())
+        assert len(self.stub.batches) < batched
+        assert not os.path.exists(f'./{self.resume_folder}/batch_state.json')
+
+        with open(f'./{self.resume_folder}/usage.json', 'r') as file:
+            assert sum(json.load(file)['num_calls'].values()) == batched
+
+    def test_fresh_intake_takes_few_batches(self):
+        for filename in RANKED:
+            os.rename(f'./{self.resume_folder}/ranked/{filename}', f'./{self.resume_folder}/unranked/{filename[4:]}')
+
+        self.sorter().insert_all(offline=True)
+        self.assert_ranked()
+        # One batch per round of the network over all eight resumes, not one per comparison
+        assert len(self.stub.batches) == ConcurrentInsertion.estimate_rounds(8, 0) == 6
+        assert sum(len(batch['requests']) for batch in self.stub.batches.values()) > 2 * len(self.stub.batches)
+
+    def test_restart_collects_the_batch_in_flight(self, monkeypatch):
+        # Stop after the second batch is submitted, before it has ended
+        retrieve = BatchInsertion._collect
+
+        def interrupt_second_batch(batch_insertion, batch_id, pending):
+            if len(self.stub.batches) == 2:
+                raise Interrupted
+            return retrieve(batch_insertion, batch_id, pending)
+
+        monkeypatch.setattr(BatchInsertion, '_collect', interrupt_second_batch)
+        with pytest.raises(Interrupted):
+            self.sorter().insert_all(offline=True)
+
+        with open(f'./{self.resume_folder}/batch_state.json', 'r') as file:
+            assert json.load(file)['batch_id'] == 'msgbatch_stub_2'
+
+        monkeypatch.setattr(BatchInsertion, '_collect', retrieve)
+        self.sorter().insert_all(offline=True)
+        self.assert_ranked()
+
+        # No comparison was submitted twice
+        votes = [(request['params']['messages'][0]['content'][1]['source']['data'],
+                  request['params']['messages'][0]['content'][2]['text'],
+                  request['params']['messages'][0]['content'][3]['source']['data'],
+                  request['params']['model'])
+                 for batch in self.stub.batches.values() for request in batch['requests']]
+        assert len(votes) == len(set(votes))
@@ -0,0 +1,38 @@
+import pytest
+from benchmark import (SimulatedComparer, compare_results, kendall_tau, load_results, run_benchmark,
+                       run_suite, save_results)
+
+class TestBenchmark:
+
+    def test_kendall_tau(self):
+        assert kendall_tau([0, 1, 2, 3]) == 1.0
+        assert kendall_tau([3, 2, 1, 0]) == -1.0
+        # One of the six pairs is out of order
+        assert kendall_tau([1, 0, 2, 3]) == pytest.approx(1 - 2 / 6)
+
+    def test_error_rate(self):
+        resume_comparer = SimulatedComparer({f'{rank}.png': rank for rank in range(100)})
+        assert resume_comparer.error_rate('0.png', '1.png', 'haiku') > resume_comparer.error_rate('0.png', '1.png', 'sonnet')
+        assert resume_comparer.error_rate('0.png', '1.png', 'sonnet') > resume_comparer.error_rate('0.png', '50.png', 'sonnet')
+
+    @pytest.mark.parametrize('strategy', ['walk', 'binary'])
+    def test_noiseless_comparer_sorts_exactly(self, strategy):
+        result = run_benchmark(strategy, 30, error_scales={'sonnet': 0, 'haiku': 0})
+        assert result['kendall_tau'] == 1.0
+        assert result['calls'] == sum(result['calls_by_model'].values()) > 0
+        assert result['cost_usd'] > 0 and result['simulated_seconds'] > 0
+
+    def test_position_bias_hurts(self):
+        unbiased = run_benchmark('binary', 50)
+        biased = run_benchmark('binary', 50, position_bias=0.4)
+        assert biased['kendall_tau'] < unbiased['kendall_tau']
+
+    def test_regressions(self, tmp_path, capsys):
+        baseline = run_suite(sizes=(20,))
+        save_results(baseline, f'{tmp_path}/results.json')
+        assert compare_results(load_results(f'{tmp_path}/results.json'), run_suite(sizes=(20,))) == []
+
+        worse = [{**result, 'calls_per_insert': result['calls_per_insert'] * 2} for result in baseline]
+        regressions = compare_results(baseline, worse)
+        assert [metric for _, metric, _, _ in regressions] == ['calls_per_insert', 'calls_per_insert']
+        assert 'REGRESSION walk n=20' in capsys.readouterr().out
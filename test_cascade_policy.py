@@ -0,0 +1,159 @@
+import os
+import anthropic
+import pytest
+from anthropic_stub import MessagesStub
+from cascade_policy import CascadePolicy, Option, expected_votes, majority_accuracy
+from comparison_store import ComparisonStore
+from conftest import RANKED, UNRANKED, respond
+from rank_search import BinaryInsertionSearch
+from resume_sorter import ResumeSorter
+from test_rank_search import run_search
+
+def history(num_ranked, near_agreement):
+    """
+    Verdicts between ranked resumes `h0`, `h1`, ... (better first): Sonnet always
+    gets them right; Haiku always does for pairs 4 or more apart, and for closer
+    pairs only `near_agreement` of the time.
+    """
+    verdicts = []
+    for a in range(num_ranked):
+        for b in range(a + 1, num_ranked):
+            verdicts.append((f'h{a}', f'h{b}', 'sonnet', 0, 'Resume A'))
+            for sample in range(10):
+                haiku_right = b - a >= 4 or sample < 10 * near_agreement
+                verdicts.append((f'h{a}', f'h{b}', 'haiku', sample, 'Resume A' if haiku_right else 'Resume B'))
+    return verdicts, {f'h{rank}': rank for rank in range(num_ranked)}
+
+class TestCascadePolicy:
+
+    def test_expected_votes(self):
+        assert expected_votes(1.0, 1) == 1
+        # Two votes that agree, a third only when they don't
+        assert expected_votes(1.0, 3) == 2
+        assert expected_votes(0.5, 3) == pytest.approx(2.5)
+
+    def test_majority_accuracy(self):
+        assert majority_accuracy(0.8, 1) == pytest.approx(0.8)
+        assert majority_accuracy(0.8, 3) == pytest.approx(0.896)
+
+    def test_fit_buckets_agreement_by_distance(self):
+        policy = CascadePolicy(agreement_prior=(0, 1)).fit(*history(12, near_agreement=0.5))
+        assert policy.haiku_agreement(1) == pytest.approx(0.5, abs=0.01)
+        assert policy.haiku_agreement(8) == pytest.approx(1.0, abs=0.01)
+
+    def test_cheap_far_apart_expensive_near_the_boundary(self):
+        policy = CascadePolicy().fit(*history(12, near_agreement=0.5))
+        assert policy.choose(8) == Option('haiku', 1)
+        assert policy.choose(1) == Option('sonnet', 1)
+
+    def test_without_history_sonnet_is_used(self):
+        assert CascadePolicy().choose(100).model == 'sonnet'
+
+    def test_unranked_and_split_pairs_are_ignored(self):
+        verdicts = [('h0', 'x', 'sonnet', 0, 'Resume A'), ('h0', 'x', 'haiku', 0, 'Resume B'),
+                    ('h0', 'h1', 'sonnet', 0, 'Resume A'), ('h0', 'h1', 'sonnet', 1, 'Resume B'),
+                    ('h0', 'h1', 'haiku', 0, 'Resume B')]
+        policy = CascadePolicy().fit(verdicts, {'h0': 0, 'h1': 1})
+        assert policy.agreement == {}
+
+    def test_audits_correct_for_flip_only_confirmations(self):
+        # Haiku is right 80% of the time; Sonnet only sees its wrong votes and a tenth of the rest
+        verdicts, audits = [], {}
+        for pair in range(1000):
+            a_hash, b_hash = f'a{pair}', f'b{pair}'
+            haiku_right = pair % 10 < 8
+            verdicts.append((a_hash, b_hash, 'haiku', 0, 'Resume A' if haiku_right else 'Resume B'))
+            if not haiku_right or pair % 100 < 10:
+                verdicts.append((a_hash, b_hash, 'sonnet', 0, 'Resume A'))
+                if haiku_right:
+                    audits[(a_hash, b_hash)] = 0.1
+        ranks = {f'{side}{pair}': 2 * pair + (side == 'b') for pair in range(1000) for side in 'ab'}
+
+        biased = CascadePolicy(agreement_prior=(0, 0)).fit(verdicts, ranks)
+        assert biased.haiku_agreement(1) == pytest.approx(80 / 280)
+        corrected = CascadePolicy(agreement_prior=(0, 0)).fit(verdicts, ranks, audits)
+        assert corrected.haiku_agreement(1) == pytest.approx(0.8)
+
+    def test_only_haiku_steps_are_audited(self):
+        policy = CascadePolicy(audit_rate=1.0)
+        assert not policy.audit(Option('sonnet', 1))
+        assert policy.audit(Option('haiku', 1))
+        assert policy.num_audits == 1 and policy.projected_cost == policy.costs['sonnet']
+        assert not CascadePolicy(audit_rate=0.0).audit(Option('haiku', 1))
+
+    def test_report(self):
+        policy = CascadePolicy().fit(*history(12, near_agreement=0.5))
+        policy.choose(8)
+        policy.choose(1)
+        policy.record({'haiku': 1, 'sonnet': 2})
+
+        report = policy.report()
+        assert report['projected_cost'] == pytest.approx(13)
+        assert report['actual_cost'] == 25
+        assert report['decisions'] == {'haiku best of 1': 1, 'sonnet best of 1': 1}
+
+    def test_binary_search_with_policy(self):
+        policy = CascadePolicy().fit(*history(12, near_agreement=0.5))
+        for true_rank in range(101):
+            search = BinaryInsertionSearch(100, policy=policy)
+            assert run_search(search, true_rank) == true_rank
+            models = [step.model for step, _ in search.history]
+            assert models[0] == 'haiku' and models[-1] == 'sonnet'
+
+class TestCascadeSorter:
+
+    @pytest.fixture(autouse=True)
+    def setup(self, resume_folder):
+        self.resume_folder = resume_folder
+        with MessagesStub(respond) as self.stub:
+            yield
+
+    @pytest.mark.parametrize('strategy', ['walk', 'binary'])
+    def test_insert_all_with_cascade(self, strategy):
+        sorter = ResumeSorter(self.resume_folder, strategy=strategy, cascade=True)
+        sorter.resume_comparer.comparison_store = ComparisonStore(':memory:')
+        sorter.resume_comparer.client = anthropic.Anthropic(base_url=self.stub.url, api_key='test', max_retries=0)
+        sorter.insert_all()
+
+        ranked = sorted(os.listdir(f'./{self.resume_folder}/ranked'))
+        names = sorted([filename[4:] for filename in RANKED] + UNRANKED)
+        assert ranked == [f'{rank:03}-{name}' for rank, name in enumerate(names)]
+
+        policy = sorter.cascade_policy
+        assert sum(policy.calls.values()) == len(self.stub.requests)
+        assert policy.projected_cost > 0
+
+    def test_walk_confirms_with_sonnet(self):
+        sorter = ResumeSorter(self.resume_folder, strategy='walk')
+        sorter.resume_comparer.comparison_store = ComparisonStore(':memory:')
+        sorter.resume_comparer.client = anthropic.Anthropic(base_url=self.stub.url, api_key='test', max_retries=0)
+        # The policy picks Haiku for every step, so only confirmations can be Sonnet
+        policy = sorter.cascade_policy = CascadePolicy(target_accuracy=0.5, audit_rate=0.0)
+        assert policy.choose(1) == Option('haiku', 1)
+        sorter.insert_all()
+
+        sonnet = [request for request in self.stub.requests if 'sonnet' in request['model']]
+        assert len(sonnet) == policy.calls['sonnet'] > 0
+        ranked = sorted(os.listdir(f'./{self.resume_folder}/ranked'))
+        assert [filename[4:] for filename in ranked] == sorted([filename[4:] for filename in RANKED] + UNRANKED)
+
+    def test_walk_distance(self):
+        sorter = ResumeSorter(self.resume_folder, strategy='walk')
+        sorter.num_ranked_resumes, sorter.current_rank = 100, 40
+        # The whole list, then the 41 ranks above or the 61 below the current one
+        assert [sorter._walk_distance(up) for up in (None, True, False)] == [25, 10, 15]
+
+    def test_walk_audits_haiku_steps(self):
+        sorter = ResumeSorter(self.resume_folder, strategy='walk')
+        sorter.resume_comparer.comparison_store = store = ComparisonStore(':memory:')
+        sorter.resume_comparer.client = anthropic.Anthropic(base_url=self.stub.url, api_key='test', max_retries=0)
+        # Haiku is trusted everywhere, and every step that keeps going is audited
+        policy = sorter.cascade_policy = CascadePolicy(target_accuracy=0.5, audit_rate=1.0)
+        sorter.insert_all()
+
+        assert policy.num_audits > 0
+        audits = store.audits(sorter.resume_comparer.prompt_hash)
+        assert len(audits) == policy.num_audits and set(audits.values()) == {1.0}
+        sonnet_pairs = {tuple(sorted((a_hash, b_hash)))
+                        for a_hash, b_hash, model, _, _ in store.verdicts(sorter.resume_comparer.prompt_hash) if model == 'sonnet'}
+        assert set(audits) <= sonnet_pairs
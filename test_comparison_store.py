@@ -0,0 +1,58 @@
+import json
+import pytest
+from comparison_store import ComparisonStore
+
+@pytest.fixture
+def store(tmp_path):
+    return ComparisonStore(str(tmp_path / 'comparisons.sqlite'), max_entries=3,
+                           stats_path=str(tmp_path / 'cache_stats.json'))
+
+class TestComparisonStore:
+
+    def test_get_put(self, store):
+        assert store.get('a', 'b', 'haiku', 'p') is None
+        store.put('a', 'b', 'haiku', 'p', 0, 'Resume A', 'I prefer Resume A')
+        assert store.get('a', 'b', 'haiku', 'p') == {'winner': 'Resume A', 'claude_response': 'I prefer Resume A'}
+
+    def test_key_includes_order_model_prompt_and_sample(self, store):
+        store.put('a', 'b', 'haiku', 'p', 0, 'Resume A', '')
+        assert store.get('b', 'a', 'haiku', 'p') is None
+        assert store.get('a', 'b', 'sonnet', 'p') is None
+        assert store.get('a', 'b', 'haiku', 'q') is None
+        assert store.get('a', 'b', 'haiku', 'p', sample=1) is None
+
+    def test_get_first_counts_one_lookup(self, store):
+        store.put('b', 'a', 'haiku', 'p', 0, 'Resume B', '')
+        key, comparison = store.get_first([('a', 'b', 'haiku', 'p', 0), ('b', 'a', 'haiku', 'p', 0)])
+        assert key == ('b', 'a', 'haiku', 'p', 0) and comparison['winner'] == 'Resume B'
+        store.get_first([('x', 'y', 'haiku', 'p', 0), ('y', 'x', 'haiku', 'p', 0)])
+        assert store.stats == {'hits': 1, 'misses': 1, 'evictions': 0}
+
+    def test_evicts_least_recently_used(self, store):
+        for sample in range(3):
+            store.put('a', 'b', 'haiku', 'p', sample, 'Resume A', '')
+        store.get('a', 'b', 'haiku', 'p', sample=0)
+        store.put('a', 'b', 'haiku', 'p', 3, 'Resume A', '')
+
+        assert store.num_entries == 3
+        assert store.get('a', 'b', 'haiku', 'p', sample=0) is not None
+        assert store.get('a', 'b', 'haiku', 'p', sample=1) is None
+
+    def test_persists(self, store):
+        store.put('a', 'b', 'haiku', 'p', 0, 'Resume A', '')
+        store.close()
+        assert ComparisonStore(store.path).get('a', 'b', 'haiku', 'p') is not None
+
+    def test_save_stats_accumulates(self, store):
+        store.get('a', 'b', 'haiku', 'p')
+        store.save_stats()
+        store.put('a', 'b', 'haiku', 'p', 0, 'Resume A', '')
+        store.get('a', 'b', 'haiku', 'p')
+        store.save_stats()
+
+        with open(store.stats_path) as file:
+            stats = json.load(file)
+        assert stats['hits'] == 1 and stats['misses'] == 1 and stats['hit_rate'] == 0.5
+
+if __name__ == "__main__":
+    pytest.main(["-s", __file__])
@@ -0,0 +1,54 @@
+import io
+import os
+import pytest
+from image_normalizer import ImageNormalizer
+
+Image = pytest.importorskip('PIL.Image')
+
+def make_png(width, height):
+    image = Image.new('RGB', (width, height), 'white')
+    for x in range(0, width, 40):
+        for y in range(0, height, 40):
+            image.putpixel((x, y), (200, 30, 30))
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+class TestImageNormalizer:
+
+    def test_downscales_to_token_budget(self, tmp_path):
+        normalizer = ImageNormalizer(str(tmp_path), max_tokens=1600)
+        normalized = normalizer.normalize(make_png(3840, 2160))
+
+        with Image.open(io.BytesIO(normalized.data)) as image:
+            assert ImageNormalizer.estimate_tokens(*image.size) <= 1600
+            assert max(image.size) <= 1568
+            assert image.mode == 'L'
+        assert normalized.tokens < normalized.original_tokens
+        assert len(normalized.data) < normalized.original_size
+
+    def test_small_images_keep_their_size(self, tmp_path):
+        normalized = ImageNormalizer(str(tmp_path)).normalize(make_png(400, 600))
+        with Image.open(io.BytesIO(normalized.data)) as image:
+            assert image.size == (400, 600)
+
+    def test_result_is_cached_by_content(self, tmp_path):
+        normalizer = ImageNormalizer(str(tmp_path))
+        data = make_png(2000, 3000)
+        first = normalizer.normalize(data)
+        assert len(os.listdir(tmp_path)) == 1
+
+        second = normalizer.normalize(data)
+        assert second == first
+        assert len(os.listdir(tmp_path)) == 1
+
+        # Other settings, other cache entry
+        ImageNormalizer(str(tmp_path), max_tokens=800).normalize(data)
+        assert len(os.listdir(tmp_path)) == 2
+
+    def test_unreadable_data_is_passed_through(self, tmp_path):
+        normalized = ImageNormalizer(str(tmp_path)).normalize(b'%PDF-1.4 not an image')
+        assert normalized.data == b'%PDF-1.4 not an image' and normalized.media_type is None
+
+if __name__ == "__main__":
+    pytest.main(["-s", __file__])
@@ -0,0 +1,90 @@
+import json
+import os
+import shutil
+import pytest
+from anthropic_stub import MessagesStub
+from conftest import RANKED, Interrupted, respond
+from insert_journal import InsertJournal
+from resume_sorter import ResumeSorter
+
+def log(resume_folder, *operations):
+    with open(f'./{resume_folder}/insert.journal', 'a') as file:
+        for operation in operations:
+            file.write(json.dumps(operation) + '\n')
+
+class TestInsertJournal:
+
+    def test_half_done_renames_are_finished(self, resume_folder):
+        # Crashed after the first of three renames
+        os.rename(f'./{resume_folder}/ranked/002-x.png', f'./{resume_folder}/ranked/003-x.png')
+        log(resume_folder, {'op': 'start', 'filename': 'd.png', 'num_ranked': 3},
+            {'op': 'renames', 'moves': [['ranked/002-x.png', 'ranked/003-x.png'], ['ranked/001-m.png', 'ranked/002-m.png'],
+                                        ['unranked/d.png', 'ranked/001-d.png']]})
+
+        journal = InsertJournal.open(resume_folder)
+
+        assert sorted(os.listdir(f'./{resume_folder}/ranked')) == ['000-c.png', '001-d.png', '002-m.png', '003-x.png']
+        # The insert was finished, so there is nothing to replay
+        assert journal.pending is None
+        assert not os.path.exists(f'./{resume_folder}/insert.journal')
+
+    def test_cut_off_line_is_ignored(self, resume_folder):
+        log(resume_folder, {'op': 'start', 'filename': 'd.png', 'num_ranked': 3})
+        with open(f'./{resume_folder}/insert.journal', 'a') as file:
+            file.write('{"op": "verdict", "oppo')
+
+        journal = InsertJournal.open(resume_folder)
+        assert journal.pending == {'filename': 'd.png', 'num_ranked': 3, 'verdicts': []}
+
+    def test_replay_stops_where_the_search_diverges(self, resume_folder):
+        comparison = {'winner': 'Resume A', 'to_be_ranked_resume': 'Resume A'}
+        log(resume_folder, {'op': 'start', 'filename': 'd.png', 'num_ranked': 3},
+            {'op': 'verdict', 'opponent': '001-m.png', 'model': 'sonnet', 'n': 3, 'comparison': comparison},
+            {'op': 'verdict', 'opponent': '000-c.png', 'model': 'haiku', 'n': 1, 'comparison': comparison})
+
+        journal = InsertJournal.open(resume_folder)
+        journal.start('d.png', 3)
+        assert journal.replayed('001-m.png', 'sonnet', 3) == comparison
+        assert journal.replayed('002-x.png', 'haiku', 1) is None
+        assert len(InsertJournal.open(resume_folder).pending['verdicts']) == 1
+
+class TestSorterRecovery:
+
+    @pytest.fixture(autouse=True)
+    def setup(self, resume_folder, monkeypatch):
+        self.resume_folder = resume_folder
+        with MessagesStub(respond) as self.stub:
+            monkeypatch.setenv('ANTHROPIC_BASE_URL', self.stub.url)
+            yield
+
+    def sorter(self, resume_folder, strategy):
+        sorter = ResumeSorter(resume_folder, strategy=strategy)
+        # Only the journal may save a call
+        sorter.resume_comparer.comparison_store = None
+        return sorter
+
+    @pytest.mark.parametrize('strategy', ['walk', 'binary'])
+    def test_no_comparison_is_paid_twice(self, strategy):
+        shutil.copytree(self.resume_folder, 'reference')
+        self.sorter('reference', strategy).insert('n.png')
+        calls_uninterrupted = len(self.stub.requests)
+        self.stub.requests.clear()
+
+        sorter = self.sorter(self.resume_folder, strategy)
+        best_of_n = sorter.resume_comparer.best_of_n
+
+        def crash_on_second_call(*args):
+            if sorter.comparisons:
+                raise Interrupted()
+            return best_of_n(*args)
+        sorter.resume_comparer.best_of_n = sorter.resume_comparer.main = crash_on_second_call
+        with pytest.raises(Interrupted):
+            sorter.insert('n.png')
+
+        restarted = self.sorter(self.resume_folder, strategy)
+        assert restarted.journal.pending['filename'] == 'n.png'
+        restarted.insert('n.png')
+
+        assert len(self.stub.requests) == calls_uninterrupted
+        assert sorted(os.listdir(f'./{self.resume_folder}/ranked')) == sorted(os.listdir('./reference/ranked'))
+        assert not os.path.exists(f'./{self.resume_folder}/insert.journal')
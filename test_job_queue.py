@@ -0,0 +1,120 @@
+import glob
+import os
+import subprocess
+import sys
+import pytest
+from anthropic_stub import MessagesStub
+from conftest import UNRANKED, respond
+from job_queue import JobQueue, Worker
+from resume_sorter import ResumeSorter
+
+JOB_QUEUE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'job_queue.py')
+
+def job(opponent='000-c.png', model='sonnet'):
+    return {'key': 'a.png', 'to_be_ranked': 'a.png', 'opponent': opponent, 'opponent_is_ranked': True,
+            'model': model, 'n': 3, 'to_be_ranked_hash': 'aaa', 'opponent_hash': f'hash of {opponent}'}
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class TestJobQueue:
+
+    @pytest.fixture(autouse=True)
+    def setup(self, tmp_path):
+        self.clock = FakeClock()
+        self.queue = JobQueue(f'{tmp_path}/jobs.sqlite', lease_seconds=60, max_attempts=2, clock=self.clock)
+
+    def test_put_is_idempotent(self):
+        job_id = self.queue.put(job())
+        assert self.queue.put(job()) == job_id
+        assert self.queue.put(job(model='haiku')) != job_id
+        assert self.queue.counts() == {'pending': 2}
+
+    def test_lease_and_complete(self):
+        job_id = self.queue.put(job())
+        assert self.queue.lease('w1') == (job_id, job())
+        # Leased jobs are not handed out twice
+        assert self.queue.lease('w2') is None
+        assert self.queue.results([job_id]) == {}
+
+        assert self.queue.complete(job_id, {'comparison': 'verdict'})
+        assert self.queue.results([job_id]) == {job_id: {'comparison': 'verdict'}}
+
+    def test_dead_worker_loses_its_lease(self):
+        job_id = self.queue.put(job())
+        self.queue.lease('dead')
+        self.clock.now += 61
+        assert self.queue.lease('w2') == (job_id, job())
+
+        assert self.queue.complete(job_id, {'by': 'w2'})
+        # The first worker comes back late: its result is not taken
+        assert not self.queue.complete(job_id, {'by': 'dead'})
+        assert self.queue.results([job_id]) == {job_id: {'by': 'w2'}}
+
+    def test_failed_job(self):
+        job_id = self.queue.put(job())
+        self.queue.lease('w1')
+        self.queue.fail(job_id, 'overloaded')
+        assert self.queue.lease('w1')[0] == job_id
+        self.queue.fail(job_id, 'overloaded')
+
+        assert self.queue.lease('w1') is None
+        with pytest.raises(RuntimeError, match='overloaded'):
+            self.queue.results([job_id])
+
+    def test_finish(self):
+        assert self.queue.is_open()
+        self.queue.put(job())
+        self.queue.finish()
+        assert not self.queue.is_open() and self.queue.counts() == {}
+
+class TestDistributedInsertion:
+
+    @pytest.fixture(autouse=True)
+    def setup(self, resume_folder, monkeypatch):
+        self.resume_folder = resume_folder
+        with MessagesStub(respond) as self.stub:
+            monkeypatch.setenv('ANTHROPIC_BASE_URL', self.stub.url)
+            yield
+
+    def test_worker_processes(self):
+        queue = JobQueue.for_folder(self.resume_folder)
+        queue.open()
+        workers = [subprocess.Popen([sys.executable, JOB_QUEUE, 'worker', self.resume_folder,
+                                     '--worker-id', f'worker-{i}', '--idle-timeout', '60'],
+                                    env={**os.environ, 'ANTHROPIC_API_KEY': 'test'},
+                                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+                   for i in range(3)]
+        try:
+            sorter = ResumeSorter(self.resume_folder)
+            sorter.insert_all(distributed=True)
+        finally:
+            outputs = [worker.communicate(timeout=60)[0] for worker in workers]
+
+        assert [worker.returncode for worker in workers] == [0, 0, 0], outputs
+        ranked = sorted(os.listdir(f'./{self.resume_folder}/ranked'))
+        assert ranked == [f'{rank:03}-{name}' for rank, name in enumerate(sorted(['c.png', 'm.png', 'x.png'] + UNRANKED))]
+        # Every call was made by a worker
+        assert sum(sorter.resume_comparer.num_calls.values()) == 0
+        assert sum(sum(calls.values()) for calls in sorter.calls_per_insert.values()) == len(self.stub.requests)
+        # Each worker counted its own calls, in its own metrics file
+        worker_calls = 0
+        for path in glob.glob(f'./{self.resume_folder}/metrics-worker-*.prom'):
+            with open(path, 'r') as file:
+                worker_calls += sum(int(line.split()[-1]) for line in file if line.startswith('resume_sorter_calls_total'))
+        assert worker_calls == len(self.stub.requests)
+        assert not queue.is_open()
+
+    def test_changed_file_fails_the_job(self):
+        queue = JobQueue.for_folder(self.resume_folder, max_attempts=1)
+        job_id = queue.put({**job(), 'to_be_ranked_hash': 'not the hash of a.png'})
+
+        Worker(self.resume_folder, queue).run(max_jobs=1)
+
+        with pytest.raises(RuntimeError, match='not the file the coordinator saw'):
+            queue.results([job_id])
+        assert self.stub.requests == []
@@ -0,0 +1,98 @@
+import base64
+import os
+import anthropic
+import pytest
+from anthropic_stub import MessagesStub
+from benchmark import run_benchmark
+from comparison_store import ComparisonStore
+from conftest import UNRANKED
+from listwise_comparer import ListwiseComparer
+from rating_engine import RatingEngine
+from resume_comparer import LLMResumeComparer
+from resume_sorter import ResumeSorter
+
+def respond_listwise(request):
+    """Ranks the labels by the names in their (fake) images, alphabetically smaller first."""
+    content = request['messages'][0]['content']
+    labels = [block['text'].rstrip(':') for block in content[1::2]]
+    names = [base64.b64decode(block['source']['data']) for block in content[2::2]]
+    return {'type': 'tool_use', 'id': 'toolu_stub', 'name': 'record_ranking',
+            'input': {'ranking': [label for _, label in sorted(zip(names, labels))]}}
+
+class TestParseRanking:
+
+    def test_labels(self):
+        assert ListwiseComparer.parse_ranking(['Resume 2', 'resume 3', '1'], 3) == [1, 2, 0]
+
+    def test_incomplete_or_repeated(self):
+        assert ListwiseComparer.parse_ranking(['Resume 2', 'Resume 1'], 3) is None
+        assert ListwiseComparer.parse_ranking(['Resume 2', 'Resume 2', 'Resume 1'], 3) is None
+        assert ListwiseComparer.parse_ranking(['Resume 4', 'Resume 2', 'Resume 1'], 3) is None
+        assert ListwiseComparer.parse_ranking('Resume 1, Resume 2', 2) is None
+
+    def test_pairwise(self):
+        assert ListwiseComparer.pairwise(['b', 'a', 'c']) == [('b', 'a'), ('b', 'c'), ('a', 'c')]
+
+class TestListwise:
+
+    @pytest.fixture(autouse=True)
+    def setup(self, resume_folder, monkeypatch):
+        self.resume_folder = resume_folder
+        with MessagesStub(respond_listwise) as self.stub:
+            monkeypatch.setenv('ANTHROPIC_BASE_URL', self.stub.url)
+            yield
+
+    def comparer(self, store):
+        resume_comparer = LLMResumeComparer(self.resume_folder, comparison_store=store)
+        resume_comparer.client = anthropic.Anthropic(base_url=self.stub.url, api_key='test', max_retries=0)
+        return resume_comparer
+
+    def test_listwise_all(self):
+        report = ResumeSorter(self.resume_folder).listwise_all(k=4)
+
+        names = sorted(['c.png', 'm.png', 'x.png'] + UNRANKED)
+        assert sorted(os.listdir(f'./{self.resume_folder}/ranked')) == [f'{rank:03}-{name}' for rank, name in enumerate(names)]
+        assert os.listdir(f'./{self.resume_folder}/unranked') == []
+        # Two groups of four per round, three when the groups are shifted by two
+        assert report['calls'] == len(self.stub.requests) <= 2 * report['rounds'] + report['rounds'] // 2 + 1
+        assert report['calls'] < report['insert_all_calls']
+        assert all(request['tools'][0]['name'] == 'record_ranking' for request in self.stub.requests)
+
+    def test_groups_are_shuffled(self):
+        store = ComparisonStore(':memory:')
+        listwise = ListwiseComparer(self.comparer(store), k=8, seed=0)
+        images = [{'filename': name, **listwise.resume_comparer.get_image(False, name)} for name in sorted(UNRANKED)]
+        for _ in range(5):
+            assert listwise.rank_groups([images]) == [list(range(len(images)))]
+
+        first_shown = {base64.b64decode(request['messages'][0]['content'][2]['source']['data']) for request in self.stub.requests}
+        assert len(first_shown) > 1
+
+    def test_verdicts_feed_a_rating_engine(self):
+        store = ComparisonStore(':memory:')
+        listwise = ListwiseComparer(self.comparer(store), k=5)
+        items = [(name, False) for name in UNRANKED]
+        images = [{'filename': name, **listwise.resume_comparer.get_image(False, name)} for name in UNRANKED]
+        listwise.rank_groups([images])
+        assert len(store.verdicts(listwise.prompt_hash)) == 10
+        assert store.verdicts(listwise.resume_comparer.prompt_hash) == []
+
+        # A new engine fits the stored verdicts without asking Claude again
+        engine = RatingEngine(self.comparer(store), items, listwise=ListwiseComparer(self.comparer(store), k=5))
+        engine.fit()
+        assert engine.order() == [(name, False) for name in sorted(UNRANKED)]
+        assert len(self.stub.requests) == 1
+
+    def test_unreadable_ranking_is_asked_again(self):
+        self.stub.respond = lambda request: {'type': 'tool_use', 'id': 'toolu_stub', 'name': 'record_ranking',
+                                             'input': {'ranking': ['Resume 1']}}
+        listwise = ListwiseComparer(self.comparer(ComparisonStore(':memory:')), k=3, max_attempts=2)
+        images = [{'filename': name, **listwise.resume_comparer.get_image(False, name)} for name in UNRANKED[:3]]
+        assert listwise.rank_groups([images, images[:1]]) == [None, [0]]
+        assert listwise.num_calls == listwise.num_unreadable == len(self.stub.requests) == 2
+
+def test_benchmark_listwise_needs_fewer_calls():
+    listwise = run_benchmark('listwise', 60)
+    binary = run_benchmark('binary', 60)
+    assert listwise['calls'] * 3 < binary['calls']
+    assert listwise['kendall_tau'] > 0.9
@@ -0,0 +1,66 @@
+import os
+import pytest
+from payload_cache import PayloadCache
+
+class CountingLoader:
+    def __init__(self, path):
+        self.path = path
+        self.loads = 0
+
+    def __call__(self):
+        self.loads += 1
+        with open(self.path, 'rb') as file:
+            data = file.read()
+        return {'data': data.hex(), 'hash': data.hex()}
+
+@pytest.fixture
+def resume(tmp_path):
+    os.makedirs(tmp_path / 'unranked')
+    os.makedirs(tmp_path / 'ranked')
+    path = tmp_path / 'unranked' / 'cv.png'
+    path.write_bytes(b'resume')
+    return path
+
+class TestPayloadCache:
+
+    def test_second_get_is_a_hit(self, resume):
+        cache, loader = PayloadCache(), CountingLoader(resume)
+        assert cache.get(resume, loader) == cache.get(resume, loader)
+        assert loader.loads == 1
+        assert cache.stats()['hit_rate'] == 0.5
+
+    def test_survives_rename(self, resume, tmp_path):
+        cache = PayloadCache()
+        cache.get(resume, CountingLoader(resume))
+
+        new_path = tmp_path / 'ranked' / '000-cv.png'
+        os.rename(resume, new_path)
+        loader = CountingLoader(new_path)
+        cache.get(new_path, loader)
+        assert loader.loads == 0
+
+    def test_invalidated_when_file_changes(self, resume):
+        cache, loader = PayloadCache(), CountingLoader(resume)
+        first = cache.get(resume, loader)
+
+        resume.write_bytes(b'a better resume')
+        second = cache.get(resume, loader)
+        assert loader.loads == 2 and first != second
+        assert cache.stats()['invalidations'] == 1
+
+    def test_evicts_least_recently_used(self, tmp_path):
+        cache = PayloadCache(max_bytes=20)
+        paths = []
+        for i in range(3):
+            path = tmp_path / f'{i}.png'
+            path.write_bytes(bytes([i]) * 4) # 8 hex characters each
+            paths.append(path)
+            cache.get(path, CountingLoader(path))
+
+        assert cache.stats()['entries'] == 2 and cache.num_bytes == 16
+        loader = CountingLoader(paths[0])
+        cache.get(paths[0], loader)
+        assert loader.loads == 1
+
+if __name__ == "__main__":
+    pytest.main(["-s", __file__])
@@ -0,0 +1,78 @@
+import base64
+import shutil
+import os
+import pytest
+from anthropic_stub import MessagesStub
+from conftest import RANKED, UNRANKED, respond
+from pointwise_scorer import PointwiseScorer
+from resume_sorter import ResumeSorter
+
+def score_or_compare(request):
+    """Scores go down the alphabet, like the pairwise verdicts of `respond`."""
+    if request.get('tools', [{}])[0].get('name') != 'record_score':
+        return respond(request)
+    image = next(block for block in request['messages'][0]['content'] if block['type'] == 'image')
+    name = base64.b64decode(image['source']['data']).decode('utf-8')
+    return {'type': 'tool_use', 'id': 'toolu_stub', 'name': 'record_score',
+            'input': {'score': 100 - 3 * (ord(name[0]) - ord('a'))}}
+
+def pairwise(requests):
+    return [request for request in requests if 'tools' not in request]
+
+class TestWindow:
+
+    def test_close_scores(self):
+        # Ranked resumes scored 90, 80, 60, 58, 40: a 61 sits around ranks 2 and 3
+        assert PointwiseScorer.window(61, [90, 80, 60, 58, 40]) == (3, 2, 4)
+
+    def test_between_scores(self):
+        assert PointwiseScorer.window(70, [90, 80, 60, 40], tolerance=2) == (2, 2, 2)
+        assert PointwiseScorer.window(99, [90, 80, 60, 40], tolerance=2) == (0, 0, 0)
+        assert PointwiseScorer.window(1, [90, 80, None, 40], tolerance=2) == (4, 4, 4)
+
+    def test_nothing_scored(self):
+        assert PointwiseScorer.window(50, [None, None]) is None
+
+class TestPrescore:
+
+    @pytest.fixture(autouse=True)
+    def setup(self, resume_folder, monkeypatch):
+        self.resume_folder = resume_folder
+        with MessagesStub(score_or_compare) as self.stub:
+            monkeypatch.setenv('ANTHROPIC_BASE_URL', self.stub.url)
+            yield
+
+    def test_scores_are_cached_by_content(self):
+        sorter = ResumeSorter(self.resume_folder)
+        scores = sorter.prescore_all()
+        assert scores['a.png'] == 100 and scores['x.png'] == 100 - 3 * 23
+        assert len(self.stub.requests) == len(RANKED) + len(UNRANKED)
+
+        # A new scorer reads scores.json; a renamed file keeps its score
+        os.rename(f'./{self.resume_folder}/unranked/a.png', f'./{self.resume_folder}/unranked/renamed.png')
+        assert ResumeSorter(self.resume_folder).prescore_all()['renamed.png'] == 100
+        assert len(self.stub.requests) == len(RANKED) + len(UNRANKED)
+
+    @pytest.mark.parametrize('strategy', ['walk', 'binary'])
+    def test_prior_saves_pairwise_calls(self, strategy):
+        shutil.copytree(self.resume_folder, 'reference')
+        ResumeSorter('reference', strategy=strategy).insert_all()
+        without_prior = len(pairwise(self.stub.requests))
+        self.stub.requests.clear()
+
+        sorter = ResumeSorter(self.resume_folder, strategy=strategy, prescore=True)
+        sorter.insert_all()
+
+        assert sorted(os.listdir(f'./{self.resume_folder}/ranked')) == sorted(os.listdir('./reference/ranked'))
+        assert len(pairwise(self.stub.requests)) < without_prior
+        report = sorter.prior_report()
+        assert report['scoring_calls'] == len(RANKED) + len(UNRANKED)
+        assert report['inserts'] == len(UNRANKED) and report['pairwise_calls_saved'] > 0
+
+    def test_unranked_name_that_looks_ranked(self):
+        # An unranked 2024-cv.png keeps its name: only ranked files lose their rank string
+        os.rename(f'./{self.resume_folder}/unranked/a.png', f'./{self.resume_folder}/unranked/2024-cv.png')
+        sorter = ResumeSorter(self.resume_folder)
+        assert sorter.prescore_all()['2024-cv.png'] == 100
+        sorter.to_be_ranked_filename = '2024-cv.png'
+        assert sorter._prior_window() is not None
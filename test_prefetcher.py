@@ -0,0 +1,71 @@
+import json
+import os
+import string
+import threading
+import time
+import pytest
+from anthropic_stub import MessagesStub
+from conftest import respond
+from resume_sorter import ResumeSorter
+
+# Ranked b.png to u.png, best first; c2.png belongs between c.png and d.png
+RANKED = list(string.ascii_lowercase[1:21])
+
+class TestPrefetcher:
+
+    @pytest.fixture(autouse=True)
+    def setup(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        for folder in ('ranked', 'unranked', 'storage'):
+            os.makedirs(f'walk_resumes/{folder}')
+        for rank, letter in enumerate(RANKED):
+            with open(f'walk_resumes/ranked/{rank:03}-{letter}.png', 'wb') as file:
+                file.write(f'{letter}.png'.encode('utf-8'))
+        with open('walk_resumes/unranked/c2.png', 'wb') as file:
+            file.write(b'c2.png')
+        with open('walk_resumes/usage.json', 'w') as file:
+            json.dump({'num_calls': {'haiku': 0, 'sonnet': 0}}, file)
+
+        # Haiku calls in flight at once
+        self.in_flight, self.most_in_flight, lock = 0, 0, threading.Lock()
+
+        def slow_respond(request):
+            if 'haiku' not in request['model']:
+                return respond(request)
+            with lock:
+                self.in_flight += 1
+                self.most_in_flight = max(self.most_in_flight, self.in_flight)
+            time.sleep(0.05)
+            with lock:
+                self.in_flight -= 1
+            return respond(request)
+
+        with MessagesStub(slow_respond) as self.stub:
+            monkeypatch.setenv('ANTHROPIC_BASE_URL', self.stub.url)
+            yield
+
+    def haiku_requests(self):
+        return [request for request in self.stub.requests if 'haiku' in request['model']]
+
+    def test_walk_prefetches(self):
+        sorter = ResumeSorter('walk_resumes', prefetch=3)
+        sorter.insert_all()
+
+        names = sorted([f'{letter}.png' for letter in RANKED] + ['c2.png'])
+        assert sorted(os.listdir('./walk_resumes/ranked')) == [f'{rank:03}-{name}' for rank, name in enumerate(names)]
+
+        # The walk goes from rank 8 (j.png) up to rank 1 (c.png), one Haiku vote per step,
+        # and every step's vote was already on its way; the one for rank 0 was not needed
+        stats = sorter.prefetcher.stats
+        assert stats['used'] == 8
+        assert stats['wasted'] + stats['cancelled'] == 1
+        assert stats['sent'] == stats['used'] + stats['wasted'] == len(self.haiku_requests())
+        assert sorter.resume_comparer.num_calls['haiku'] == stats['sent']
+        assert self.most_in_flight > 1
+
+    def test_without_prefetch(self):
+        sorter = ResumeSorter('walk_resumes')
+        sorter.insert_all()
+        assert sorter.prefetcher is None
+        assert len(self.haiku_requests()) == 8
+        assert self.most_in_flight == 1
@@ -0,0 +1,121 @@
+import json
+import os
+import random
+import pytest
+from rank_index import RankedList, RankIndex
+
+@pytest.fixture
+def resume_folder(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for folder in ('ranked', 'unranked'):
+        os.makedirs(tmp_path / 'resumes' / folder)
+    return 'resumes'
+
+def touch(path):
+    with open(path, 'w') as file:
+        file.write(path)
+
+class TestRankedList:
+
+    def test_matches_list(self):
+        rng = random.Random(0)
+        ranked_list, expected = RankedList(), []
+        for i in range(2000):
+            if expected and rng.random() < 0.3:
+                index = rng.randrange(len(expected))
+                assert ranked_list.pop(index) == expected.pop(index)
+            else:
+                index = rng.randint(0, len(expected))
+                ranked_list.insert(index, i)
+                expected.insert(index, i)
+        assert list(ranked_list) == expected
+        assert [ranked_list[i] for i in range(len(expected))] == expected
+        assert ranked_list[-1] == expected[-1]
+        assert [ranked_list.index(value) for value in expected] == list(range(len(expected)))
+
+    def test_index_errors(self):
+        with pytest.raises(IndexError):
+            RankedList([1, 2])[2]
+        with pytest.raises(IndexError):
+            RankedList().pop(0)
+        with pytest.raises(ValueError):
+            RankedList([1, 2]).index(3)
+
+class TestRankIndex:
+
+    def test_imports_prefixed_folder(self, resume_folder):
+        for filename in ['000-b.png', '002-a.png', '001-c-d.png']:
+            touch(f'{resume_folder}/ranked/{filename}')
+        index = RankIndex.open(resume_folder)
+        assert list(index) == ['000-b.png', '001-c-d.png', '002-a.png']
+        assert [index.name_at(rank) for rank in range(3)] == ['b.png', 'c-d.png', 'a.png']
+
+        with open(f'{resume_folder}/rankings.json') as file:
+            rankings = json.load(file)
+        assert rankings['c-d.png'] == {'rank': 1, 'comparisons': {}, 'path': '001-c-d.png'}
+
+    def test_journal_is_replayed(self, resume_folder):
+        index = RankIndex.open(resume_folder)
+        for rank, name in [(0, 'b.png'), (0, 'a.png'), (2, 'c.png')]:
+            touch(f'{resume_folder}/ranked/{name}')
+            index.insert(rank, name)
+        index.remove(1)
+        os.remove(f'{resume_folder}/ranked/b.png')
+
+        # No checkpoint: everything above only lives in the journal
+        assert list(RankIndex.open(resume_folder)) == ['a.png', 'c.png']
+
+    def test_torn_journal_line_is_ignored(self, resume_folder):
+        index = RankIndex.open(resume_folder)
+        touch(f'{resume_folder}/ranked/a.png')
+        index.insert(0, 'a.png')
+        with open(index.journal_path, 'a') as file:
+            file.write('{"op": "insert", "ra')
+        assert list(RankIndex.open(resume_folder)) == ['a.png']
+
+    def test_open_finishes_interrupted_move(self, resume_folder):
+        index = RankIndex.open(resume_folder)
+        touch(f'{resume_folder}/unranked/a.png')
+        index.insert(0, 'a.png')
+
+        assert list(RankIndex.open(resume_folder)) == ['a.png']
+        assert os.listdir(f'{resume_folder}/ranked') == ['a.png']
+
+    def test_export_any_width(self, resume_folder):
+        index = RankIndex.open(resume_folder)
+        for i in range(1001):
+            touch(f'{resume_folder}/ranked/{i}.png')
+            index.insert(0, f'{i}.png')
+        index.export()
+
+        ranked = sorted(os.listdir(f'{resume_folder}/ranked'))
+        assert ranked[0] == '0000-1000.png' and ranked[-1] == '1000-0.png'
+        assert list(RankIndex.open(resume_folder))[:2] == ['0000-1000.png', '0001-999.png']
+
+    def test_rank_of(self, resume_folder):
+        index = RankIndex.open(resume_folder)
+        for rank, name in [(0, 'b.png'), (0, 'a.png'), (2, 'd.png'), (2, 'c.png')]:
+            touch(f'{resume_folder}/ranked/{name}')
+            index.insert(rank, name)
+        index.remove(index.rank_of('b.png'))
+        os.remove(f'{resume_folder}/ranked/b.png')
+        assert [index.rank_of(path) for path in ['a.png', 'c.png', 'd.png']] == [0, 1, 2]
+
+        index.export()
+        assert index.rank_of('001-c.png') == 1
+        with pytest.raises(KeyError):
+            index.rank_of('c.png')
+        assert RankIndex.open(resume_folder).rank_of('002-d.png') == 2
+
+    def test_export_swaps_taken_names(self, resume_folder):
+        """Two resumes called '000-x.png' and 'x.png' swap places."""
+        index = RankIndex.open(resume_folder)
+        touch(f'{resume_folder}/ranked/x.png')
+        touch(f'{resume_folder}/ranked/000-x.png')
+        index.insert(0, 'x.png')
+        index.insert(1, '000-x.png', path='000-x.png')
+        index.export()
+        assert sorted(os.listdir(f'{resume_folder}/ranked')) == ['000-x.png', '001-000-x.png']
+
+if __name__ == "__main__":
+    pytest.main(["-s", __file__])
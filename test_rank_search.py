@@ -0,0 +1,133 @@
+import random
+import pytest
+from rank_search import BinaryInsertionSearch, ConcurrentInsertion
+
+def run_search(search, true_rank, flip=lambda step: False):
+    """Drive `search` with an oracle; `flip(step)` returns True to give a wrong verdict."""
+    while (step := search.next_step()) is not None:
+        is_win = true_rank <= step.rank
+        search.record(is_win != flip(step))
+    return search.rank
+
+class TestBinaryInsertionSearch:
+
+    @pytest.mark.parametrize('num_ranked', [1, 2, 3, 10, 100, 801])
+    def test_finds_every_rank(self, num_ranked):
+        for true_rank in range(num_ranked + 1):
+            assert run_search(BinaryInsertionSearch(num_ranked), true_rank) == true_rank
+
+    def test_number_of_steps_is_logarithmic(self):
+        search = BinaryInsertionSearch(800)
+        run_search(search, true_rank=123)
+        # ~log2(801) halvings plus at most two confirmations
+        assert search.num_steps <= 10 + 2
+
+    def test_first_step_is_sonnet_best_of_3(self):
+        step = BinaryInsertionSearch(10).next_step()
+        assert step.model == 'sonnet' and step.n == 3 and step.rank == 5
+
+    def test_confirmations_wait_in_the_confirm_lane(self):
+        search = BinaryInsertionSearch(100)
+        steps = []
+        while (step := search.next_step()) is not None:
+            steps.append(step)
+            search.record(40 <= step.rank)
+        assert steps[0].lane == 'default'
+        assert {step.lane for step in steps if step.model == 'haiku'} == {'explore'}
+        assert steps[-1].lane == 'confirm'
+
+    def test_record_without_step(self):
+        with pytest.raises(ValueError):
+            BinaryInsertionSearch(10).record(True)
+
+    def test_wrong_haiku_step_is_repaired(self):
+        """Haiku gets the first comparison after the Sonnet best of 3 wrong."""
+        num_ranked, true_rank = 100, 40
+        flipped = []
+
+        def flip(step):
+            if step.model == 'haiku' and not flipped:
+                flipped.append(step)
+                return True
+            return False
+
+        search = BinaryInsertionSearch(num_ranked)
+        assert run_search(search, true_rank, flip) == true_rank
+        assert search.backtracks >= 1
+
+    def test_random_haiku_noise(self):
+        rng = random.Random(0)
+        num_ranked, errors = 200, []
+        for _ in range(200):
+            true_rank = rng.randint(0, num_ranked)
+            search = BinaryInsertionSearch(num_ranked)
+            rank = run_search(search, true_rank, lambda step: step.model == 'haiku' and rng.random() < 0.1)
+            errors.append(abs(rank - true_rank))
+        # Confirmations keep most of the results exact despite 10% haiku noise
+        assert sum(error == 0 for error in errors) / len(errors) > 0.8
+
+class TestConcurrentInsertion:
+
+    @staticmethod
+    def run_rounds(insertion):
+        """Lexicographic oracle; every job handed out in a round is answered together."""
+        rounds = 0
+        while not insertion.done:
+            jobs = insertion.pending_jobs()
+            rounds += 1
+            for job in jobs:
+                insertion.record(job, job.to_be_ranked < job.opponent)
+        return [filename for filename, _ in insertion.final_order()], rounds
+
+    @pytest.mark.parametrize('num_ranked, num_candidates', [(0, 1), (0, 7), (5, 0), (1, 1), (10, 30), (200, 50)])
+    def test_final_order_is_sorted(self, num_ranked, num_candidates):
+        rng = random.Random(num_ranked + num_candidates)
+        names = rng.sample([f'{i:05d}.png' for i in range(10000)], num_ranked + num_candidates)
+        ranked, candidates = sorted(names[:num_ranked]), names[num_ranked:]
+
+        order, _ = self.run_rounds(ConcurrentInsertion(candidates, ranked))
+        assert order == sorted(names)
+
+    def test_ranked_flags(self):
+        insertion = ConcurrentInsertion(['b.png', 'd.png'], ['a.png', 'c.png'])
+        self.run_rounds(insertion)
+        assert insertion.final_order() == [('a.png', True), ('b.png', False), ('c.png', True), ('d.png', False)]
+
+    def test_rounds_do_not_grow_with_candidates(self):
+        ranked = [f'{i:04d}.png' for i in range(0, 2000, 2)]
+        candidates = [f'{i:04d}.png' for i in range(1, 2000, 20)]
+        _, rounds = self.run_rounds(ConcurrentInsertion(candidates, ranked))
+        # One binary search deep, not one per candidate
+        assert rounds <= 15
+
+    def test_fresh_intake_is_ordered_in_parallel(self):
+        candidates = random.Random(0).sample([f'{i:03d}.png' for i in range(300)], 300)
+        insertion = ConcurrentInsertion(candidates, [])
+        rounds, comparisons, models = 0, 0, set()
+        while not insertion.done:
+            jobs = insertion.pending_jobs()
+            rounds += 1
+            comparisons += len(jobs)
+            models.update(job.model for job in jobs)
+            for job in jobs:
+                insertion.record(job, job.to_be_ranked < job.opponent)
+
+        assert [filename for filename, _ in insertion.final_order()] == sorted(candidates)
+        # Every candidate lands in the one gap; its network is 45 rounds deep
+        assert rounds <= 46
+        assert comparisons > 50 * rounds
+        # ... and its comparators are Haiku calls
+        assert models == {'haiku'}
+        assert ConcurrentInsertion.estimate_calls(300, 0) == {'haiku': comparisons, 'sonnet': 0}
+
+    def test_estimate_calls(self):
+        # Every search takes its steps, and 300 candidates in 1,001 gaps need no network
+        assert ConcurrentInsertion.estimate_calls(300, 1000) == {'haiku': 300 * 8, 'sonnet': 300 * 3}
+        assert ConcurrentInsertion.estimate_calls(8, 0, gap_model='sonnet') == {'haiku': 0, 'sonnet': 19}
+
+    def test_final_order_before_done(self):
+        with pytest.raises(ValueError):
+            ConcurrentInsertion(['a.png'], ['b.png']).final_order()
+
+if __name__ == "__main__":
+    pytest.main(["-s", __file__])
@@ -0,0 +1,103 @@
+import json
+import os
+import anthropic
+import numpy as np
+import pytest
+from anthropic_stub import MessagesStub
+from comparison_store import ComparisonStore
+from conftest import respond
+from rating_engine import RatingEngine
+from resume_comparer import LLMResumeComparer
+from resume_sorter import ResumeSorter
+
+NAMES = ['a.png', 'c.png', 'f.png', 'h.png', 'k.png', 'p.png', 't.png', 'w.png']
+
+@pytest.fixture
+def resume_folder(tmp_path, monkeypatch):
+    """Alphabetically earlier names are better; half of them are already ranked, in the wrong order."""
+    monkeypatch.chdir(tmp_path)
+    for folder in ('ranked', 'unranked', 'storage'):
+        os.makedirs(f'rated_resumes/{folder}')
+    for rank, name in enumerate(reversed(NAMES[::2])):
+        with open(f'rated_resumes/ranked/{rank:03}-{name}', 'wb') as file:
+            file.write(name.encode('utf-8'))
+    for name in NAMES[1::2]:
+        with open(f'rated_resumes/unranked/{name}', 'wb') as file:
+            file.write(name.encode('utf-8'))
+    with open('rated_resumes/usage.json', 'w') as file:
+        json.dump({'num_calls': {'haiku': 0, 'sonnet': 0}}, file)
+    return 'rated_resumes'
+
+@pytest.fixture
+def stub():
+    with MessagesStub(respond) as stub:
+        yield stub
+
+def comparer(resume_folder, stub, store=None):
+    resume_comparer = LLMResumeComparer(resume_folder, comparison_store=store or ComparisonStore(':memory:'))
+    resume_comparer.client = anthropic.Anthropic(base_url=stub.url, api_key='test', max_retries=0)
+    return resume_comparer
+
+def items(resume_folder):
+    return ([(filename, True) for filename in sorted(os.listdir(f'./{resume_folder}/ranked'))] +
+            [(filename, False) for filename in sorted(os.listdir(f'./{resume_folder}/unranked'))])
+
+class TestRatingEngine:
+
+    def test_fit_orders_by_wins(self, resume_folder, stub):
+        engine = RatingEngine(comparer(resume_folder, stub), items(resume_folder))
+        # 0 beats 1 beats 2, and 0 beats 2; the rest were never compared
+        engine.wins[0, 1] = engine.wins[1, 2] = engine.wins[0, 2] = 1
+        engine.fit()
+
+        assert engine.scores[0] > engine.scores[1] > engine.scores[2]
+        # Never compared, so less is known about them
+        uncertainties = engine.uncertainties()
+        assert uncertainties[3] > uncertainties[1]
+
+    def test_run_finds_the_order_and_stops(self, resume_folder, stub):
+        engine = RatingEngine(comparer(resume_folder, stub), items(resume_folder), pairs_per_round=4)
+        order = engine.run()
+
+        names = [filename.split('-')[-1] for filename, _ in order]
+        assert names == NAMES
+        assert engine.num_calls == len(stub.requests)
+        # Stopped by the stability rule, not by running out of rounds
+        assert engine.rounds < engine.max_rounds
+
+    def test_kendall_tau(self):
+        tau = RatingEngine.kendall_tau
+        assert tau(np.array([0, 1, 2]), np.array([0, 1, 2])) == 1
+        assert tau(np.array([0, 1, 2]), np.array([2, 1, 0])) == -1
+        assert tau(np.array([0, 1, 2]), np.array([1, 0, 2])) == pytest.approx(1 / 3)
+
+    def test_max_calls(self, resume_folder, stub):
+        engine = RatingEngine(comparer(resume_folder, stub), items(resume_folder), pairs_per_round=4, max_calls=6)
+        engine.run()
+        assert engine.num_calls == 6
+
+    def test_stored_verdicts_are_used(self, resume_folder, stub):
+        store = ComparisonStore(':memory:')
+        first = RatingEngine(comparer(resume_folder, stub, store), items(resume_folder), pairs_per_round=4)
+        first.run()
+
+        second = RatingEngine(comparer(resume_folder, stub, store), items(resume_folder))
+        assert second.wins.sum() == first.wins.sum()
+        assert list(second.fit().argsort()) == list(first.scores.argsort())
+
+class TestRateAll:
+
+    @pytest.mark.parametrize('use_index', [False, True])
+    def test_rate_all_rewrites_ranked_folder(self, resume_folder, stub, use_index):
+        sorter = ResumeSorter(resume_folder, use_index=use_index)
+        sorter.resume_comparer.client = anthropic.Anthropic(base_url=stub.url, api_key='test', max_retries=0)
+        engine = sorter.rate_all(pairs_per_round=4)
+
+        assert sorted(os.listdir(f'./{resume_folder}/ranked')) == [f'{rank:03}-{name}' for rank, name in enumerate(NAMES)]
+        assert os.listdir(f'./{resume_folder}/unranked') == []
+
+        with open(f'./{resume_folder}/ratings.json', 'r') as file:
+            ratings = json.load(file)
+        assert sorted(ratings) == NAMES
+        with open(f'./{resume_folder}/usage.json', 'r') as file:
+            assert json.load(file)['num_calls']['sonnet'] == engine.num_calls
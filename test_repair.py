@@ -0,0 +1,92 @@
+import base64
+import json
+import os
+import pytest
+from anthropic_stub import MessagesStub
+from conftest import label_of, respond
+from resume_sorter import ResumeSorter
+from verdict_graph import VerdictGraph
+
+class TestCycles:
+
+    def test_cycle_is_found(self):
+        graph = VerdictGraph()
+        graph.add('a', 'b', True, 'sonnet')
+        graph.add('b', 'c', True, 'sonnet')
+        graph.add('c', 'a', True, 'haiku')
+        graph.add('c', 'd', True, 'sonnet')
+        assert [sorted(cycle) for cycle in graph.cycles()] == [['a', 'b', 'c']]
+
+    def test_no_cycle(self):
+        graph = VerdictGraph()
+        graph.add('a', 'b', True, 'sonnet')
+        graph.add('b', 'c', True, 'sonnet')
+        graph.add('a', 'c', True, 'haiku')
+        assert graph.cycles() == []
+
+class TestRepair:
+
+    @pytest.fixture(autouse=True)
+    def setup(self, resume_folder, monkeypatch):
+        self.resume_folder = resume_folder
+        with MessagesStub(respond) as self.stub:
+            monkeypatch.setenv('ANTHROPIC_BASE_URL', self.stub.url)
+            yield
+
+    def seed(self, sorter, votes):
+        """Store one Haiku vote per (winner, loser) pair of ranked filenames."""
+        comparer = sorter.resume_comparer
+        for winner, loser in votes:
+            comparer.comparison_store.put(comparer.image_hash(True, winner), comparer.image_hash(True, loser), 'haiku',
+                                          comparer.prompt_hash, 0, 'Resume A', '')
+
+    def ranked(self):
+        return sorted(os.listdir(f'./{self.resume_folder}/ranked'))
+
+    def test_consistent_ranking_costs_nothing(self):
+        sorter = ResumeSorter(self.resume_folder)
+        self.seed(sorter, [('000-c.png', '001-m.png'), ('001-m.png', '002-x.png')])
+        report = sorter.repair()
+        assert self.stub.requests == []
+        assert report['suspects'] == report['calls'] == 0
+        assert self.ranked() == ['000-c.png', '001-m.png', '002-x.png']
+
+    def test_bad_vote_is_outvoted(self):
+        sorter = ResumeSorter(self.resume_folder)
+        self.seed(sorter, [('001-m.png', '000-c.png')])
+        report = sorter.repair(extra_votes=3)
+        assert len(self.stub.requests) == report['calls'] == 3
+        # A/B, B/A, A/B
+        c_data = base64.b64encode(b'c.png').decode('utf-8')
+        labels = [label_of(request['messages'][0]['content'], c_data) for request in self.stub.requests]
+        assert sorted(labels) == ['Resume A', 'Resume A', 'Resume B']
+        assert report['suspects'] == report['confirmed'] == 1
+        assert report['windows'] == []
+        assert self.ranked() == ['000-c.png', '001-m.png', '002-x.png']
+
+    def test_misordered_pair_is_resorted(self):
+        os.rename(f'{self.resume_folder}/ranked/000-c.png', f'{self.resume_folder}/ranked/001-c.png.tmp')
+        os.rename(f'{self.resume_folder}/ranked/001-m.png', f'{self.resume_folder}/ranked/000-m.png')
+        os.rename(f'{self.resume_folder}/ranked/001-c.png.tmp', f'{self.resume_folder}/ranked/001-c.png')
+        sorter = ResumeSorter(self.resume_folder)
+        self.seed(sorter, [('001-c.png', '000-m.png'), ('000-m.png', '002-x.png')])
+
+        report = sorter.repair()
+        assert report['confirmed'] == 0
+        assert report['windows'] == [(0, 1)]
+        assert report['moved'] == 2
+        assert self.ranked() == ['000-c.png', '001-m.png', '002-x.png']
+        # x.png was never in doubt
+        assert report['calls'] == len(self.stub.requests) <= 3 + 2 * 2
+        with open(f'{self.resume_folder}/usage.json') as file:
+            assert json.load(file)['num_calls']['sonnet'] == report['calls']
+
+    def test_cycle_is_broken(self):
+        sorter = ResumeSorter(self.resume_folder)
+        self.seed(sorter, [('000-c.png', '001-m.png'), ('001-m.png', '002-x.png'), ('002-x.png', '000-c.png')])
+        report = sorter.repair(extra_votes=1)
+        assert report['cycles'] == 1
+        assert report['suspects'] == report['confirmed'] == 3
+        assert report['windows'] == []
+        assert report['insert_all_calls'] > 0
+        assert self.ranked() == ['000-c.png', '001-m.png', '002-x.png']
@@ -0,0 +1,245 @@
+import asyncio
+from types import SimpleNamespace
+import anthropic
+import httpx
+import pytest
+from comparison_store import ComparisonStore
+from request_scheduler import RateLimits, RequestScheduler, classify_error
+from resume_comparer import AsyncLLMResumeComparer, LLMResumeComparer
+from test_resume_comparer import FakeMessages
+
+def api_error(cls, status, message='error', headers=None):
+    response = httpx.Response(status, headers=headers, request=httpx.Request('POST', 'https://api.anthropic.com/v1/messages'))
+    return cls(message, response=response, body=None)
+
+def reply(output_tokens=10):
+    usage = SimpleNamespace(input_tokens=100, cache_creation_input_tokens=0, cache_read_input_tokens=0, output_tokens=output_tokens)
+    return SimpleNamespace(content=[], usage=usage)
+
+PARAMS = {'max_tokens': 1000, 'messages': [{'role': 'user', 'content': [{'type': 'text', 'text': 'x' * 400}]}]}
+
+class FakeTime:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+def scheduler(fake_time, limits=None, **kwargs):
+    return RequestScheduler(limits=limits or {}, clock=fake_time.clock, sleep=fake_time.sleep, **kwargs)
+
+class TestClassifyError:
+
+    @pytest.mark.parametrize('error, kind', [
+        (api_error(anthropic.RateLimitError, 429), 'rate_limited'),
+        (api_error(anthropic.APIStatusError, 529), 'overloaded'),
+        (api_error(anthropic.InternalServerError, 500), 'server'),
+        (anthropic.APIConnectionError(request=httpx.Request('POST', 'https://api.anthropic.com')), 'connection'),
+        (api_error(anthropic.BadRequestError, 400, 'Image does not match the provided media type image/png'), 'media_type'),
+        (api_error(anthropic.BadRequestError, 400, 'max_tokens: field required'), 'bad_request'),
+        (api_error(anthropic.AuthenticationError, 401), 'auth'),
+    ])
+    def test_classify(self, error, kind):
+        assert classify_error(error) == kind
+
+class TestRequestScheduler:
+
+    def test_requests_per_minute(self):
+        fake_time = FakeTime()
+        requests = scheduler(fake_time, {'haiku': RateLimits(2, 10**6, 10**6)})
+        for _ in range(3):
+            requests.create(lambda **params: reply(), PARAMS, 'haiku')
+
+        # The third request waits for the bucket to refill one request: 30 seconds at 2 per minute
+        assert fake_time.now == pytest.approx(30)
+        assert requests.report()['haiku']['throttle_seconds'] == pytest.approx(30)
+
+    def test_unused_output_tokens_are_given_back(self):
+        fake_time = FakeTime()
+        requests = scheduler(fake_time, {'haiku': RateLimits(100, 10**6, 1500)})
+        # Each call reserves max_tokens=1000 but only uses 10, so the second doesn't wait
+        requests.create(lambda **params: reply(output_tokens=10), PARAMS, 'haiku')
+        requests.create(lambda **params: reply(output_tokens=10), PARAMS, 'haiku')
+        assert fake_time.now == 0
+
+    def test_rate_limit_is_retried_after_retry_after(self):
+        fake_time = FakeTime()
+        requests = scheduler(fake_time)
+        errors = [api_error(anthropic.RateLimitError, 429, headers={'retry-after': '7'})]
+
+        def create(**params):
+            if errors:
+                raise errors.pop()
+            return reply()
+
+        assert requests.create(create, PARAMS, 'sonnet').usage.output_tokens == 10
+        assert fake_time.sleeps[0] >= 7
+        assert requests.report()['sonnet']['retries'] == {'rate_limited': 1}
+
+    def test_backoff_is_exponential_and_gives_up(self):
+        fake_time = FakeTime()
+        requests = scheduler(fake_time, max_attempts=4, base_delay=1.0)
+
+        def create(**params):
+            raise api_error(anthropic.InternalServerError, 500)
+
+        with pytest.raises(anthropic.InternalServerError):
+            requests.create(create, PARAMS, 'sonnet')
+        assert len(fake_time.sleeps) == 3
+        assert all(delay <= 2 ** attempt for attempt, delay in enumerate(fake_time.sleeps))
+        assert requests.report()['sonnet']['errors'] == {'server': 1}
+
+    def test_bad_request_is_not_retried(self):
+        fake_time = FakeTime()
+        requests = scheduler(fake_time)
+        calls = []
+
+        def create(**params):
+            calls.append(params)
+            raise api_error(anthropic.BadRequestError, 400, 'max_tokens: field required')
+
+        with pytest.raises(anthropic.BadRequestError):
+            requests.create(create, PARAMS, 'sonnet')
+        assert len(calls) == 1
+
+    def test_confirm_lane_goes_first(self):
+        fake_time = FakeTime()
+        requests = scheduler(fake_time, {'sonnet': RateLimits(1, 10**6, 10**6)})
+        requests.create(lambda **params: reply(), PARAMS, 'sonnet')
+
+        # The bucket is empty; an exploring call arrives before a confirming one
+        explore = requests._enqueue('sonnet', 'explore', PARAMS)
+        confirm = requests._enqueue('sonnet', 'confirm', PARAMS)
+        assert requests.report()['sonnet']['queue_depth'] == 2
+
+        fake_time.now += 60
+        assert requests._try_admit('sonnet', explore) > 0
+        assert requests._try_admit('sonnet', confirm) == 0
+
+    def test_cancelled_waiter_leaves_the_queue(self):
+        fake_time = FakeTime()
+        requests = RequestScheduler(limits={'haiku': RateLimits(1, 10**6, 10**6)}, clock=fake_time.clock)
+
+        async def create(**params):
+            return reply()
+
+        async def run():
+            await requests.create_async(create, PARAMS, 'haiku')
+            # The bucket is empty, so this one waits, until it is cancelled
+            waiter = asyncio.create_task(requests.create_async(create, PARAMS, 'haiku'))
+            await asyncio.sleep(0)
+            assert len(requests.queues['haiku']) == 1
+            waiter.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await waiter
+            assert requests.queues['haiku'] == []
+
+            fake_time.now += 60
+            return await asyncio.wait_for(requests.create_async(create, PARAMS, 'haiku'), timeout=5)
+
+        assert asyncio.run(run()).usage.output_tokens == 10
+
+    def test_interrupted_waiter_leaves_the_queue(self):
+        fake_time = FakeTime()
+
+        def interrupt(seconds):
+            raise KeyboardInterrupt
+
+        requests = RequestScheduler(limits={'haiku': RateLimits(1, 10**6, 10**6)}, clock=fake_time.clock, sleep=interrupt)
+        requests.create(lambda **params: reply(), PARAMS, 'haiku')
+        with pytest.raises(KeyboardInterrupt):
+            requests.create(lambda **params: reply(), PARAMS, 'haiku')
+        assert requests.queues['haiku'] == []
+
+        fake_time.now += 60
+        assert requests.create(lambda **params: reply(), PARAMS, 'haiku').usage.output_tokens == 10
+
+    def test_confirm_call_takes_the_next_free_slot(self):
+        comparer = AsyncLLMResumeComparer('test_resumes', max_concurrency=1, scheduler=RequestScheduler(limits={}))
+        resumes = comparer._build_resumes('000-jorge.png', '001-resume_test_update.jpg')
+        served = []
+
+        async def create(**params):
+            served.append(params['model'])
+            return reply()
+
+        comparer.client = SimpleNamespace(messages=SimpleNamespace(create=create))
+
+        async def run():
+            # Hold the only slot while three exploring Haiku calls and then a confirming Sonnet call queue up
+            await comparer.semaphore.acquire()
+            explore = [asyncio.create_task(comparer._create_message(resumes, False, 'haiku', lane='explore')) for _ in range(3)]
+            for _ in range(3):
+                await asyncio.sleep(0)
+            confirm = asyncio.create_task(comparer._create_message(resumes, False, 'sonnet', lane='confirm'))
+            for _ in range(3):
+                await asyncio.sleep(0)
+            assert served == []
+            comparer.semaphore.release()
+            await asyncio.gather(*explore, confirm)
+
+        asyncio.run(run())
+        assert ['sonnet' in model for model in served] == [True, False, False, False]
+        assert comparer.semaphore.value == 1
+
+    def test_async(self, monkeypatch):
+        fake_time = FakeTime()
+        requests = scheduler(fake_time)
+        errors = [api_error(anthropic.APIStatusError, 529)]
+
+        async def create(**params):
+            if errors:
+                raise errors.pop()
+            return reply()
+
+        async def no_wait(seconds):
+            pass
+
+        monkeypatch.setattr(asyncio, 'sleep', no_wait)
+        message = asyncio.run(requests.create_async(create, PARAMS, 'haiku'))
+        assert message.usage.output_tokens == 10
+        assert requests.report()['haiku']['retries'] == {'overloaded': 1}
+
+class FailingMessages(FakeMessages):
+    """Raises each of `errors` once before answering like `FakeMessages`."""
+    def __init__(self, errors):
+        super().__init__()
+        self.errors = list(errors)
+
+    def create(self, **kwargs):
+        if self.errors:
+            self.calls += 1
+            raise self.errors.pop(0)
+        return super().create(**kwargs)
+
+class TestComparerErrors:
+
+    def comparer(self, errors):
+        resume_comparer = LLMResumeComparer(resume_folder='test_resumes', comparison_store=ComparisonStore(':memory:'),
+                                            scheduler=RequestScheduler(limits={}, sleep=lambda seconds: None))
+        self.messages = FailingMessages(errors)
+        self.messages.winner_data = resume_comparer.get_image_data(ranked=False, image_filename='000-jorge.png')
+        resume_comparer.client = SimpleNamespace(messages=self.messages)
+        return resume_comparer
+
+    def test_rate_limit_does_not_swap_mediatype(self):
+        resume_comparer = self.comparer([api_error(anthropic.RateLimitError, 429)])
+        comparison = resume_comparer.main('000-jorge.png', '001-resume_test_update.jpg')
+        assert comparison['winner'] == comparison['to_be_ranked_resume']
+        assert not resume_comparer.should_swap_mediatype
+        assert self.messages.calls == 2
+
+    def test_media_type_error_swaps_mediatype(self):
+        resume_comparer = self.comparer([api_error(anthropic.BadRequestError, 400, 'Image does not match the provided media type')])
+        resume_comparer.main('000-jorge.png', '001-resume_test_update.jpg')
+        assert resume_comparer.should_swap_mediatype
+
+    def test_other_errors_are_raised(self):
+        resume_comparer = self.comparer([api_error(anthropic.AuthenticationError, 401)])
+        with pytest.raises(anthropic.AuthenticationError):
+            resume_comparer.main('000-jorge.png', '001-resume_test_update.jpg')
@@ -1,6 +1,13 @@
+import anthropic
 import os
+import threading
 import pytest
+from types import SimpleNamespace
+import resume_comparer
 from resume_comparer import LLMResumeComparer
+from comparison_store import ComparisonStore
+from anthropic_stub import MessagesStub
+from conftest import label_of
 
 @pytest.fixture(scope="class")
 def resume_comparer_fixture():
@@ -44,5 +51,207 @@ class TestResumeComparer:
     def test_4vs5(self):
         self._compare_and_assert(4, 5)
         
+class FakeMessages:
+    """Stands in for `client.messages`; the resume with `winner_data` always wins."""
+    def __init__(self):
+        self.calls = 0
+
+    def create(self, **kwargs):
+        self.calls += 1
+        text = f"I prefer {label_of(kwargs['messages'][0]['content'], self.winner_data)}"
+        usage = SimpleNamespace(input_tokens=100, cache_creation_input_tokens=0, cache_read_input_tokens=0, output_tokens=50)
+        return SimpleNamespace(content=[SimpleNamespace(type='text', text=text)], usage=usage)
+
+class TestComparisonStoreLookups:
+
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        self.resume_comparer = LLMResumeComparer(resume_folder='test_resumes', comparison_store=ComparisonStore(':memory:'))
+        self.messages = FakeMessages()
+        self.messages.winner_data = self.resume_comparer.get_image_data(ranked=False, image_filename='000-jorge.png')
+        self.resume_comparer.client = SimpleNamespace(messages=self.messages)
+
+    def test_main_is_cached(self):
+        first = self.resume_comparer.main('000-jorge.png', '001-resume_test_update.jpg')
+        second = self.resume_comparer.main('000-jorge.png', '001-resume_test_update.jpg')
+        assert self.messages.calls == 1
+        assert first['winner'] == first['to_be_ranked_resume']
+        assert second['winner'] == second['to_be_ranked_resume']
+
+    def test_best_of_n_reuses_every_vote(self):
+        self.resume_comparer.best_of_n(3, '000-jorge.png', '001-resume_test_update.jpg')
+        calls = self.messages.calls
+        comparison = self.resume_comparer.best_of_n(3, '000-jorge.png', '001-resume_test_update.jpg')
+        assert self.messages.calls == calls
+        assert self.resume_comparer.num_calls['sonnet'] == calls
+        assert comparison['winner'] == comparison['to_be_ranked_resume']
+
+class BarrierMessages(FakeMessages):
+    """Like `FakeMessages`, but every call waits until `parties` calls are in flight."""
+    def __init__(self, parties):
+        super().__init__()
+        self.barrier = threading.Barrier(parties, timeout=5)
+        self.lock = threading.Lock()
+
+    def create(self, **kwargs):
+        self.barrier.wait()
+        with self.lock:
+            return super().create(**kwargs)
+
+class TestParallelBestOfN:
+
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        self.resume_comparer = LLMResumeComparer(resume_folder='test_resumes', comparison_store=ComparisonStore(':memory:'))
+        self.winner_data = self.resume_comparer.get_image_data(ranked=False, image_filename='000-jorge.png')
+
+    def _use(self, messages):
+        messages.winner_data = self.winner_data
+        self.resume_comparer.client = SimpleNamespace(messages=messages)
+        return messages
+
+    def test_first_wave_is_concurrent(self):
+        # Best of 5 with a unanimous winner: one wave of 3 calls, all in flight together
+        messages = self._use(BarrierMessages(3))
+        comparison = self.resume_comparer.best_of_n(5, '000-jorge.png', '001-resume_test_update.jpg')
+        assert messages.calls == 3
+        assert self.resume_comparer.num_calls['sonnet'] == 3
+        assert comparison['winner'] == comparison['to_be_ranked_resume']
+
+    def test_split_vote_needs_one_more_call(self):
+        messages = self._use(FakeMessages())
+        verdicts = iter([True, False, True])
+        create = messages.create
+
+        def create_with_verdicts(**kwargs):
+            message = create(**kwargs)
+            winner = label_of(kwargs['messages'][0]['content'], self.winner_data)
+            loser = 'Resume B' if winner == 'Resume A' else 'Resume A'
+            message.content[0].text = f'I prefer {winner if next(verdicts) else loser}'
+            return message
+
+        messages.create = create_with_verdicts
+        comparison = self.resume_comparer.best_of_n(3, '000-jorge.png', '001-resume_test_update.jpg')
+        assert messages.calls == 3
+        assert comparison['winner'] == comparison['to_be_ranked_resume']
+
+    def test_votes_alternate_order(self):
+        messages = self._use(BarrierMessages(2))
+        orders = []
+        create = messages.create
+
+        def record_label(**kwargs):
+            orders.append(label_of(kwargs['messages'][0]['content'], self.winner_data))
+            return create(**kwargs)
+
+        messages.create = record_label
+        self.resume_comparer.best_of_n(3, '000-jorge.png', '001-resume_test_update.jpg')
+        assert sorted(orders) == ['Resume A', 'Resume B']
+
+class TestPromptCaching:
+
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        self.resume_comparer = LLMResumeComparer(resume_folder='test_resumes', comparison_store=ComparisonStore(':memory:'))
+        winner_data = self.resume_comparer.get_image_data(ranked=False, image_filename='000-jorge.png')
+        respond = lambda request: f"I prefer {label_of(request['messages'][0]['content'], winner_data)}"
+        with MessagesStub(respond) as self.stub:
+            self.resume_comparer.client = anthropic.Anthropic(base_url=self.stub.url, api_key='test', max_retries=0)
+            yield
+
+    def test_either_resume_can_come_first(self, monkeypatch):
+        swaps = iter([0, 1, 0, 1])
+        monkeypatch.setattr(resume_comparer, 'randint', lambda a, b: next(swaps))
+        for opponent in ['001-resume_test_update.jpg', '002-longbow.png', '004-CV_V1_111.png', '005-cv0.png']:
+            self.resume_comparer.main('000-jorge.png', opponent)
+
+        candidate_data = self.resume_comparer.get_image_data(ranked=False, image_filename='000-jorge.png')
+        candidate_first = []
+        for request in self.stub.requests:
+            content = request['messages'][0]['content']
+            assert content[0]['text'].startswith(LLMResumeComparer.PROMPT)
+            assert content[0]['cache_control'] == {'type': 'ephemeral'}
+            candidate_first.append(content[1]['source']['data'] == candidate_data)
+            # Resume A is the one shown first; the resume being ranked is cached with the prompt when it is first
+            assert label_of(content, content[1]['source']['data']) == 'Resume A'
+            assert ('cache_control' in content[1]) == candidate_first[-1]
+            assert 'cache_control' not in content[3]
+        assert candidate_first == [False, True, False, True]
+
+    def test_prefix_is_read_from_cache(self, monkeypatch):
+        # The resume being ranked is shown first
+        monkeypatch.setattr(resume_comparer, 'randint', lambda a, b: 1)
+        first = self.resume_comparer.main('000-jorge.png', '001-resume_test_update.jpg')
+        second = self.resume_comparer.main('000-jorge.png', '002-longbow.png')
+        assert first['winner'] == first['to_be_ranked_resume']
+        assert second['winner'] == second['to_be_ranked_resume']
+
+        first_usage, second_usage = self.resume_comparer.token_usage
+        assert first_usage['cache_creation_input_tokens'] > 0
+        assert first_usage['cache_read_input_tokens'] == 0
+        assert second_usage['cache_read_input_tokens'] == first_usage['cache_creation_input_tokens']
+        assert second_usage['opponent'] == '002-longbow.png'
+
+        totals = self.resume_comparer.token_report()
+        assert totals['cache_read_input_tokens'] == second_usage['cache_read_input_tokens']
+
+        # Shown second, only the prompt comes from the cache
+        monkeypatch.setattr(resume_comparer, 'randint', lambda a, b: 0)
+        self.resume_comparer.main('000-jorge.png', '004-CV_V1_111.png')
+        assert 0 < self.resume_comparer.token_usage[-1]['cache_read_input_tokens'] < second_usage['cache_read_input_tokens']
+
+class TestFastVerdict:
+
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        self.resume_comparer = LLMResumeComparer(resume_folder='test_resumes', comparison_store=ComparisonStore(':memory:'),
+                                                 fast_verdict=True)
+        self.winner_data = self.resume_comparer.get_image_data(ranked=False, image_filename='000-jorge.png')
+        # Replies that can't be read, before the real ones
+        self.unreadable = 0
+
+        with MessagesStub(self.respond) as self.stub:
+            self.resume_comparer.client = anthropic.Anthropic(base_url=self.stub.url, api_key='test', max_retries=0)
+            yield
+
+    def respond(self, request):
+        content = request['messages'][0]['content']
+        if 'tools' not in request:
+            return f'A long essay. I prefer {label_of(content, self.winner_data)}'
+        if self.unreadable:
+            self.unreadable -= 1
+            return {'type': 'tool_use', 'id': 'toolu_stub', 'name': 'record_verdict', 'input': {'winner': 'neither'}}
+        return {'type': 'tool_use', 'id': 'toolu_stub', 'name': 'record_verdict',
+                'input': {'winner': label_of(content, self.winner_data), 'reason': 'More relevant experience.'}}
+
+    def test_structured_verdict(self):
+        comparison = self.resume_comparer.main('000-jorge.png', '001-resume_test_update.jpg')
+        assert comparison['winner'] == comparison['to_be_ranked_resume']
+        assert comparison['claude_response'] == 'More relevant experience.'
+
+        request, = self.stub.requests
+        assert request['max_tokens'] == LLMResumeComparer.FAST_MAX_TOKENS
+        assert request['tool_choice'] == {'type': 'tool', 'name': 'record_verdict'}
+        assert request['messages'][0]['content'][0]['text'].startswith(LLMResumeComparer.FAST_PROMPT)
+
+    def test_unreadable_verdict_is_retried(self, monkeypatch):
+        monkeypatch.setattr('builtins.input', lambda *args: pytest.fail('waited for a key press'))
+        self.unreadable = 2
+        comparison = self.resume_comparer.main('000-jorge.png', '001-resume_test_update.jpg')
+        assert comparison['winner'] == comparison['to_be_ranked_resume']
+        assert len(self.stub.requests) == 3
+        assert self.resume_comparer.num_calls['sonnet'] == 3
+
+    def test_explain_fetches_the_essay_once(self):
+        self.resume_comparer.main('000-jorge.png', '001-resume_test_update.jpg')
+        for _ in range(2):
+            comparison = self.resume_comparer.explain('000-jorge.png', '001-resume_test_update.jpg')
+            assert comparison['claude_response'].startswith('A long essay')
+            assert comparison['winner'] == comparison['to_be_ranked_resume']
+
+        essay_requests = [request for request in self.stub.requests if 'tools' not in request]
+        assert len(essay_requests) == 1
+        assert essay_requests[0]['max_tokens'] == LLMResumeComparer.ESSAY_MAX_TOKENS
+
 if __name__ == "__main__":
     pytest.main(["-s", __file__])
\ No newline at end of file
@@ -0,0 +1,142 @@
+import io
+import json
+import os
+import pytest
+from comparison_store import ComparisonStore
+from resume_comparer import LLMResumeComparer
+from resume_ingest import ResumeIngest, hamming_distance, perceptual_hash, sniff_media_type
+from resume_sorter import ResumeSorter
+
+Image = pytest.importorskip('PIL.Image')
+
+def make_resume(layout, size=(600, 800), image_format='PNG'):
+    """A white page with dark 'text' blocks; `layout` moves the blocks around."""
+    image = Image.new('RGB', (600, 800), 'white')
+    for row in range(10):
+        left = 40 + (row * 37 * layout) % 200
+        image.paste((30, 30, 30), (left, 40 + row * 70, left + 300, 70 + row * 70))
+    image = image.resize(size)
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format)
+    return buffer.getvalue()
+
+@pytest.fixture
+def resume_folder(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for folder in ('ranked', 'unranked', 'storage'):
+        os.makedirs(f'ingest_resumes/{folder}')
+    return 'ingest_resumes'
+
+def write(resume_folder, folder, filename, data):
+    with open(f'./{resume_folder}/{folder}/{filename}', 'wb') as file:
+        file.write(data)
+
+class TestSniffing:
+
+    @pytest.mark.parametrize('image_format, media_type', [('PNG', 'image/png'), ('JPEG', 'image/jpeg'),
+                                                          ('GIF', 'image/gif'), ('WEBP', 'image/webp')])
+    def test_images(self, image_format, media_type):
+        assert sniff_media_type(make_resume(1, image_format=image_format)) == media_type
+
+    def test_pdf_and_unknown(self):
+        assert sniff_media_type(b'%PDF-1.7\n...') == 'application/pdf'
+        assert sniff_media_type(b'Dear hiring manager') is None
+
+    def test_perceptual_hash(self):
+        original = perceptual_hash(make_resume(1))
+        rescaled = perceptual_hash(make_resume(1, size=(450, 600), image_format='JPEG'))
+        other = perceptual_hash(make_resume(2))
+        assert hamming_distance(original, rescaled) <= 8
+        assert hamming_distance(original, other) > 8
+
+class TestResumeIngest:
+
+    def test_run(self, resume_folder):
+        write(resume_folder, 'ranked', '000-kept.png', make_resume(1))
+        write(resume_folder, 'unranked', 'copy.png', make_resume(1))
+        write(resume_folder, 'unranked', 'rescaled.jpg', make_resume(1, size=(450, 600), image_format='JPEG'))
+        write(resume_folder, 'unranked', 'new.cv.v2.jpg', make_resume(2))
+        write(resume_folder, 'unranked', 'letter.txt', b'Dear hiring manager')
+
+        manifest = ResumeIngest(resume_folder).run()
+        files = manifest['files']
+
+        assert files['copy.png']['status'] == 'duplicate'
+        assert files['copy.png']['duplicate_of'] == '000-kept.png'
+        assert files['rescaled.jpg']['status'] == 'ok'
+        assert files['rescaled.jpg']['near_duplicate_of'] == '000-kept.png'
+        assert files['new.cv.v2.jpg'] == {'source': 'new.cv.v2.jpg', 'media_type': 'image/png', 'status': 'ok',
+                                          'hash': ComparisonStore.hash_bytes(make_resume(2))}
+        assert files['letter.txt']['status'] == 'unsupported'
+
+        assert sorted(os.listdir(f'./{resume_folder}/unranked')) == ['new.cv.v2.jpg', 'rescaled.jpg']
+        assert os.listdir(f'./{resume_folder}/storage/duplicates') == ['copy.png']
+        assert os.listdir(f'./{resume_folder}/storage/unsupported') == ['letter.txt']
+        with open(f'./{resume_folder}/manifest.json', 'r') as file:
+            assert json.load(file) == manifest
+
+    def test_same_template_is_only_flagged(self, resume_folder):
+        # Another person's resume on the same template: one line shorter, a few bits away
+        image = Image.open(io.BytesIO(make_resume(1)))
+        image.paste('white', (300, 460, 380, 490))
+        buffer = io.BytesIO()
+        image.save(buffer, format='PNG')
+        assert hamming_distance(perceptual_hash(make_resume(1)), perceptual_hash(buffer.getvalue())) <= 8
+        write(resume_folder, 'unranked', 'alice.png', make_resume(1))
+        write(resume_folder, 'unranked', 'bob.png', buffer.getvalue())
+
+        files = ResumeIngest(resume_folder).run()['files']
+
+        assert files['bob.png']['status'] == 'ok'
+        assert files['bob.png']['near_duplicate_of'] == 'alice.png'
+        assert sorted(os.listdir(f'./{resume_folder}/unranked')) == ['alice.png', 'bob.png']
+
+    def test_storage_is_not_overwritten(self, resume_folder):
+        write(resume_folder, 'ranked', '000-kept.png', make_resume(1))
+        os.makedirs(f'./{resume_folder}/storage/duplicates')
+        write(resume_folder, 'storage/duplicates', 'copy.png', b'an earlier copy')
+        write(resume_folder, 'unranked', 'copy.png', make_resume(1))
+
+        files = ResumeIngest(resume_folder).run()['files']
+
+        assert files['copy.png']['stored_as'] == 'copy-1.png'
+        with open(f'./{resume_folder}/storage/duplicates/copy.png', 'rb') as file:
+            assert file.read() == b'an earlier copy'
+        assert sorted(os.listdir(f'./{resume_folder}/storage/duplicates')) == ['copy-1.png', 'copy.png']
+
+    def test_pdf_is_rendered(self, resume_folder):
+        pytest.importorskip('pypdfium2')
+        pages = [Image.open(io.BytesIO(make_resume(layout))) for layout in (1, 2, 3)]
+        buffer = io.BytesIO()
+        pages[0].save(buffer, format='PDF', save_all=True, append_images=pages[1:])
+        write(resume_folder, 'unranked', 'cv.pdf', buffer.getvalue())
+
+        manifest = ResumeIngest(resume_folder, pdf_scale=1.0, max_pages=2).run()
+
+        assert manifest['files']['cv.png']['source'] == 'cv.pdf'
+        assert manifest['files']['cv.png']['media_type'] == 'image/png'
+        assert os.listdir(f'./{resume_folder}/storage/originals') == ['cv.pdf']
+        with Image.open(f'./{resume_folder}/unranked/cv.png') as image:
+            # Two of the three pages, one under the other
+            assert image.size == (600, 1600)
+
+    def test_comparer_uses_the_media_type(self, resume_folder):
+        # A PNG named .jpg
+        write(resume_folder, 'unranked', 'cv.jpg', make_resume(1))
+        sorter = ResumeSorter(resume_folder)
+        sorter.ingest()
+
+        resume_comparer = sorter.resume_comparer
+        resume_comparer.normalizer = None
+        assert resume_comparer.get_image(False, 'cv.jpg')['type'] == 'png'
+
+        # A new comparer reads the manifest
+        other = LLMResumeComparer(resume_folder, comparison_store=ComparisonStore(':memory:'), normalizer=None)
+        assert other.media_types == resume_comparer.media_types
+
+    def test_comparer_refuses_a_pdf(self, resume_folder):
+        # A PDF that was not ingested, whatever its name, is not sent as an image
+        write(resume_folder, 'unranked', 'cv.png', b'%PDF-1.7\n...')
+        resume_comparer = LLMResumeComparer(resume_folder, comparison_store=ComparisonStore(':memory:'), normalizer=None)
+        with pytest.raises(ValueError, match='ingest'):
+            resume_comparer.get_image(False, 'cv.png')
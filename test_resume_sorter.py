@@ -1,4 +1,6 @@
 from resume_sorter import ResumeSorter
+from resume_comparer import AsyncLLMResumeComparer
+from rank_search import ConcurrentInsertion
 from unittest.mock import patch
 import pytest
 import os
@@ -149,6 +151,97 @@ class TestResumeSorter:
         self.sorter.insert("zzz.png")
         self.assert_filenames()
 
+    def mock_async_best_of_n(self, n, unranked_filename, ranked_filename, model=None, opponent_is_ranked=True, lane='default'):
+        """Resume A (the one being ranked) wins if it is lexicographically smaller."""
+        opponent = self.rankstring.rm_rankstring_from_filename(ranked_filename) if opponent_is_ranked else ranked_filename
+        return {'Resume A': unranked_filename,
+                'Resume B': ranked_filename,
+                'winner': 'Resume A' if unranked_filename < opponent else 'Resume B',
+                'to_be_ranked_resume': 'Resume A',
+                'claude_response': 'placeholder'}
+
+    @patch.object(AsyncLLMResumeComparer, 'best_of_n', autospec=True)
+    def test_insert_all_concurrent(self, mock_best_of_n):
+        """Unrank everything, then insert it all at once against the (empty) snapshot."""
+        mock_best_of_n.side_effect = lambda comparer, *args, **kwargs: self.mock_async_best_of_n(*args, **kwargs)
+
+        self.sorter.unrank_files()
+        num_unranked = len(os.listdir('./resumes_test_sorter/unranked'))
+
+        # Size of every wave of comparisons handed out
+        waves = []
+        pending_jobs = ConcurrentInsertion.pending_jobs
+        def spy(insertion):
+            jobs = pending_jobs(insertion)
+            if jobs:
+                waves.append(len(jobs))
+            return jobs
+
+        with patch.object(ConcurrentInsertion, 'pending_jobs', spy):
+            self.sorter.insert_all(concurrency=4)
+        assert len(os.listdir('./resumes_test_sorter/ranked')) == num_unranked
+        assert os.listdir('./resumes_test_sorter/unranked') == []
+        self.assert_filenames()
+        if num_unranked > 2:
+            assert len(waves) < sum(waves)
+
+@pytest.fixture(scope='class')
+def binary_resume_sorter_fixture():
+    resume_sorter = ResumeSorter(resume_folder='resumes_test_sorter', debug=True, strategy='binary')
+    resume_sorter.unrank_files()
+    resume_sorter.read_ranked_folder()
+
+    # Move these files to storage
+    move_to_storage = ['abb.png', 'xxx.png', 'a.png', 'zzz.png']
+    for filename in move_to_storage:
+        try:
+            os.rename(f'./resumes_test_sorter/unranked/{filename}',
+                    f'./resumes_test_sorter/storage/{filename}')
+        except:
+            continue # they're probably already in storage
+
+    return resume_sorter, RankString()
+
+class TestResumeSorterBinary(TestResumeSorter):
+    """Same tests, but `find_rank()` uses the binary search strategy."""
+
+    @pytest.fixture(autouse=True)
+    def setup(self, binary_resume_sorter_fixture):
+        self.sorter, self.rankstring = binary_resume_sorter_fixture
+
+@pytest.fixture(scope='class')
+def index_resume_sorter_fixture():
+    resume_sorter = ResumeSorter(resume_folder='resumes_test_sorter', debug=True, use_index=True)
+    resume_sorter.unrank_files()
+    resume_sorter.read_ranked_folder()
+
+    # Move these files to storage
+    move_to_storage = ['abb.png', 'xxx.png', 'a.png', 'zzz.png']
+    for filename in move_to_storage:
+        try:
+            os.rename(f'./resumes_test_sorter/unranked/{filename}',
+                    f'./resumes_test_sorter/storage/{filename}')
+        except:
+            continue # they're probably already in storage
+
+    return resume_sorter, RankString()
+
+class TestResumeSorterIndex(TestResumeSorter):
+    """Same tests, but ranks are kept in rankings.json and only exported at the end."""
+
+    @pytest.fixture(autouse=True)
+    def setup(self, index_resume_sorter_fixture):
+        self.sorter, self.rankstring = index_resume_sorter_fixture
+
+    def mock_is_winner_tbr(self, comparison):
+        """Ranked files keep their own name until the ranked folder is exported."""
+        resume_r = self.rankstring.rm_rankstring_from_filename(comparison['Resume B'])
+        return comparison['Resume A'] < resume_r
+
+    def assert_filenames(self):
+        self.sorter.export_ranked_folder()
+        super().assert_filenames()
+
 if __name__ == "__main__":
     pytest.main(['-s', __file__])
 
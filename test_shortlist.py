@@ -0,0 +1,76 @@
+import base64
+import json
+import os
+import string
+import anthropic
+import pytest
+from anthropic_stub import MessagesStub
+from conftest import respond
+from resume_sorter import ResumeSorter
+from shortlist import Shortlist
+
+# 52 resumes; the alphabetically smaller name wins
+NAMES = [f'{letter}{suffix}.png' for letter in string.ascii_lowercase for suffix in ('a', 'b')]
+RANKED = ['000-ab.png', '001-mb.png', '002-zb.png']
+
+class TestShortlist:
+
+    @pytest.fixture(autouse=True)
+    def setup(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        for folder in ('ranked', 'unranked', 'storage'):
+            os.makedirs(f'shortlist_resumes/{folder}')
+        for name in NAMES:
+            ranked = [filename for filename in RANKED if filename[4:] == name]
+            path = f'shortlist_resumes/ranked/{ranked[0]}' if ranked else f'shortlist_resumes/unranked/{name}'
+            with open(path, 'wb') as file:
+                file.write(name.encode('utf-8'))
+        with open('shortlist_resumes/usage.json', 'w') as file:
+            json.dump({'num_calls': {'haiku': 0, 'sonnet': 0}}, file)
+
+        with MessagesStub(respond) as self.stub:
+            yield
+
+    @pytest.mark.parametrize('use_index', [False, True])
+    def test_shortlist_all(self, use_index):
+        sorter = ResumeSorter('shortlist_resumes', use_index=use_index)
+        sorter.resume_comparer.client = anthropic.Anthropic(base_url=self.stub.url, api_key='test', max_retries=0)
+        report = sorter.shortlist_all(k=5, seed=0)
+
+        assert sorted(os.listdir('./shortlist_resumes/ranked')) == [f'{rank:03}-{name}' for rank, name in enumerate(NAMES[:5])]
+        assert sorted(os.listdir('./shortlist_resumes/rest')) == NAMES[5:]
+        assert os.listdir('./shortlist_resumes/unranked') == []
+
+        # Linear in the pool, and far fewer than ordering all of it
+        assert report['calls']['haiku'] <= 5 * len(NAMES)
+        assert sum(report['calls'].values()) == len(self.stub.requests) < report['tournament_comparisons']
+        sonnet = [request for request in self.stub.requests if 'sonnet' in request['model']]
+        assert len(sonnet) == report['calls']['sonnet'] > 0
+
+    @pytest.mark.parametrize('seed', range(5))
+    def test_wrong_haiku_loss_is_overturned(self, seed, monkeypatch):
+        """Haiku says ba.png (second best) loses whenever it is the challenger and shown second, as Resume B."""
+        pivots, mistakes = [], []
+        beats_pivot = Shortlist._beats_pivot
+
+        def spy(shortlist, pivot, others, *args, **kwargs):
+            pivots.append(shortlist.images[pivot]['data'])
+            return beats_pivot(shortlist, pivot, others, *args, **kwargs)
+
+        def respond_with_haiku_mistake(request):
+            content = request['messages'][0]['content']
+            first, second = content[1]['source']['data'], content[3]['source']['data']
+            if 'haiku' in request['model'] and base64.b64decode(second) == b'ba.png' and first == pivots[-1]:
+                mistakes.append(request)
+                return 'I prefer Resume A'
+            return respond(request)
+
+        monkeypatch.setattr(Shortlist, '_beats_pivot', spy)
+
+        self.stub.respond = respond_with_haiku_mistake
+        sorter = ResumeSorter('shortlist_resumes')
+        sorter.resume_comparer.client = anthropic.Anthropic(base_url=self.stub.url, api_key='test', max_retries=0)
+        shortlist = Shortlist(sorter.resume_comparer, [(name, False) for name in os.listdir('./shortlist_resumes/unranked')], 5, seed=seed)
+        top, _ = shortlist.run()
+        assert mistakes
+        assert [filename for filename, _ in top] == ['aa.png', 'ba.png', 'bb.png', 'ca.png', 'cb.png']
@@ -0,0 +1,102 @@
+import os
+import pytest
+from anthropic_stub import MessagesStub
+from batch_insertion import BatchInsertion
+from conftest import UNRANKED, respond
+from resume_sorter import ResumeSorter
+from telemetry import Telemetry, call_cost, read_log, summary
+
+TOKENS = {'input_tokens': 1000, 'cache_creation_input_tokens': 0, 'cache_read_input_tokens': 2000, 'output_tokens': 100}
+
+class TestTelemetry:
+
+    def test_call_cost(self):
+        # 1000 * $3 + 2000 * $0.30 + 100 * $15 per million tokens
+        assert call_cost('sonnet', TOKENS) == pytest.approx(0.0051)
+        assert call_cost('sonnet', TOKENS, batch=True) == pytest.approx(0.00255)
+        assert call_cost('haiku', TOKENS) == pytest.approx(0.000435)
+
+    def test_record(self, tmp_path):
+        telemetry = Telemetry(f'{tmp_path}/calls.jsonl', f'{tmp_path}/metrics.prom')
+        telemetry.record('sonnet', 'a.png', '000-b.png', TOKENS, {'wall_seconds': 2.5, 'queue_seconds': 0.5, 'retries': 1})
+        telemetry.record('haiku', 'a.png', '001-c.png', TOKENS)
+
+        records = read_log(f'{tmp_path}/calls.jsonl')
+        assert [record['model'] for record in records] == ['sonnet', 'haiku']
+        assert records[0]['wall_seconds'] == 2.5 and records[0]['retries'] == 1
+
+        with open(f'{tmp_path}/metrics.prom', 'r') as file:
+            metrics = file.read()
+        assert 'resume_sorter_calls_total{model="sonnet"} 1' in metrics
+        assert 'resume_sorter_tokens_total{model="haiku",kind="cache_read_input_tokens"} 2000' in metrics
+        assert 'resume_sorter_retries_total{model="sonnet"} 1' in metrics
+
+    def test_workers_keep_their_own_metrics(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        os.makedirs('resumes')
+        workers = [Telemetry.for_folder('resumes', worker) for worker in ('host:1', 'host:2')]
+        seen = {}
+        for call, telemetry in enumerate([workers[0], workers[0], workers[1], workers[0]]):
+            telemetry.record('haiku', f'{call}.png', '000-b.png', TOKENS)
+            for worker in ('host_1', 'host_2'):
+                if os.path.exists(f'resumes/metrics-{worker}.prom'):
+                    with open(f'resumes/metrics-{worker}.prom', 'r') as file:
+                        calls = [line for line in file if line.startswith('resume_sorter_calls_total')]
+                    # Another worker's call never resets this one's counter
+                    assert int(calls[0].split()[-1]) >= seen.get(worker, 0)
+                    seen[worker] = int(calls[0].split()[-1])
+
+        assert seen == {'host_1': 3, 'host_2': 1}
+        with open('resumes/metrics-host_2.prom', 'r') as file:
+            assert 'resume_sorter_calls_total{model="haiku",worker="host:2"} 1' in file.read()
+        assert not os.path.exists('resumes/metrics.prom')
+        assert len(read_log('resumes/calls.jsonl')) == 4
+        assert Telemetry.for_folder('resumes', 'host:1').totals['haiku']['calls'] == 3
+
+    def test_totals_survive_a_crash(self, tmp_path):
+        telemetry = Telemetry(f'{tmp_path}/calls.jsonl')
+        telemetry.record('sonnet', 'a.png', '000-b.png', TOKENS)
+        with open(f'{tmp_path}/calls.jsonl', 'a') as file:
+            # Killed halfway through writing a line
+            file.write('{"time": 1, "model": "son')
+
+        restarted = Telemetry(f'{tmp_path}/calls.jsonl')
+        assert restarted.totals['sonnet']['calls'] == 1
+        assert restarted.totals['sonnet']['cost_usd'] == pytest.approx(0.0051)
+
+    def test_summary(self, tmp_path):
+        telemetry = Telemetry(f'{tmp_path}/calls.jsonl')
+        telemetry.record('sonnet', 'a.png', '000-b.png', TOKENS, {'wall_seconds': 2.0})
+        telemetry.record('haiku', 'a.png', '001-c.png', TOKENS, {'wall_seconds': 1.0})
+        telemetry.record('haiku', 'd.png', '001-c.png', TOKENS, {'wall_seconds': 1.0})
+
+        resumes = summary(f'{tmp_path}/calls.jsonl')
+        assert resumes['a.png']['calls'] == {'sonnet': 1, 'haiku': 1}
+        assert resumes['a.png']['wall_seconds'] == pytest.approx(3.0)
+        assert resumes['d.png']['cost_usd'] == pytest.approx(0.000435)
+
+class TestSorterTelemetry:
+
+    @pytest.fixture(autouse=True)
+    def setup(self, resume_folder, monkeypatch):
+        self.resume_folder = resume_folder
+        monkeypatch.setattr(BatchInsertion, '_wait', lambda self: None)
+        with MessagesStub(respond) as self.stub:
+            # Also reaches the client the concurrent comparer makes
+            monkeypatch.setenv('ANTHROPIC_BASE_URL', self.stub.url)
+            yield
+
+    @pytest.mark.parametrize('insert_all_kwargs', [{}, {'concurrency': 4}, {'offline': True}])
+    def test_every_call_is_logged(self, insert_all_kwargs):
+        sorter = ResumeSorter(self.resume_folder, strategy='binary')
+        sorter.insert_all(**insert_all_kwargs)
+
+        records = read_log(f'./{self.resume_folder}/calls.jsonl')
+        assert len(records) == len(self.stub.requests)
+        assert {record['to_be_ranked'] for record in records} <= set(UNRANKED)
+        assert all(record['batch'] == bool(insert_all_kwargs.get('offline')) for record in records)
+        assert all(record['cost_usd'] > 0 for record in records)
+
+        with open(f'./{self.resume_folder}/metrics.prom', 'r') as file:
+            calls = [line for line in file if line.startswith('resume_sorter_calls_total')]
+        assert sum(int(line.split()[-1]) for line in calls) == len(records)
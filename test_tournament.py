@@ -0,0 +1,65 @@
+import itertools
+import json
+import os
+import anthropic
+import pytest
+from anthropic_stub import MessagesStub
+from conftest import respond
+from resume_sorter import ResumeSorter
+from tournament import merge_sort_network, estimate_insert_all
+
+NAMES = ['b.png', 'd.png', 'e.png', 'g.png', 'j.png', 'l.png', 'o.png', 'r.png', 's.png', 'v.png', 'y.png']
+
+class TestMergeSortNetwork:
+
+    @pytest.mark.parametrize('num_items', range(1, 11))
+    def test_sorts_every_zero_one_sequence(self, num_items):
+        # A comparator network that sorts every sequence of 0s and 1s sorts everything
+        network = merge_sort_network(num_items)
+        for bits in itertools.product([0, 1], repeat=num_items):
+            values = list(bits)
+            for comparators in network:
+                for i, j in comparators:
+                    if values[j] < values[i]:
+                        values[i], values[j] = values[j], values[i]
+            assert values == sorted(values)
+
+    def test_rounds_are_independent(self):
+        for comparators in merge_sort_network(100):
+            positions = [position for comparator in comparators for position in comparator]
+            assert len(positions) == len(set(positions))
+            assert all(i < j < 100 for i, j in comparators)
+
+    def test_rounds_grow_with_log_squared(self):
+        # 9 * 10 / 2 rounds for 512, and for anything padded up to it
+        assert len(merge_sort_network(500)) == 45
+        calls, rounds = estimate_insert_all(500)
+        assert rounds > 50 * len(merge_sort_network(500))
+
+class TestTournament:
+
+    @pytest.fixture(autouse=True)
+    def setup(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        for folder in ('ranked', 'unranked', 'storage'):
+            os.makedirs(f'tournament_resumes/{folder}')
+        for name in reversed(NAMES):
+            with open(f'tournament_resumes/unranked/{name}', 'wb') as file:
+                file.write(name.encode('utf-8'))
+        with open('tournament_resumes/usage.json', 'w') as file:
+            json.dump({'num_calls': {'haiku': 0, 'sonnet': 0}}, file)
+
+        with MessagesStub(respond) as self.stub:
+            yield
+
+    def test_tournament_all(self):
+        sorter = ResumeSorter('tournament_resumes')
+        sorter.resume_comparer.client = anthropic.Anthropic(base_url=self.stub.url, api_key='test', max_retries=0)
+        report = sorter.tournament_all(max_concurrency=4)
+
+        assert sorted(os.listdir('./tournament_resumes/ranked')) == [f'{rank:03}-{name}' for rank, name in enumerate(NAMES)]
+        assert report['rounds'] == len(merge_sort_network(len(NAMES)))
+        assert report['comparisons'] == sum(len(comparators) for comparators in merge_sort_network(len(NAMES)))
+        # A pair that meets twice is answered from the comparison store the second time
+        assert report['calls'] == len(self.stub.requests) <= report['comparisons']
+        assert report['insert_all_calls'] > 0
@@ -0,0 +1,69 @@
+import os
+import pytest
+from anthropic_stub import MessagesStub
+from conftest import respond
+from resume_sorter import ResumeSorter
+from verdict_graph import VerdictGraph
+
+class TestVerdictGraph:
+
+    def test_chain_is_inferred(self):
+        graph = VerdictGraph()
+        graph.add('a', 'b', True, 'sonnet', 3)
+        graph.add('c', 'b', False, 'sonnet', 3)
+
+        a_wins, confidence, chain = graph.infer('a', 'c')
+        assert a_wins and chain == ['a', 'b', 'c']
+        assert confidence == pytest.approx(graph.confidence('a', 'b') * graph.confidence('b', 'c'))
+        assert graph.infer('c', 'a')[0] is False
+        assert graph.reachable('a') == {'b': pytest.approx(graph.confidence('a', 'b')), 'c': pytest.approx(confidence)}
+
+    def test_weak_chain_is_not_inferred(self):
+        graph = VerdictGraph()
+        graph.add('a', 'b', True, 'haiku')
+        graph.add('b', 'c', True, 'haiku')
+        assert graph.infer('a', 'c') is None
+        assert graph.best_chain('a', 'c', 0.5)[1] == ['a', 'b', 'c']
+
+    def test_contested_pair_is_asked(self):
+        graph = VerdictGraph()
+        graph.add('a', 'b', True, 'sonnet', 3)
+        graph.add('b', 'c', True, 'sonnet', 3)
+        # A cycle: c -> a
+        graph.add('c', 'a', True, 'haiku')
+        assert graph.infer('a', 'c') is None
+
+    def test_contradicting_verdicts_cancel(self):
+        graph = VerdictGraph()
+        graph.add('a', 'b', True, 'sonnet')
+        graph.add('a', 'b', False, 'sonnet')
+        assert graph.confidence('a', 'b') == pytest.approx(0.5)
+        assert graph.infer('a', 'b') is None
+
+class TestTransitivity:
+
+    @pytest.fixture(autouse=True)
+    def setup(self, resume_folder, monkeypatch):
+        self.resume_folder = resume_folder
+        with MessagesStub(respond) as self.stub:
+            monkeypatch.setenv('ANTHROPIC_BASE_URL', self.stub.url)
+            yield
+
+    def test_implied_comparisons_are_skipped(self):
+        sorter = ResumeSorter(self.resume_folder, transitivity=True)
+        image_hash = sorter.resume_comparer.image_hash
+        # a.png beat c.png, and c.png beat m.png (the median), both by Sonnet best of 3
+        graph = sorter.verdict_graph
+        graph.add(image_hash(False, 'a.png'), image_hash(True, '000-c.png'), True, 'sonnet', 3)
+        graph.add(image_hash(True, '000-c.png'), image_hash(True, '001-m.png'), True, 'sonnet', 3)
+
+        sorter.insert('a.png')
+        assert self.stub.requests == []
+        assert '000-a.png' in os.listdir(f'./{self.resume_folder}/ranked')
+        assert graph.report() == {'verdicts': 2, 'inferred': 2, 'calls_skipped': 3}
+
+    def test_verdicts_are_added(self):
+        sorter = ResumeSorter(self.resume_folder, transitivity=True)
+        sorter.insert('d.png')
+        assert sorter.verdict_graph.num_inferred == 0
+        assert sorter.verdict_graph.num_verdicts == len(sorter.comparisons) > 0
@@ -0,0 +1,103 @@
+from rank_search import BinaryInsertionSearch, merge_sort_network
+
+def estimate_insert_all(num_resumes):
+    """
+    Calls and rounds (comparisons that have to wait for the previous one) that
+    `ResumeSorter.insert_all()` with strategy='binary' needs for `num_resumes`
+    resumes, assuming every vote agrees. One resume at a time, so each call is its
+    own round, apart from the votes of a best of n, which go out together.
+    """
+    calls, rounds = 0, 0
+    for num_ranked in range(1, num_resumes):
+        search = BinaryInsertionSearch(num_ranked)
+        target = num_ranked // 2
+        while (step := search.next_step()) is not None:
+            calls += (step.n + 1) // 2
+            rounds += 1
+            search.record(step.rank >= target)
+    return calls, rounds
+
+class Tournament:
+    """
+    Ranks resumes with a sorting network (see `merge_sort_network`), so that every
+    comparison in a round is independent of the others. Each round is sent as one
+    concurrent wave through `LLMResumeComparer`, which makes the wall time depend
+    on the number of rounds (O(log^2 n)) rather than the number of comparisons.
+
+    The network makes more comparisons than binary insertion (O(n log^2 n) against
+    O(n log n)); `report()` puts the two side by side.
+
+    Parameters:
+    - resume_comparer (LLMResumeComparer): makes the comparisons, with its `model`.
+    - items (list): (filename, is_ranked) pairs; `is_ranked` says which folder the file is in.
+    - max_concurrency (int): most requests in flight at once.
+    - max_attempts (int): times a comparison is asked when Claude does not state a winner;
+        after that the two resumes keep their order.
+    """
+    def __init__(self, resume_comparer, items, max_concurrency=16, max_attempts=3):
+        self.resume_comparer = resume_comparer
+        self.items = list(items)
+        self.max_concurrency = max_concurrency
+        self.max_attempts = max_attempts
+
+        self.images = [{'filename': filename, **resume_comparer.get_image(is_ranked, filename)}
+                       for filename, is_ranked in self.items]
+
+        self.num_calls = 0
+        self.num_comparisons = 0
+        self.rounds = 0
+
+    def run(self):
+        """Returns the order as (filename, is_ranked) pairs, best first."""
+        # position -> index into `items`
+        order = list(range(len(self.items)))
+        network = merge_sort_network(len(self.items))
+
+        for comparators in network:
+            self.rounds += 1
+            winners = self._compare(order, comparators)
+            for (i, j), lower_wins in zip(comparators, winners):
+                if lower_wins:
+                    order[i], order[j] = order[j], order[i]
+            print(f'Round {self.rounds}/{len(network)}: {len(comparators)} comparisons')
+
+        return [self.items[index] for index in order]
+
+    def _compare(self, order, comparators):
+        """For each comparator (i, j): does the resume at position j beat the one at position i?"""
+        # Votes as (resumes, to_be_ranked_is_A, sample); the resume at j plays the one being ranked
+        votes = []
+        for i, j in comparators:
+            resumes = {'Resume A': self.images[order[i]], 'Resume B': self.images[order[j]]}
+            votes.append(self.resume_comparer._fixed_labels(resumes))
+
+        winners = [None] * len(votes)
+        undecided = list(range(len(votes)))
+        for attempt in range(self.max_attempts):
+            calls_before = sum(self.resume_comparer.num_calls.values())
+            comparisons = self.resume_comparer._cast_votes([(*votes[v], attempt) for v in undecided],
+                                                           max_workers=self.max_concurrency)
+            self.num_calls += sum(self.resume_comparer.num_calls.values()) - calls_before
+
+            for v, comparison in zip(undecided, comparisons):
+                if comparison['winner'] is not None:
+                    winners[v] = comparison['winner'] == comparison['to_be_ranked_resume']
+            undecided = [v for v in undecided if winners[v] is None]
+            if not undecided:
+                break
+
+        self.num_comparisons += len(votes)
+        return [bool(winner) for winner in winners]
+
+    def report(self):
+        """Calls and rounds used, next to the `insert_all()` estimate for the same folder."""
+        insert_all_calls, insert_all_rounds = estimate_insert_all(len(self.items))
+        report = {'resumes': len(self.items),
+                  'comparisons': self.num_comparisons,
+                  'calls': self.num_calls,
+                  'rounds': self.rounds,
+                  'insert_all_calls': insert_all_calls,
+                  'insert_all_rounds': insert_all_rounds}
+        print(f"tournament: {report['calls']} calls in {report['rounds']} rounds; "
+              f"insert_all would take about {insert_all_calls} calls in {insert_all_rounds} rounds")
+        return report
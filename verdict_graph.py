@@ -0,0 +1,173 @@
+import heapq
+import math
+from cascade_policy import majority_accuracy
+
+class VerdictGraph:
+    """
+    Every verdict seen so far, as a directed graph over resumes (by SHA-256 of the
+    file): an edge X -> Y means the evidence says X is better than Y.
+
+    Each verdict counts with the log-odds of being right: a best of n with `model`
+    is right with probability `majority_accuracy(VOTE_ACCURACY[model], n)`. Verdicts
+    on the same pair add up, and contradicting ones cancel. The edge points the way
+    the sum leans, with confidence sigmoid(sum).
+
+    `infer(x, y)` looks for the most confident chain X -> ... -> Y, whose confidence
+    is the product of its edges' (Dijkstra on -log confidence, pruned at `threshold`).
+    The verdict is inferred when that chain reaches `threshold` and there is no chain
+    at all the other way with confidence above one half. A cycle means the evidence is
+    contested, so the pair is asked instead. Adding a verdict is O(1); a query only
+    explores chains that could still reach the threshold.
+
+    Parameters:
+    - threshold (float): confidence an inferred verdict needs.
+    """
+    # Chance that one vote is right, as `CascadePolicy` assumes for Sonnet and its agreement prior for Haiku
+    VOTE_ACCURACY = {'sonnet': 0.95, 'haiku': 0.8}
+
+    def __init__(self, threshold=0.95):
+        self.threshold = threshold
+        # hash -> {hash: log-odds that the first beats the second}; kept for both directions
+        self.evidence = {}
+        # hash -> a filename it was seen under, for messages
+        self.names = {}
+
+        self.num_verdicts = 0
+        self.num_inferred = 0
+        self.calls_skipped = 0
+
+    @classmethod
+    def from_store(cls, store, prompt_hash, hashes=None, **graph_kwargs):
+        """
+        A graph of every vote in the `ComparisonStore` made with `prompt_hash`, each a
+        best of 1; only those between resumes in `hashes`, if given.
+        """
+        graph = cls(**graph_kwargs)
+        if store is not None:
+            for a_hash, b_hash, model, _, winner in store.verdicts(prompt_hash):
+                if hashes is None or (a_hash in hashes and b_hash in hashes):
+                    graph.add(a_hash, b_hash, winner == 'Resume A', model)
+        return graph
+
+    def add(self, x, y, x_won, model, n=1):
+        """Add a best of `n` with `model` between resumes `x` and `y` (hashes) that `x` won if `x_won`."""
+        if x == y:
+            return
+        accuracy = majority_accuracy(self.VOTE_ACCURACY.get(model, 0.8), n)
+        weight = math.log(accuracy / (1 - accuracy))
+        if not x_won:
+            weight = -weight
+        x_evidence, y_evidence = self.evidence.setdefault(x, {}), self.evidence.setdefault(y, {})
+        x_evidence[y] = x_evidence.get(y, 0.0) + weight
+        y_evidence[x] = y_evidence.get(x, 0.0) - weight
+        self.num_verdicts += 1
+
+    def confidence(self, x, y):
+        """Confidence that `x` beats `y` from their direct verdicts alone (0.5 if there are none)."""
+        return 1 / (1 + math.exp(-self.evidence.get(x, {}).get(y, 0.0)))
+
+    def best_chain(self, x, y, min_confidence):
+        """
+        The most confident chain x -> ... -> y, as (confidence, [x, ..., y]), if one
+        reaches `min_confidence`; otherwise None.
+        """
+        costs, previous = self._search(x, min_confidence, target=y)
+        if y == x or y not in costs:
+            return None
+        chain = [y]
+        while chain[-1] != x:
+            chain.append(previous[chain[-1]])
+        return math.exp(-costs[y]), chain[::-1]
+
+    def reachable(self, x, min_confidence=None):
+        """Closure query: {hash: confidence} of every resume `x` beats through a chain at least that confident."""
+        costs, _ = self._search(x, self.threshold if min_confidence is None else min_confidence)
+        return {node: math.exp(-cost) for node, cost in costs.items() if node != x}
+
+    def _search(self, x, min_confidence, target=None):
+        """Dijkstra from `x` on -log(confidence), pruned at `min_confidence`. Returns (costs, previous)."""
+        costs, previous = {x: 0.0}, {}
+        if x not in self.evidence:
+            return costs, previous
+        max_cost = -math.log(min_confidence)
+        queue = [(0.0, x)]
+        while queue:
+            cost, node = heapq.heappop(queue)
+            if node == target:
+                break
+            if cost > costs[node]:
+                continue
+            for other, log_odds in self.evidence[node].items():
+                if log_odds <= 0:
+                    continue
+                other_cost = cost + math.log1p(math.exp(-log_odds))
+                if other_cost <= max_cost and other_cost < costs.get(other, math.inf):
+                    costs[other], previous[other] = other_cost, node
+                    heapq.heappush(queue, (other_cost, other))
+        return costs, previous
+
+    def infer(self, x, y):
+        """
+        (x_wins, confidence, chain) if the graph settles x against y without asking;
+        None if it doesn't, or if the evidence is contested.
+        """
+        for winner, loser in ((x, y), (y, x)):
+            found = self.best_chain(winner, loser, self.threshold)
+            if found is not None and self.best_chain(loser, winner, 0.5) is None:
+                confidence, chain = found
+                return winner == x, confidence, chain
+        return None
+
+    def cycles(self):
+        """
+        The strongly connected components of more than one resume (Tarjan's algorithm,
+        following the way each pair's evidence leans): every resume in one beats every
+        other through some chain, so their verdicts are intransitive somewhere.
+        """
+        index, low, stack, on_stack, components = {}, {}, [], set(), []
+        for root in self.evidence:
+            if root in index:
+                continue
+            # (node, its remaining successors), in place of recursion
+            path = [(root, iter(self.evidence[root].items()))]
+            index[root] = low[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            while path:
+                node, successors = path[-1]
+                for other, log_odds in successors:
+                    if log_odds <= 0:
+                        continue
+                    if other not in index:
+                        index[other] = low[other] = len(index)
+                        stack.append(other)
+                        on_stack.add(other)
+                        path.append((other, iter(self.evidence[other].items())))
+                        break
+                    if other in on_stack:
+                        low[node] = min(low[node], index[other])
+                else:
+                    path.pop()
+                    if path:
+                        low[path[-1][0]] = min(low[path[-1][0]], low[node])
+                    if low[node] == index[node]:
+                        component = []
+                        while True:
+                            member = stack.pop()
+                            on_stack.discard(member)
+                            component.append(member)
+                            if member == node:
+                                break
+                        if len(component) > 1:
+                            components.append(component)
+        return components
+
+    def describe(self, chain):
+        return ' > '.join(self.names.get(node, node[:8]) for node in chain)
+
+    def report(self):
+        """Prints and returns how many comparisons were inferred instead of asked."""
+        report = {'verdicts': self.num_verdicts, 'inferred': self.num_inferred, 'calls_skipped': self.calls_skipped}
+        print(f"transitivity: {report['inferred']} comparisons inferred from {report['verdicts']} verdicts, "
+              f"about {report['calls_skipped']} calls skipped")
+        return report